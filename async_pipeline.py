@@ -0,0 +1,135 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+
+from settings import load_settings
+from sync_cursor import device_key
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+class AsyncSyncPipeline:
+    """Bucle asyncio propio que encadena lectura de dispositivos y envío a la nube por etapas.
+
+    pyzk y el cliente HTTP son bloqueantes: cada etapa corre en un pool de hilos acotado y el
+    bucle solo coordina (concurrencia, límites de tiempo, cancelación y la cola entre etapas).
+    """
+
+    def __init__(self, read_stage, upload_stage, log=print, settings=None):
+        # read_stage(device, incremental, connect_timeout, force, **read_options) -> estadísticas de lectura
+        # upload_stage(device_id) -> (enviados, pendientes)
+        self.read_stage = read_stage
+        self.upload_stage = upload_stage
+        self.log = log
+        self.settings = settings or load_settings()
+        self.max_workers = max(1, int(self.settings['sync_max_workers']))
+        self.upload_workers = max(1, int(self.settings['pipeline_upload_workers']))
+        self.queue_size = max(1, int(self.settings['pipeline_queue_size']))
+        self._device_executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='zk-device')
+        self._upload_executor = ThreadPoolExecutor(max_workers=self.upload_workers, thread_name_prefix='zk-upload')
+        # Tareas por dispositivo de la sincronización en curso (para cancelarlas por separado)
+        self._tasks = {}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, daemon=True, name='zk-pipeline')
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def sync(self, devices, incremental=True, report=None, timeout=None, connect_timeout=None, force=False,
+             read_options=None):
+        """Lanzar una sincronización desde cualquier hilo; devuelve un Future cancelable"""
+        report = report or (lambda key, **values: None)
+        read = partial(self.read_stage, **(read_options or {}))
+        coro = self._sync(list(devices), read, report, timeout, connect_timeout, force, incremental)
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def cancel_device(self, key):
+        """Cancelar un dispositivo sin afectar al resto de la sincronización"""
+        def cancel():
+            task = self._tasks.get(key)
+            if task is not None:
+                task.cancel()
+        self._loop.call_soon_threadsafe(cancel)
+
+    def run_blocking(self, func, *args):
+        """Ejecutar una operación bloqueante con el dispositivo en el pool de E/S acotado"""
+        return self._device_executor.submit(func, *args)
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._device_executor.shutdown(wait=False, cancel_futures=True)
+        self._upload_executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _sync(self, devices, read, report, timeout, connect_timeout, force, incremental):
+        timeout = float(timeout or self.settings['device_sync_timeout'])
+        semaphore = asyncio.Semaphore(self.max_workers)
+        # Cola acotada: si la nube va lenta, la lectura de más dispositivos espera
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        uploaders = [asyncio.ensure_future(self._upload_worker(queue, report)) for _ in range(self.upload_workers)]
+        tasks = {
+            device_key(device): asyncio.ensure_future(
+                self._read(device, read, incremental, report, timeout, connect_timeout, force, semaphore, queue))
+            for device in devices
+        }
+        self._tasks.update(tasks)
+        try:
+            # return_exceptions: cancelar un dispositivo no corta la sincronización del resto
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            for _ in uploaders:
+                await queue.put(None)
+            await asyncio.gather(*uploaders)
+        finally:
+            for task in uploaders:
+                task.cancel()
+            for key in tasks:
+                self._tasks.pop(key, None)
+
+    async def _read(self, device, read, incremental, report, timeout, connect_timeout, force, semaphore, queue):
+        key = device_key(device)
+        async with semaphore:
+            report(key, estado='sincronizando', inicio=_now(), nombre=device['name'],
+                   ip=device['ip_address'], error=None)
+            call = partial(read, device, incremental, connect_timeout, force)
+            try:
+                # El hilo bloqueado en pyzk no se puede interrumpir; se deja de esperarlo
+                stats = await asyncio.wait_for(self._loop.run_in_executor(self._device_executor, call), timeout)
+            except asyncio.TimeoutError:
+                report(key, estado='timeout', error=f"Sin respuesta en {timeout:.0f}s", fin=_now())
+                self.log(f"✗ {device['name']} ({device['ip_address']}): tiempo agotado")
+                return
+            except asyncio.CancelledError:
+                report(key, estado='cancelado', fin=_now())
+                raise
+            except Exception as e:
+                report(key, estado='error', error=str(e), fin=_now())
+                self.log(f"✗ {device['name']} ({device['ip_address']}): {str(e)}")
+                return
+
+        report(key, estado='enviando', **stats)
+        try:
+            await queue.put(key)
+        except asyncio.CancelledError:
+            report(key, estado='cancelado', fin=_now())
+            raise
+
+    async def _upload_worker(self, queue, report):
+        while True:
+            key = await queue.get()
+            if key is None:
+                return
+            try:
+                sent, pending = await self._loop.run_in_executor(self._upload_executor, self.upload_stage, key)
+                report(key, estado='ok', registros_enviados=sent, pendientes_envio=pending, fin=_now())
+            except asyncio.CancelledError:
+                report(key, estado='cancelado', fin=_now())
+                raise
+            except Exception as e:
+                # La lectura ya quedó en la cola local; el envío se reintentará en segundo plano
+                report(key, estado='ok', error_envio=str(e), fin=_now())
+                self.log(f"✗ Error enviando registros de {key}: {str(e)}")
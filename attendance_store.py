@@ -0,0 +1,173 @@
+import base64
+import json
+import os
+import sqlite3
+import threading
+
+from records import iter_chunks, parse_window_bound, timestamp_from_key, timestamp_key
+from settings import ATTENDANCE_DB_PATH, load_settings
+
+# Registros insertados por transacción
+STORE_BLOCK_SIZE = 5000
+
+
+def encode_page_token(row):
+    """Posición de la última fila de una página, opaca para el cliente"""
+    return base64.urlsafe_b64encode(json.dumps(row, separators=(',', ':')).encode()).decode()
+
+
+def decode_page_token(token):
+    try:
+        ts, device_id, user_id, uid = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return int(ts), str(device_id), str(user_id), int(uid)
+    except (ValueError, TypeError):
+        raise ValueError("Parámetro 'siguiente' inválido")
+
+
+class AttendanceStore:
+    """Copia local en SQLite de todas las marcaciones leídas, indexada por dispositivo, usuario y hora.
+
+    Las consultas usan una conexión por hilo: en modo WAL leen mientras otra sincronización
+    escribe, sin esperar el candado de escritura.
+    """
+
+    def __init__(self, path=ATTENDANCE_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS attendance (
+                device_id TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                ts INTEGER NOT NULL,
+                uid INTEGER NOT NULL,
+                state INTEGER,
+                type INTEGER,
+                PRIMARY KEY (device_id, ts, user_id, uid)
+            ) WITHOUT ROWID
+        ''')
+        # Clave e índices en el orden de la consulta (hora y desempate): la página sale del índice
+        # sin ordenar, y los registros nuevos, cronológicos, se agregan al final de cada árbol
+        self._db.execute('CREATE INDEX IF NOT EXISTS attendance_ts ON attendance (ts, device_id, user_id, uid)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS attendance_user_ts ON attendance (user_id, ts, device_id, uid)')
+        self._db.commit()
+
+    def _reader(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, check_same_thread=False)
+        return db
+
+    def save(self, device_id, records):
+        """Guardar registros (los repetidos se ignoran); devuelve cuántos eran nuevos"""
+        added = 0
+        for block in iter_chunks(records, STORE_BLOCK_SIZE):
+            added += self._save_block(str(device_id), block)
+        return added
+
+    def iter_save(self, device_id, records):
+        """Guardar los registros a medida que pasan, sin cortar el streaming hacia la cola"""
+        device_id = str(device_id)
+        for block in iter_chunks(records, STORE_BLOCK_SIZE):
+            self._save_block(device_id, block)
+            yield from block
+
+    def _save_block(self, device_id, block):
+        rows = [(device_id, str(r['id']), timestamp_key(r['timestamp']), int(r['uid']), r['state'], r['type'])
+                for r in block]
+        with self._lock:
+            before = self._db.total_changes
+            self._db.executemany(
+                'INSERT OR IGNORE INTO attendance (device_id, user_id, ts, uid, state, type) '
+                'VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._db.commit()
+            return self._db.total_changes - before
+
+    def query(self, user_id=None, device_id=None, since=None, until=None, limit=100, after=None):
+        """Marcaciones en orden cronológico; devuelve (registros, token de la página siguiente o None)"""
+        where = []
+        params = []
+        if user_id is not None:
+            where.append('user_id = ?')
+            params.append(str(user_id))
+        if device_id is not None:
+            where.append('device_id = ?')
+            params.append(str(device_id))
+        if since is not None:
+            where.append('ts >= ?')
+            params.append(timestamp_key(since))
+        if until is not None:
+            where.append('ts <= ?')
+            params.append(timestamp_key(until))
+        if after is not None:
+            # Paginación por posición: cada página cuesta lo mismo sin importar cuán lejos esté
+            where.append('(ts, device_id, user_id, uid) > (?, ?, ?, ?)')
+            params.extend(after)
+        sql = 'SELECT ts, device_id, user_id, uid, state, type FROM attendance'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY ts, device_id, user_id, uid LIMIT ?'
+        params.append(limit + 1)
+        rows = self._reader().execute(sql, params).fetchall()
+
+        page = rows[:limit]
+        records = [{'dispositivo': device, 'uid': uid, 'id': user, 'timestamp': timestamp_from_key(ts),
+                    'state': state, 'type': punch} for ts, device, user, uid, state, punch in page]
+        next_token = encode_page_token(list(page[-1][:4])) if len(rows) > limit else None
+        return records, next_token
+
+    def count(self, device_id=None):
+        if device_id is None:
+            row = self._reader().execute('SELECT COUNT(*) FROM attendance').fetchone()
+        else:
+            row = self._reader().execute('SELECT COUNT(*) FROM attendance WHERE device_id = ?',
+                                         (str(device_id),)).fetchone()
+        return row[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def open_store(log=print, settings=None):
+    """AttendanceStore si está activado en la configuración (attendance_store), si no None"""
+    settings = settings or load_settings()
+    if not settings['attendance_store']:
+        return None
+    try:
+        return AttendanceStore()
+    except sqlite3.Error as e:
+        log(f"ADVERTENCIA: No se pudo abrir la copia local de asistencias: {e}")
+        return None
+
+
+def register_attendance_routes(app, store, settings=None):
+    """Ruta /asistencias de la API local: consulta la copia local sin tocar el dispositivo"""
+    from flask import jsonify, request
+
+    settings = settings or load_settings()
+    default_limit = int(settings['attendance_page_size'])
+    max_limit = int(settings['attendance_page_max'])
+
+    @app.route('/asistencias', methods=['GET'])
+    def asistencias():
+        # ?user_id=1001&desde=2024-05-01&hasta=2024-05-31&dispositivo=1&limite=100&siguiente=<token>
+        if store is None:
+            return jsonify({'error': 'La copia local de asistencias está desactivada'}), 404
+        try:
+            limit = int(request.args.get('limite', default_limit))
+            token = request.args.get('siguiente')
+            records, next_token = store.query(
+                user_id=request.args.get('user_id') or None,
+                device_id=request.args.get('dispositivo') or None,
+                since=parse_window_bound(request.args.get('desde')),
+                until=parse_window_bound(request.args.get('hasta'), end=True),
+                limit=max(1, min(limit, max_limit)),
+                after=decode_page_token(token) if token else None)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'asistencias': records, 'cantidad': len(records), 'siguiente': next_token})
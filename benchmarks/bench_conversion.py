@@ -0,0 +1,91 @@
+"""Benchmark de conversión de asistencias: lista de dicts (antes) vs. streaming compacto (después).
+
+Uso: python benchmarks/bench_conversion.py [cantidad]
+"""
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import encode_record, iter_records  # noqa: E402
+
+try:
+    from zk.attendance import Attendance
+except ImportError:
+    class Attendance:
+        def __init__(self, user_id, timestamp, status, punch=0, uid=0):
+            self.uid = uid
+            self.user_id = user_id
+            self.timestamp = timestamp
+            self.status = status
+            self.punch = punch
+
+
+def make_attendance(count):
+    """Lista como la que devuelve pyzk get_attendance()"""
+    start = datetime(2024, 1, 1, 7, 0, 0)
+    return [Attendance(str(1000 + i % 300), start + timedelta(minutes=i), 1, i % 2, 1 + i % 300)
+            for i in range(count)]
+
+
+def convert_before(attendance):
+    """Camino original: segunda lista completa de dicts con strftime"""
+    attendance_data = []
+    for record in attendance:
+        attendance_data.append({
+            'uid': record.uid,
+            'id': record.user_id,
+            'timestamp': record.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+            'state': record.status,
+            'type': record.punch
+        })
+    encoded = 0
+    for record in attendance_data:
+        encoded += len(encode_record(record))
+    return encoded
+
+
+def convert_after(attendance):
+    """Camino nuevo: generador de registros con __slots__ directo al codificador"""
+    encoded = 0
+    for record in iter_records(attendance):
+        encoded += len(encode_record(record))
+    return encoded
+
+
+def measure(name, func, count):
+    # Tiempo sin tracemalloc (que penaliza cada asignación) y memoria en una segunda pasada
+    attendance = make_attendance(count)
+    gc.collect()
+    started = time.perf_counter()
+    encoded = func(attendance)
+    elapsed = time.perf_counter() - started
+    del attendance
+
+    attendance = make_attendance(count)
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    func(attendance)
+    peak = max(0, tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+    del attendance
+
+    print(f"{name:<8} {count:>8} registros  {elapsed:7.3f}s  pico +{peak / 1024 / 1024:7.2f} MB  ({encoded} bytes JSON)")
+    return elapsed, peak
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    before = measure('antes', convert_before, count)
+    after = measure('después', convert_after, count)
+    print(f"Tiempo: {before[0] / after[0]:.2f}x  |  "
+          f"Memoria pico adicional: {before[1] / 1024 / 1024:.2f} MB -> {after[1] / 1024 / 1024:.2f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""Extremo a extremo: extracción del dispositivo -> cola local -> envío a la API, sin hardware.
+
+Por cada volumen levanta el dispositivo simulado (sim_device.py) y la API simulada
+(mock_api.py) en procesos aparte y ejecuta en otro proceso las mismas etapas que la
+aplicación: SyncEngine.sync_device (lectura con pyzk, conversión y cola) y
+SyncEngine.upload_device (envío por lotes). Verifica que la API recibió todos los registros.
+
+Cada corrida se agrega a benchmarks/results/e2e.jsonl. Con --save-baseline se guarda como
+referencia y las corridas siguientes se comparan contra ella: si una etapa es más lenta que
+la referencia por encima de --tolerance, se marca REGRESIÓN y el proceso sale con código 1.
+
+Uso: python benchmarks/bench_e2e.py [1000,100000,1000000] [--latency S] [--loss P]
+                                    [--api-latency S] [--fail-rate P] [--save-baseline] [--tolerance 0.2]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(ROOT, 'benchmarks')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+HISTORY_PATH = os.path.join(RESULTS_DIR, 'e2e.jsonl')
+BASELINE_PATH = os.path.join(RESULTS_DIR, 'baseline_e2e.json')
+
+STAGES = ('extraccion', 'envio', 'total')
+
+# Diferencias menores no cuentan como regresión (ruido de corridas cortas)
+MIN_REGRESSION_SECONDS = 0.05
+
+
+def run_stages(count, device_port, api_port):
+    """Proceso de medición: las dos etapas del pipeline contra los simuladores"""
+    sys.path.insert(0, ROOT)
+    from device_pool import DeviceConnectionPool
+    from http_client import HttpClient
+    from outbox import Outbox, OutboxDrainer
+    from settings import load_settings
+    from sync_cursor import SyncCursor, device_key
+    from sync_engine import SyncEngine
+    from uploader import CloudUploader
+
+    quiet = lambda message: None  # noqa: E731
+    settings = dict(load_settings(), api_base_url=f'http://127.0.0.1:{api_port}/')
+    device = {'id': 'bench', 'name': 'Simulador', 'ip_address': '127.0.0.1', 'port': device_port}
+    workdir = tempfile.mkdtemp(prefix='zk-e2e-')
+    outbox = Outbox(os.path.join(workdir, 'outbox.db'))
+    cursor = SyncCursor(os.path.join(workdir, 'sync_cursor.json'))
+    uploader = CloudUploader(log=quiet, settings=settings, client=HttpClient(settings))
+    drainer = OutboxDrainer(outbox, uploader, cursor, log=quiet, settings=settings)
+    pool = DeviceConnectionPool(log=quiet, settings=settings)
+    engine = SyncEngine(outbox, drainer, cursor, devices=[device], pool=pool, log=quiet, settings=settings)
+
+    started = time.perf_counter()
+    stats = engine.sync_device(device, incremental=True, connect_timeout=60, force=True)
+    extracted = time.perf_counter()
+    sent, pending = engine.upload_device(device_key(device))
+    finished = time.perf_counter()
+    pool.close_all()
+
+    result = {
+        'registros': count,
+        'leidos': stats['registros_leidos'],
+        'encolados': stats['registros_encolados'],
+        'enviados': sent,
+        'pendientes': pending,
+        'extraccion': round(extracted - started, 3),
+        'envio': round(finished - extracted, 3),
+        'total': round(finished - started, 3),
+    }
+    try:
+        import resource
+        # ru_maxrss: KB en Linux
+        result['memoria_max_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    except ImportError:
+        pass
+    print(json.dumps(result))
+
+
+def start_helper(script, *args):
+    """Lanzar un simulador y leer el puerto que eligió (primera línea de su salida)"""
+    process = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, script), *args],
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    port = int(process.stdout.readline())
+    return process, port
+
+
+def run_size(count, options):
+    sim_args = ['--port', '0', '--latency', options['--latency'], '--loss', options['--loss']]
+    device, device_port = start_helper('sim_device.py', str(count), *sim_args)
+    api, api_port = start_helper('mock_api.py', '--port', '0', '--latency', options['--api-latency'],
+                                 '--fail-rate', options['--fail-rate'])
+    try:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--run', str(count),
+                                 str(device_port), str(api_port)],
+                                capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        import requests
+        received = requests.get(f'http://127.0.0.1:{api_port}/stats', timeout=10).json()
+        result['recibidos'] = received['unicos']
+        result['peticiones'] = received['peticiones']
+        result['mb_enviados'] = round(received['bytes'] / 1024 / 1024, 2)
+        return result
+    finally:
+        for process in (device, api):
+            process.terminate()
+            process.wait()
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def report(result, baseline, tolerance):
+    """Imprimir una fila y devolver las etapas que empeoraron respecto de la referencia"""
+    count = result['registros']
+    ok = result['recibidos'] == count and result['pendientes'] == 0
+    rate = count / result['total'] if result['total'] else 0
+    print(f"  {count:>9,} reg   extracción {result['extraccion']:8.2f} s   envío {result['envio']:8.2f} s   "
+          f"total {result['total']:8.2f} s   {rate:9,.0f} reg/s   {result.get('memoria_max_mb', '-')} MB   "
+          f"{'OK' if ok else 'INCOMPLETO (' + str(result['recibidos']) + ' recibidos)'}")
+    previous = baseline.get(str(count))
+    regressions = []
+    if previous:
+        for stage in STAGES:
+            if previous[stage] and result[stage] > previous[stage] * (1 + tolerance) \
+                    and result[stage] - previous[stage] > MIN_REGRESSION_SECONDS:
+                regressions.append(f"{stage} {previous[stage]:.2f} s -> {result[stage]:.2f} s "
+                                   f"(+{(result[stage] / previous[stage] - 1) * 100:.0f}%)")
+        for line in regressions:
+            print(f"      REGRESIÓN {line}")
+    if not ok:
+        regressions.append('registros incompletos')
+    return regressions
+
+
+def main():
+    args = sys.argv[1:]
+    if args and args[0] == '--run':
+        run_stages(int(args[1]), int(args[2]), int(args[3]))
+        return
+
+    options = {'--latency': '0', '--loss': '0', '--api-latency': '0', '--fail-rate': '0', '--tolerance': '0.2'}
+    for name in options:
+        if name in args:
+            index = args.index(name)
+            options[name] = args[index + 1]
+            del args[index:index + 2]
+    save_baseline = '--save-baseline' in args
+    if save_baseline:
+        args.remove('--save-baseline')
+    sizes = [int(size) for size in (args[0] if args else '1000,100000,1000000').split(',')]
+    tolerance = float(options['--tolerance'])
+
+    run_options = {k.lstrip('-'): v for k, v in options.items() if k != '--tolerance'}
+    baseline = {}
+    if os.path.exists(BASELINE_PATH) and not save_baseline:
+        with open(BASELINE_PATH, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+        # Solo es comparable una referencia medida con la misma latencia, pérdida y fallos
+        if saved['opciones'] == run_options:
+            baseline = saved['resultados']
+        else:
+            print(f"Referencia con otras opciones ({saved['opciones']}); no se compara")
+
+    print(f"Extremo a extremo (latencia dispositivo {options['--latency']} s, pérdida {options['--loss']}, "
+          f"latencia API {options['--api-latency']} s, fallos API {options['--fail-rate']})")
+    results = []
+    regressions = []
+    for count in sizes:
+        result = run_size(count, options)
+        results.append(result)
+        regressions.extend(report(result, baseline, tolerance))
+
+    run = {'fecha': datetime.now().isoformat(timespec='seconds'), 'revision': git_revision(),
+           'opciones': run_options, 'resultados': results}
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(HISTORY_PATH, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(run) + '\n')
+    if save_baseline:
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(dict(run, resultados={str(r['registros']): r for r in results}), f, indent=2)
+        print(f"Referencia guardada en {os.path.relpath(BASELINE_PATH, ROOT)}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""Bytes por formato de envío: JSON original vs. columnar, sin comprimir y con gzip/zstd.
+
+Uso: python benchmarks/bench_payload.py [cantidad] [tamaño_lote]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_conversion import make_attendance  # noqa: E402
+from records import iter_chunks, iter_records  # noqa: E402
+from uploader import ZSTD_AVAILABLE, compress_body, encode_chunk  # noqa: E402
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    chunks = list(iter_chunks(iter_records(make_attendance(count)), batch_size))
+
+    codecs = [None, 'gzip'] + (['zstd'] if ZSTD_AVAILABLE else [])
+    baseline = None
+    print(f"{count} registros en lotes de {batch_size}")
+    for payload_format in ('json', 'columnar'):
+        for codec in codecs:
+            started = time.perf_counter()
+            total = sum(len(compress_body(encode_chunk(chunk, payload_format), codec)) for chunk in chunks)
+            elapsed = time.perf_counter() - started
+            baseline = baseline or total
+            name = payload_format + ('+' + codec if codec else '')
+            print(f"  {name:<15} {total / 1024:10.1f} KB  {100 * total / baseline:6.1f}%  {elapsed:6.3f}s")
+    if not ZSTD_AVAILABLE:
+        print("  (zstd no disponible: pip install zstandard)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Tiempo de arranque de la interfaz: hasta la ventana dibujada y hasta los servicios listos.
+
+Mide desde que se lanza el proceso (incluye el intérprete o el desempaquetado de PyInstaller).
+Requiere escritorio: la ventana se abre y se cierra sola en cada corrida.
+
+Uso: python benchmarks/bench_startup.py [corridas] [--exe dist/ZKTeco-Sync.exe]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PARAMS = json.dumps({'id': 'bench', 'name': 'Benchmark', 'ip_address': '127.0.0.1', 'port': 4370})
+
+
+def run_once(command, timeout=60):
+    fd, marks_path = tempfile.mkstemp(suffix='.jsonl')
+    os.close(fd)
+    env = dict(os.environ, ZKTECO_STARTUP_BENCH=marks_path)
+    try:
+        started = time.time()
+        subprocess.run(command + ['--params-system', PARAMS], cwd=ROOT, env=env, timeout=timeout,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        with open(marks_path, 'r', encoding='utf-8') as f:
+            marks = [json.loads(line) for line in f if line.strip()]
+        return {mark['etapa']: mark['t'] - started for mark in marks}
+    finally:
+        os.remove(marks_path)
+
+
+def main():
+    args = sys.argv[1:]
+    command = [sys.executable, os.path.join(ROOT, 'main.py')]
+    if '--exe' in args:
+        index = args.index('--exe')
+        command = [os.path.abspath(args[index + 1])]
+        del args[index:index + 2]
+    runs = int(args[0]) if args else 5
+
+    print(f"{' '.join(command)} ({runs} corridas)")
+    results = [run_once(command) for _ in range(runs)]
+    for stage in ('ventana', 'servicios'):
+        values = [r[stage] for r in results if stage in r]
+        if not values:
+            print(f"  {stage:<10} sin datos (¿hay escritorio disponible?)")
+            continue
+        print(f"  {stage:<10} mediana {statistics.median(values) * 1000:7.0f} ms   "
+              f"mín {min(values) * 1000:7.0f} ms   máx {max(values) * 1000:7.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Latencia de la API local bajo consultas concurrentes (varias pestañas del portal sondeando).
+
+Sin --url levanta una app de prueba con /estado y /dispositivos en un puerto libre y compara
+el servidor de desarrollo (app.run threaded) con StatusServer. Con --url mide un servidor ya
+en marcha, p. ej. http://127.0.0.1:3322/estado.
+
+Uso: python benchmarks/bench_status_api.py [clientes] [segundos] [--url URL]
+"""
+import logging
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+from flask import Flask, jsonify  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+from status_server import StatusServer  # noqa: E402
+
+
+def make_app():
+    app = Flask(__name__)
+    devices = [{'id': str(i), 'estado': 'ok', 'registros_leidos': 1000 + i} for i in range(20)]
+
+    @app.route('/estado')
+    def estado():
+        return jsonify({'status': 'zkteco activo', 'timestamp': datetime.now().isoformat()})
+
+    @app.route('/dispositivos')
+    def dispositivos():
+        return jsonify({'sincronizando': False, 'dispositivos': devices})
+
+    return app
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def load(urls, clients, seconds):
+    """Cada cliente sondea en bucle con su propia sesión keep-alive, como un navegador"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client(index):
+        session = requests.Session()
+        url = urls[index % len(urls)]
+        local = []
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                session.get(url, timeout=5).raise_for_status()
+                local.append(time.perf_counter() - started)
+            except requests.RequestException:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def report(name, latencies, errors, seconds):
+    if not latencies:
+        print(f"  {name:<22} sin respuestas ({errors} errores)")
+        return
+    ordered = sorted(latencies)
+    p = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000  # noqa: E731
+    print(f"  {name:<22} {len(latencies) / seconds:8.0f} req/s   p50 {statistics.median(ordered) * 1000:6.1f} ms   "
+          f"p95 {p(0.95):6.1f} ms   p99 {p(0.99):6.1f} ms   máx {ordered[-1] * 1000:6.1f} ms   errores {errors}")
+
+
+def main():
+    args = sys.argv[1:]
+    url = None
+    if '--url' in args:
+        index = args.index('--url')
+        url = args[index + 1]
+        del args[index:index + 2]
+    clients = int(args[0]) if args else 50
+    seconds = float(args[1]) if len(args) > 1 else 5
+
+    print(f"{clients} clientes concurrentes durante {seconds:.0f}s")
+    # Sin el log de cada petición de werkzeug
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    if url:
+        report(url, *load([url], clients, seconds), seconds)
+        return
+
+    app = make_app()
+    servers = []
+    port = free_port()
+    servers.append(('werkzeug dev (threaded)', make_server('127.0.0.1', port, app, threaded=True), port))
+    port = free_port()
+    status_server = StatusServer(app, port=port, log=lambda message: None)
+    servers.append((f'StatusServer ({status_server.backend})', status_server, port))
+
+    for name, server, port in servers:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        base = f'http://127.0.0.1:{port}'
+        report(name, *load([base + '/estado', base + '/dispositivos'], clients, seconds), seconds)
+        if isinstance(server, StatusServer):
+            server.stop()
+        else:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Comprobación de regresión de la marca de agua y la cola local con el dispositivo y la API simulados.
+
+Cada escenario envía algo que no cubre todo el log (por ejemplo, una extracción por rango de
+fechas) y después hace una sincronización incremental normal. Verifica que la API termine
+recibiendo todos los registros del dispositivo: si la marca de agua avanzó de más, los
+registros anteriores se pierden para siempre. El escenario de rechazo verifica además que un
+registro que la API rechaza quede apartado (dead_letter) sin bloquear al resto de la cola, y
+el de conciliación que /conciliar no se lance dos veces y que su estado sobreviva a la
+siguiente sincronización.
+
+Uso: python benchmarks/check_cursor.py   (sale con código 1 si algún escenario falla)
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from flask import Flask
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from http_client import HttpClient  # noqa: E402
+from mock_api import MockAttendanceAPI  # noqa: E402
+from live_capture import LiveCapture  # noqa: E402
+from outbox import Outbox, OutboxDrainer  # noqa: E402
+from reconcile import register_reconcile_routes  # noqa: E402
+from records import AttendanceRecord  # noqa: E402
+from settings import load_settings  # noqa: E402
+from sim_device import SimulatedDevice  # noqa: E402
+from sync_cursor import SyncCursor  # noqa: E402
+from sync_engine import SyncEngine  # noqa: E402
+from uploader import CloudUploader  # noqa: E402
+
+# 300 marcaciones, una por minuto desde las 07:00 (hasta las 11:59)
+RECORDS = 300
+
+
+def make_engine(device, api):
+    quiet = lambda message: None  # noqa: E731
+    settings = dict(load_settings(), api_base_url=api.base_url)
+    workdir = tempfile.mkdtemp(prefix='zk-cursor-')
+    outbox = Outbox(os.path.join(workdir, 'outbox.db'))
+    cursor = SyncCursor(os.path.join(workdir, 'sync_cursor.json'))
+    uploader = CloudUploader(log=quiet, settings=settings, client=HttpClient(settings))
+    drainer = OutboxDrainer(outbox, uploader, cursor, log=quiet, settings=settings)
+    return SyncEngine(outbox, drainer, cursor, devices=[device], log=quiet, settings=settings)
+
+
+def windowed_then_incremental(engine, device, api):
+    """Extracción de 09:00 a 10:00 y luego una sincronización incremental"""
+    engine.run_all(since=datetime(2024, 1, 1, 9, 0), until=datetime(2024, 1, 1, 10, 0), force=True)
+    engine.run_all(force=True)
+
+
+def live_then_incremental(engine, device, api):
+    """La última marcación (11:59) llega en tiempo real y se envía antes de la primera sincronización"""
+    capture = LiveCapture(device, engine.outbox, engine.drainer, log=engine.log, settings=engine.settings)
+    capture._buffer.append(AttendanceRecord(RECORDS, str(1000 + RECORDS), '2024-01-01 11:59:00', 1, 1))
+    capture._flush()
+    engine.drainer.drain_device('1')
+    engine.run_all(force=True)
+
+
+def rejected_record(engine, device, api):
+    """La API rechaza (422) el registro del uid 150: se sincroniza hasta agotar sus intentos"""
+    for _ in range(engine.drainer.max_attempts):
+        engine.run_all(force=True)
+
+
+def reconcile_then_incremental(engine, device, api):
+    """La API pierde el 30 %; dos POST /conciliar seguidos (el segundo debe dar 409) y una sincronización"""
+    engine.run_all(force=True)
+    api.forget(0.3)
+    app = Flask(__name__)
+    register_reconcile_routes(app, engine)
+    client = app.test_client()
+    codes = (client.post('/conciliar?dispositivo=1').status_code, client.post('/conciliar?dispositivo=1').status_code)
+    while engine.get_results().get('1', {}).get('conciliacion', {}).get('estado') == 'conciliando':
+        time.sleep(0.05)
+    engine.drainer.drain_device('1')
+    engine.run_all(force=True)
+    state = engine.get_results().get('1', {}).get('conciliacion', {}).get('estado')
+    if codes != (202, 409) or state != 'completado':
+        return f"respuestas {codes}, conciliación '{state}' tras sincronizar"
+
+
+# (nombre, escenario, uid que la API rechaza)
+SCENARIOS = [
+    ('rango de fechas', windowed_then_incremental, ()),
+    ('tiempo real', live_then_incremental, ()),
+    ('registro rechazado', rejected_record, (150,)),
+    ('conciliación', reconcile_then_incremental, ()),
+]
+
+
+def main():
+    failures = 0
+    for name, scenario, rejected in SCENARIOS:
+        simulator = SimulatedDevice(records=RECORDS).start()
+        api = MockAttendanceAPI(reject_uids=rejected).start()
+        try:
+            device = dict(simulator.device, id='1', name='Simulador')
+            engine = make_engine(device, api)
+            error = scenario(engine, device, api)
+            received = api.snapshot()['unicos']
+            pending = engine.outbox.pending_count()
+            dead = engine.outbox.dead_letter_count()
+        finally:
+            simulator.stop()
+            api.stop()
+        # Un registro por uid: cada uid rechazado es un registro que no llega
+        ok = received == RECORDS - len(rejected) and not pending and dead == len(rejected) and not error
+        failures += not ok
+        print(f"{'OK   ' if ok else 'FALLA'} {name}: {received} de {RECORDS} registros en la API, "
+              f"{pending} pendientes, {dead} rechazados{f' ({error})' if error else ''}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    sys.exit(main())
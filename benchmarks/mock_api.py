@@ -0,0 +1,192 @@
+"""API de Laravel simulada: POST /api/zkteco/attendance como la de producción.
+
+Acepta JSON plano o columnar, con o sin gzip/zstd, cuenta los registros únicos recibidos
+(uid + timestamp, igual que la restricción de la tabla) y responde con un mensaje. --latency
+demora cada respuesta y --fail-rate devuelve 503 en esa fracción de lotes para ejercitar los
+reintentos; reject_uids responde 422 a los lotes que contengan esos uid. GET
+/api/zkteco/attendance/summary devuelve el resumen por bucket que usa la conciliación (por
+dispositivo según la cabecera X-ZKTeco-Device). GET /stats devuelve los contadores y POST
+/reset los pone a cero.
+
+Uso: python benchmarks/mock_api.py [--port 8000] [--latency 0] [--fail-rate 0]
+"""
+import gzip
+import json
+import logging
+import os
+import random
+import sys
+import threading
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+from reconcile import BUCKET_PREFIX, summarize
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+ATTENDANCE_ENDPOINT = '/api/zkteco/attendance'
+SUMMARY_ENDPOINT = ATTENDANCE_ENDPOINT + '/summary'
+DEVICE_HEADER = 'X-ZKTeco-Device'
+
+
+def decode_body(body, encoding, content_type):
+    """Registros de un lote según Content-Encoding y Content-Type"""
+    if encoding == 'gzip':
+        body = gzip.decompress(body)
+    elif encoding == 'zstd':
+        body = zstandard.ZstdDecompressor().decompress(body, max_output_size=256 * 1024 * 1024)
+    payload = json.loads(body)
+    if 'columnar' not in (content_type or ''):
+        return payload
+    # Columnar: timestamps como deltas en segundos desde 'base'
+    records = []
+    current = payload['base']
+    for i, delta in enumerate(payload['timestamp']):
+        current += delta
+        record = {field: payload[field][i] for field in payload['fields'] if field != 'timestamp'}
+        record['timestamp'] = datetime(1970, 1, 1) + timedelta(seconds=current)
+        records.append(record)
+    return records
+
+
+class MockAttendanceAPI:
+    """Servidor HTTP local con el endpoint de asistencias y contadores para verificar el envío"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, fail_rate=0.0, seed=0, reject_uids=()):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        # Lotes con alguno de estos uid se responden con 422 (validación de Laravel)
+        self.reject_uids = set(reject_uids)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset()
+        self.app = self._make_app()
+        self._server = make_server(host, port, self.app, threaded=True)
+        self.host = host
+        self.port = self._server.server_port
+
+    @property
+    def base_url(self):
+        """Valor de api_base_url para apuntar la aplicación a este servidor"""
+        return f'http://{self.host}:{self.port}/'
+
+    def reset(self):
+        with self._lock:
+            # (dispositivo, uid, timestamp) -> id de usuario
+            self._records = {}
+            self.stats = {'peticiones': 0, 'rechazadas': 0, 'registros': 0, 'duplicados': 0, 'bytes': 0}
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, unicos=len(self._records))
+
+    def forget(self, fraction, device=None):
+        """Borrar una fracción de los registros guardados (simula pérdidas del lado del servidor)"""
+        with self._lock:
+            keys = sorted(k for k in self._records if device is None or k[0] == device)
+            lost = self._random.sample(keys, int(len(keys) * fraction))
+            for key in lost:
+                del self._records[key]
+        return len(lost)
+
+    def _make_app(self):
+        app = Flask(__name__)
+
+        @app.route(ATTENDANCE_ENDPOINT, methods=['POST'])
+        def attendance():
+            body = request.get_data()
+            if self.latency:
+                threading.Event().wait(self.latency)
+            with self._lock:
+                self.stats['peticiones'] += 1
+                self.stats['bytes'] += len(body)
+                fail = self.fail_rate and self._random.random() < self.fail_rate
+                if fail:
+                    self.stats['rechazadas'] += 1
+            if fail:
+                return jsonify({'message': 'Servicio no disponible (simulado)'}), 503
+            encoding = request.headers.get('Content-Encoding')
+            if encoding == 'zstd' and not ZSTD_AVAILABLE:
+                return jsonify({'message': 'Codificación no soportada'}), 415
+            try:
+                records = decode_body(body, encoding, request.content_type)
+            except (OSError, ValueError, KeyError) as e:
+                return jsonify({'message': f'Cuerpo inválido: {e}'}), 400
+            invalid = [r['uid'] for r in records if int(r['uid']) in self.reject_uids]
+            if invalid:
+                with self._lock:
+                    self.stats['rechazadas'] += 1
+                return jsonify({'message': f"Datos inválidos (uid {invalid[0]})"}), 422
+            device = request.headers.get(DEVICE_HEADER, '')
+            with self._lock:
+                before = len(self._records)
+                self._records.update(((device, int(r['uid']), str(r['timestamp'])), str(r['id'])) for r in records)
+                added = len(self._records) - before
+                self.stats['registros'] += len(records)
+                self.stats['duplicados'] += len(records) - added
+            return jsonify({'message': f'{added} registros guardados'})
+
+        @app.route(SUMMARY_ENDPOINT, methods=['GET'])
+        def summary():
+            granularity = request.args.get('granularidad', 'day')
+            if granularity not in BUCKET_PREFIX:
+                return jsonify({'message': 'Granularidad inválida'}), 422
+            device = request.args.get('dispositivo', request.headers.get(DEVICE_HEADER, ''))
+            since = request.args.get('desde', '')
+            until = request.args.get('hasta', '\uffff')
+            with self._lock:
+                records = [{'id': user_id, 'timestamp': ts} for (dev, _, ts), user_id in self._records.items()
+                           if dev == device and since <= ts <= until]
+            return jsonify({'buckets': summarize(records, granularity)})
+
+        @app.route('/stats', methods=['GET'])
+        def stats():
+            return jsonify(self.snapshot())
+
+        @app.route('/reset', methods=['POST'])
+        def reset():
+            self.reset()
+            return jsonify({'message': 'ok'})
+
+        return app
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    args = sys.argv[1:]
+    options = {'--port': 8000, '--latency': 0.0, '--fail-rate': 0.0}
+    for name, default in options.items():
+        if name in args:
+            index = args.index(name)
+            options[name] = type(default)(args[index + 1])
+            del args[index:index + 2]
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    api = MockAttendanceAPI(port=options['--port'], latency=options['--latency'],
+                            fail_rate=options['--fail-rate'])
+    # Primera línea: puerto elegido (la lee bench_e2e.py)
+    print(api.port, flush=True)
+    print(f"API simulada en {api.base_url.rstrip('/')}{ATTENDANCE_ENDPOINT}, PID {os.getpid()}", flush=True)
+    try:
+        api._server.serve_forever()
+    except KeyboardInterrupt:
+        api._server.server_close()
+
+
+if __name__ == '__main__':
+    main()
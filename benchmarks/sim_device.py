@@ -0,0 +1,305 @@
+"""Dispositivo ZKTeco simulado para medir sin hardware.
+
+Responde por TCP y UDP (mismo puerto) el subconjunto del protocolo que usa pyzk: conexión,
+contadores (read_sizes), hora, usuarios y registros de asistencia por buffer (1503/1504),
+habilitar/deshabilitar y vaciar el log. Los registros usan el formato de 40 bytes de los
+equipos ZK8.
+
+--latency agrega una demora a cada respuesta. --loss simula pérdida de paquetes: por UDP la
+respuesta se descarta (pyzk agota su tiempo de espera, como con un equipo real) y por TCP se
+suma una retransmisión (--retransmit segundos).
+
+Uso: python benchmarks/sim_device.py [registros] [--port 4370] [--users 300] [--latency 0] [--loss 0]
+"""
+import os
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+CMD_CONNECT = 1000
+CMD_EXIT = 1001
+CMD_ENABLEDEVICE = 1002
+CMD_DISABLEDEVICE = 1003
+CMD_USERTEMP_RRQ = 9
+CMD_ATTLOG_RRQ = 13
+CMD_CLEAR_ATTLOG = 15
+CMD_GET_FREE_SIZES = 50
+CMD_GET_TIME = 201
+CMD_GET_VERSION = 1100
+CMD_PREPARE_DATA = 1500
+CMD_DATA = 1501
+CMD_FREE_DATA = 1502
+CMD_PREPARE_BUFFER = 1503
+CMD_READ_BUFFER = 1504
+CMD_ACK_OK = 2000
+CMD_ACK_ERROR = 2001
+
+MACHINE_PREPARE_DATA_1 = 20560
+MACHINE_PREPARE_DATA_2 = 32130
+USHRT_MAX = 65535
+
+# Carga útil de cada datagrama de datos por UDP (pyzk lee de a 1024 + 8 bytes)
+UDP_DATA_SIZE = 1024
+
+ATTENDANCE_STRUCT = struct.Struct('<H24sB4sB8s')
+USER_STRUCT = struct.Struct('<HB8s24sIx7sx24s')
+
+
+def checksum(packet):
+    """Suma de control del encabezado ZK (zkemsdk.c)"""
+    if len(packet) % 2:
+        packet += b'\x00'
+    total = sum(struct.unpack(f'<{len(packet) // 2}H', packet))
+    while total > USHRT_MAX:
+        total -= USHRT_MAX
+    total = ~total
+    while total < 0:
+        total += USHRT_MAX
+    return total
+
+
+def make_packet(command, session_id, reply_id, data=b''):
+    header = struct.pack('<4H', command, 0, session_id, reply_id)
+    return struct.pack('<4H', command, checksum(header + data), session_id, reply_id) + data
+
+
+def encode_time(t):
+    """Hora en el formato de 32 bits del dispositivo (EncodeTime de zkemsdk.c)"""
+    return (((t.year % 100) * 12 * 31 + (t.month - 1) * 31 + t.day - 1) * 86400
+            + (t.hour * 60 + t.minute) * 60 + t.second)
+
+
+class SimulatedDevice:
+    """Equipo simulado con una cantidad configurable de registros y usuarios"""
+
+    def __init__(self, records=1000, users=300, host='127.0.0.1', port=0, latency=0.0, loss=0.0,
+                 retransmit=0.2, start=datetime(2024, 1, 1, 7, 0, 0), seed=0):
+        self.host = host
+        self.port = port
+        self.users = max(1, users)
+        self.latency = latency
+        self.loss = loss
+        self.retransmit = retransmit
+        self.start_time = start
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._session_ids = iter(range(1, USHRT_MAX))
+        self.stats = {'conexiones': 0, 'comandos': 0, 'bytes_enviados': 0, 'perdidos': 0}
+        self._records = 0
+        self._attendance = b''
+        self.set_records(records)
+        self._user_data = b''.join(
+            USER_STRUCT.pack(uid, 0, b'', f'Usuario {uid}'.encode(), 100000 + uid, b'1', str(1000 + uid).encode())
+            for uid in range(1, self.users + 1))
+
+    @property
+    def device(self):
+        """Entrada de config/device.json para apuntar la aplicación al simulador"""
+        return {'id': f'sim-{self.port}', 'name': f'Simulador {self.port}', 'ip_address': self.host,
+                'port': self.port}
+
+    def set_records(self, count):
+        """Regenerar el log: un usuario distinto por registro y una marcación por minuto"""
+        rows = []
+        for i in range(count):
+            uid = 1 + i % self.users
+            timestamp = struct.pack('<I', encode_time(self.start_time + timedelta(minutes=i)))
+            rows.append(ATTENDANCE_STRUCT.pack(uid, str(1000 + uid).encode(), 1, timestamp, i % 2, b''))
+        with self._lock:
+            self._records = count
+            self._attendance = b''.join(rows)
+
+    def start(self):
+        """Abrir TCP y UDP en el mismo puerto (0 elige uno libre)"""
+        self._tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._tcp.bind((self.host, self.port))
+        self.port = self._tcp.getsockname()[1]
+        self._tcp.listen(16)
+        self._udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._udp.bind((self.host, self.port))
+        for target in (self._accept_loop, self._udp_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for sock in (self._tcp, self._udp):
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _delay(self):
+        """Demora de la respuesta; True si el paquete se pierde"""
+        if self.latency:
+            time.sleep(self.latency)
+        if self.loss and self._random.random() < self.loss:
+            with self._lock:
+                self.stats['perdidos'] += 1
+            return True
+        return False
+
+    def _handle(self, session, command, data):
+        """Respuestas (comando, datos) a un comando; session guarda el buffer preparado"""
+        with self._lock:
+            self.stats['comandos'] += 1
+        if command == CMD_CONNECT:
+            with self._lock:
+                self.stats['conexiones'] += 1
+            return [(CMD_ACK_OK, b'')]
+        if command == CMD_GET_FREE_SIZES:
+            with self._lock:
+                records = self._records
+            fields = [0] * 20
+            fields[4] = self.users
+            fields[8] = records
+            fields[14], fields[15], fields[16] = 3000, 10000, 200000
+            fields[17], fields[18], fields[19] = 3000, 10000 - self.users, max(0, 200000 - records)
+            return [(CMD_ACK_OK, struct.pack('20i', *fields) + struct.pack('3i', 0, 0, 0))]
+        if command == CMD_GET_TIME:
+            return [(CMD_ACK_OK, struct.pack('<I', encode_time(datetime.now())))]
+        if command == CMD_GET_VERSION:
+            return [(CMD_ACK_OK, b'Ver 6.60 Sim\x00')]
+        if command == CMD_PREPARE_BUFFER:
+            _, requested, _, _ = struct.unpack('<bhii', data[:11])
+            with self._lock:
+                if requested == CMD_ATTLOG_RRQ:
+                    payload = self._attendance
+                elif requested == CMD_USERTEMP_RRQ:
+                    payload = self._user_data
+                else:
+                    return [(CMD_ACK_ERROR, b'')]
+            # El buffer empieza con su propio tamaño, como en el equipo
+            session['buffer'] = struct.pack('<I', len(payload)) + payload
+            return [(CMD_ACK_OK, b'\x00' + struct.pack('<I', len(session['buffer'])) + b'\x00' * 4)]
+        if command == CMD_READ_BUFFER:
+            start, size = struct.unpack('<ii', data[:8])
+            chunk = session.get('buffer', b'')[start:start + size]
+            if session['udp']:
+                packets = [(CMD_PREPARE_DATA, struct.pack('<I', len(chunk)))]
+                packets.extend((CMD_DATA, chunk[i:i + UDP_DATA_SIZE]) for i in range(0, len(chunk), UDP_DATA_SIZE))
+                packets.append((CMD_ACK_OK, b''))
+                return packets
+            return [(CMD_DATA, chunk)]
+        if command == CMD_FREE_DATA:
+            session.pop('buffer', None)
+            return [(CMD_ACK_OK, b'')]
+        if command == CMD_CLEAR_ATTLOG:
+            with self._lock:
+                self._records = 0
+                self._attendance = b''
+            return [(CMD_ACK_OK, b'')]
+        # Habilitar/deshabilitar, salir, eventos y el resto: confirmación sin datos
+        return [(CMD_ACK_OK, b'')]
+
+    def _accept_loop(self):
+        while not self._stop.is_set():
+            try:
+                conn, _ = self._tcp.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._tcp_session, args=(conn,), daemon=True).start()
+
+    def _tcp_session(self, conn):
+        session = {'id': next(self._session_ids), 'udp': False}
+        with conn:
+            while not self._stop.is_set():
+                top = self._recv_exact(conn, 8)
+                if top is None:
+                    return
+                magic1, magic2, length = struct.unpack('<HHI', top)
+                if (magic1, magic2) != (MACHINE_PREPARE_DATA_1, MACHINE_PREPARE_DATA_2):
+                    return
+                packet = self._recv_exact(conn, length)
+                if packet is None or len(packet) < 8:
+                    return
+                command, _, _, reply_id = struct.unpack('<4H', packet[:8])
+                responses = self._handle(session, command, packet[8:])
+                if self._delay() and self.retransmit:
+                    # TCP no pierde datos: la pérdida se ve como una retransmisión
+                    time.sleep(self.retransmit)
+                out = []
+                for response, data in responses:
+                    body = make_packet(response, session['id'], reply_id, data)
+                    out.append(struct.pack('<HHI', MACHINE_PREPARE_DATA_1, MACHINE_PREPARE_DATA_2, len(body)) + body)
+                payload = b''.join(out)
+                try:
+                    conn.sendall(payload)
+                except OSError:
+                    return
+                with self._lock:
+                    self.stats['bytes_enviados'] += len(payload)
+                if command == CMD_EXIT:
+                    return
+
+    @staticmethod
+    def _recv_exact(conn, size):
+        data = b''
+        while len(data) < size:
+            try:
+                part = conn.recv(size - len(data))
+            except OSError:
+                return None
+            if not part:
+                return None
+            data += part
+        return data
+
+    def _udp_loop(self):
+        sessions = {}
+        while not self._stop.is_set():
+            try:
+                packet, address = self._udp.recvfrom(65535)
+            except OSError:
+                return
+            if len(packet) < 8:
+                continue
+            command, _, _, reply_id = struct.unpack('<4H', packet[:8])
+            session = sessions.setdefault(address, {'id': next(self._session_ids), 'udp': True})
+            responses = self._handle(session, command, packet[8:])
+            if command == CMD_EXIT:
+                sessions.pop(address, None)
+            for response, data in responses:
+                if self._delay():
+                    continue
+                body = make_packet(response, session['id'], reply_id, data)
+                self._udp.sendto(body, address)
+                with self._lock:
+                    self.stats['bytes_enviados'] += len(body)
+
+
+def main():
+    args = sys.argv[1:]
+    options = {'--port': 4370, '--users': 300, '--latency': 0.0, '--loss': 0.0, '--retransmit': 0.2}
+    for name, default in options.items():
+        if name in args:
+            index = args.index(name)
+            options[name] = type(default)(args[index + 1])
+            del args[index:index + 2]
+    records = int(args[0]) if args else 1000
+
+    device = SimulatedDevice(records, users=options['--users'], port=options['--port'],
+                             latency=options['--latency'], loss=options['--loss'],
+                             retransmit=options['--retransmit']).start()
+    # Primera línea: puerto elegido (la lee bench_e2e.py)
+    print(device.port, flush=True)
+    print(f"Simulador ZKTeco en {device.host}:{device.port} (TCP/UDP), {records} registros, "
+          f"{device.users} usuarios, PID {os.getpid()}", flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        device.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import threading
+import time
+from collections import deque
+
+from metrics import ADAPTIVE_TIMEOUT, CIRCUIT_STATE
+
+CLOSED = 'cerrado'
+OPEN = 'abierto'
+HALF_OPEN = 'semiabierto'
+
+# Valor del gauge zkteco_circuit_state por estado
+STATE_VALUES = {CLOSED: 0, OPEN: 1, HALF_OPEN: 2}
+
+
+class CircuitOpenError(ConnectionError):
+    """El destino falló varias veces seguidas: se rechaza sin intentar la conexión"""
+
+
+class TargetHealth:
+    """Latencias observadas y circuit breaker de un destino (un dispositivo o la API).
+
+    El timeout es el percentil adaptive_timeout_percentile de las últimas latencias por
+    adaptive_timeout_factor, acotado entre minimum y el máximo configurado; con menos de
+    adaptive_timeout_min_samples muestras se usa el máximo. Tras circuit_failure_threshold
+    fallos seguidos el circuito se abre y las llamadas fallan al instante; pasada la espera
+    (exponencial entre cooldown_min y cooldown_max) se deja pasar un solo intento, que lo
+    cierra si responde o lo vuelve a abrir.
+    """
+
+    def __init__(self, name, settings, minimum, maximum, cooldown_min, cooldown_max, kind, label=None, log=print):
+        self.name = name
+        # Etiqueta de las métricas (clave del dispositivo o 'api'); name es para el registro
+        self.label = label or name
+        self.kind = kind
+        self.log = log
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+        self.cooldown_min = float(cooldown_min)
+        self.cooldown_max = float(cooldown_max)
+        self.percentile = float(settings['adaptive_timeout_percentile'])
+        self.factor = float(settings['adaptive_timeout_factor'])
+        self.min_samples = int(settings['adaptive_timeout_min_samples'])
+        self.threshold = max(1, int(settings['circuit_failure_threshold']))
+        self._samples = deque(maxlen=int(settings['adaptive_timeout_window']))
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.retry_at = 0.0
+        self._opened = 0
+        self._trial_started = None
+        CIRCUIT_STATE.set(0, target=self.label, kind=kind)
+
+    def _quantile(self, samples, percentile):
+        return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
+
+    def timeout(self, maximum=None):
+        """Timeout para el próximo intento; maximum reemplaza al configurado (p. ej. el de la interfaz)"""
+        maximum = float(maximum or self.maximum)
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < self.min_samples:
+            return maximum
+        value = self._quantile(samples, self.percentile) * self.factor
+        return round(min(maximum, max(min(self.minimum, maximum), value)), 2)
+
+    def _set_state(self, state):
+        self.state = state
+        CIRCUIT_STATE.set(STATE_VALUES[state], target=self.label, kind=self.kind)
+
+    def allow(self):
+        """True si se puede intentar; con el circuito semiabierto pasa un solo intento a la vez"""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and now >= self.retry_at:
+                self._set_state(HALF_OPEN)
+            # Un intento que nunca informó su resultado no bloquea para siempre
+            stale = self._trial_started is not None and now - self._trial_started > 2 * self.maximum
+            if self.state == HALF_OPEN and (self._trial_started is None or stale):
+                self._trial_started = now
+                return True
+            return False
+
+    def check(self):
+        """Lanzar CircuitOpenError si el circuito no deja pasar el intento"""
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} no responde; próximo intento en {self.retry_in():.0f}s")
+
+    def probe_due(self):
+        """El circuito está abierto y ya pasó la espera: toca sondear en segundo plano"""
+        with self._lock:
+            return self.state != CLOSED and self._trial_started is None and time.monotonic() >= self.retry_at
+
+    def retry_in(self):
+        return max(0.0, self.retry_at - time.monotonic())
+
+    def success(self, seconds=None):
+        """Registrar una respuesta (con su latencia si se midió)"""
+        with self._lock:
+            if seconds is not None:
+                self._samples.append(seconds)
+            recovered = self.state != CLOSED
+            self.failures = 0
+            self._opened = 0
+            self._trial_started = None
+            if recovered:
+                self._set_state(CLOSED)
+        ADAPTIVE_TIMEOUT.set(self.timeout(), target=self.label, kind=self.kind)
+        if recovered:
+            self.log(f"✓ {self.name} responde de nuevo (circuito cerrado)")
+
+    def failure(self):
+        """Registrar un timeout o error de conexión; abre el circuito al llegar al umbral"""
+        with self._lock:
+            self.failures += 1
+            self._trial_started = None
+            if self.state == CLOSED and self.failures < self.threshold:
+                return
+            self._opened += 1
+            delay = min(self.cooldown_max, self.cooldown_min * 2 ** (self._opened - 1))
+            self.retry_at = time.monotonic() + delay
+            self._set_state(OPEN)
+        self.log(f"✗ {self.name} sin respuesta {self.failures} veces seguidas; circuito abierto por {delay:.0f}s")
+
+    def status(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            state, failures = self.state, self.failures
+        return {
+            'circuito': state,
+            'fallos_seguidos': failures,
+            'timeout': self.timeout(),
+            'latencia_p50': round(self._quantile(samples, 50), 3) if samples else None,
+            'latencia_p99': round(self._quantile(samples, 99), 3) if samples else None,
+            'reintento_en': round(self.retry_in()) if state != CLOSED else None,
+        }
@@ -0,0 +1,283 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from circuit_breaker import TargetHealth
+from settings import load_settings
+from sync_cursor import device_key
+from tracing import span
+
+try:
+    from zk import ZK
+    from zk.exception import ZKNetworkError
+    ZK_AVAILABLE = True
+    # Fallos de red (cuentan para el circuito); un ZKErrorResponse es una respuesta del equipo
+    NETWORK_ERRORS = (OSError, ZKNetworkError)
+except ImportError:
+    ZK_AVAILABLE = False
+    NETWORK_ERRORS = (OSError,)
+
+
+class DeviceBusyError(RuntimeError):
+    """La sesión del dispositivo está en uso (p. ej. por una descarga) y no se quiso esperar"""
+
+
+def set_session_timeout(conn, seconds):
+    """Cambiar el timeout del socket de una conexión pyzk ya abierta.
+
+    pyzk usa un único timeout para todo: el adaptativo (corto) se aplica al conectar y aquí
+    se sube al máximo configurado para que las descargas grandes no se corten.
+    """
+    sock = getattr(conn, '_ZK__sock', None)
+    if sock is not None:
+        conn._ZK__timeout = seconds
+        sock.settimeout(seconds)
+
+
+class DeviceSession:
+    """Sesión autenticada con un dispositivo y su estado de reconexión"""
+
+    def __init__(self, device, health):
+        self.device = device
+        self.conn = None
+        self.lock = threading.RLock()
+        self.last_used = 0.0
+        self.last_check = 0.0
+        # Latencias y circuit breaker del dispositivo
+        self.health = health
+
+    @property
+    def connected(self):
+        return self.conn is not None and self.conn.is_connect
+
+
+class DeviceConnectionPool:
+    """Conexiones persistentes por dispositivo con keep-alive y reconexión automática"""
+
+    def __init__(self, log=print, settings=None):
+        self.log = log
+        self.settings = settings or load_settings()
+        self.keepalive_interval = float(self.settings['device_keepalive_interval'])
+        self.idle_timeout = float(self.settings['device_idle_timeout'])
+        self.probe_ttl = float(self.settings['device_probe_ttl'])
+        self._sessions = {}
+        self._probes = {}
+        # Último fallo de sondeo por dispositivo: un equipo caído no retiene un hilo en cada consulta
+        self._probe_errors = {}
+        self._health = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _session(self, device):
+        key = device_key(device)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                # Las latencias y el circuito sobreviven al cierre de la sesión
+                health = self._health.get(key) or TargetHealth(
+                    f"Dispositivo {device['name'] or device['ip_address']} ({device['ip_address']})", self.settings,
+                    self.settings['device_timeout_min'], self.settings['device_timeout'],
+                    self.settings['device_reconnect_min'], self.settings['device_reconnect_max'],
+                    kind='device', label=key, log=self.log)
+                self._health[key] = health
+                session = self._sessions[key] = DeviceSession(device, health)
+            else:
+                session.device = device
+            return session
+
+    def _connect(self, session, timeout):
+        """Conectar con el timeout adaptativo; timeout es el máximo (el configurado o el de la interfaz)"""
+        device = session.device
+        # ommit_ping evita lanzar un proceso 'ping' del sistema en cada conexión
+        zk = ZK(device['ip_address'], port=int(device['port']), timeout=session.health.timeout(timeout),
+                ommit_ping=True)
+        started = time.monotonic()
+        try:
+            with span('conexion', dispositivo=device_key(device)):
+                session.conn = zk.connect()
+        except Exception:
+            session.conn = None
+            session.health.failure()
+            raise
+        session.last_check = time.monotonic()
+        session.health.success(session.last_check - started)
+        set_session_timeout(session.conn, timeout)
+        self.log(f"Sesión abierta con {device['name'] or device['ip_address']} ({device['ip_address']}:{device['port']})")
+
+    def _drop(self, session):
+        conn, session.conn = session.conn, None
+        if conn is not None:
+            try:
+                conn.disconnect()
+            except Exception:
+                pass
+
+    def _is_alive(self, session):
+        """Comprobar la sesión con un comando barato (hora del dispositivo)"""
+        started = time.monotonic()
+        try:
+            session.conn.get_time()
+            session.last_check = time.monotonic()
+            session.health.success(session.last_check - started)
+            return True
+        except Exception:
+            return False
+
+    def _ensure(self, session, timeout, force):
+        now = time.monotonic()
+        if session.connected and now - session.last_check < self.keepalive_interval:
+            return
+        if session.connected and self._is_alive(session):
+            return
+
+        self._drop(session)
+        if not force:
+            # Circuito abierto: se falla al instante (force, p. ej. desde la interfaz, lo ignora)
+            session.health.check()
+        self._connect(session, timeout)
+
+    def connect(self, device, timeout=None, force=True):
+        """Abrir (o reutilizar) la sesión del dispositivo y devolver la conexión"""
+        with self.acquire(device, timeout=timeout, force=force) as conn:
+            return conn
+
+    @contextmanager
+    def acquire(self, device, timeout=None, force=False, blocking=True):
+        """Obtener la conexión del dispositivo en exclusiva mientras dure el bloque.
+
+        Con blocking=False lanza DeviceBusyError si otra operación la está usando.
+        """
+        if not ZK_AVAILABLE:
+            raise RuntimeError("Librería pyzk no está instalada")
+        timeout = timeout or int(self.settings['device_timeout'])
+        session = self._session(device)
+        # También con fallos: el hilo de keep-alive es el que sondea los circuitos abiertos
+        self.start_keepalive()
+        if not session.lock.acquire(blocking=blocking):
+            raise DeviceBusyError(f"Dispositivo {device_key(device)} ocupado")
+        try:
+            self._ensure(session, timeout, force)
+            try:
+                yield session.conn
+            except Exception as e:
+                # Cualquier fallo deja la sesión en estado dudoso: se reabrirá en el próximo uso
+                self._drop(session)
+                if isinstance(e, NETWORK_ERRORS):
+                    session.health.failure()
+                raise
+            finally:
+                session.last_used = time.monotonic()
+        finally:
+            session.lock.release()
+
+    def probe(self, device, timeout=None, force=False, wait=False):
+        """Contadores y firmware del dispositivo sin descargar registros (cacheado probe_ttl segundos).
+
+        Si una sincronización tiene la sesión no se espera a que termine (salvo wait=True): se
+        devuelve el último sondeo marcado 'ocupado'. Un fallo también se recuerda probe_ttl
+        segundos y se vuelve a lanzar sin conectar, salvo con force (acciones manuales).
+        """
+        key = device_key(device)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._probes.get(key)
+            failed = self._probe_errors.get(key)
+        if failed and not force and now - failed[0] < self.probe_ttl:
+            raise failed[1]
+        if cached and now - cached[0] < self.probe_ttl:
+            return cached[1]
+
+        try:
+            with self.acquire(device, timeout=timeout, force=force, blocking=wait) as conn:
+                # read_sizes devuelve solo los contadores de memoria (un paquete)
+                conn.read_sizes()
+                info = {
+                    'registros': conn.records,
+                    'capacidad_registros': conn.rec_cap,
+                    'usuarios': conn.users,
+                    'capacidad_usuarios': conn.users_cap,
+                    'huellas': conn.fingers,
+                    'rostros': conn.faces,
+                    'firmware': conn.get_firmware_version(),
+                    'serie': conn.get_serialnumber(),
+                    'consultado': time.strftime('%Y-%m-%dT%H:%M:%S')
+                }
+        except DeviceBusyError:
+            return dict(cached[1] if cached else {}, ocupado=True)
+        except Exception as e:
+            with self._lock:
+                self._probe_errors[key] = (time.monotonic(), e)
+            raise
+        with self._lock:
+            self._probes[key] = (time.monotonic(), info)
+            self._probe_errors.pop(key, None)
+        return info
+
+    def health(self):
+        """Timeout, latencias y estado del circuito por dispositivo"""
+        with self._lock:
+            health = dict(self._health)
+        return {key: value.status() for key, value in health.items()}
+
+    def is_connected(self, device):
+        with self._lock:
+            session = self._sessions.get(device_key(device))
+        return bool(session and session.connected)
+
+    def close(self, device):
+        with self._lock:
+            session = self._sessions.pop(device_key(device), None)
+        if session:
+            with session.lock:
+                self._drop(session)
+
+    def close_all(self):
+        self._stop.set()
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), {}
+        for session in sessions:
+            with session.lock:
+                self._drop(session)
+
+    def start_keepalive(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._keepalive_loop, daemon=True)
+            self._thread.start()
+
+    def _keepalive_loop(self):
+        while not self._stop.wait(self.keepalive_interval):
+            with self._lock:
+                sessions = list(self._sessions.values())
+            for session in sessions:
+                # Las sesiones en uso por una sincronización no se tocan
+                if not session.lock.acquire(blocking=False):
+                    continue
+                try:
+                    if not session.connected:
+                        self._probe_circuit(session)
+                        continue
+                    now = time.monotonic()
+                    if self.idle_timeout and now - session.last_used > self.idle_timeout:
+                        # Liberar el dispositivo para otras aplicaciones
+                        self._drop(session)
+                    elif now - session.last_check >= self.keepalive_interval and not self._is_alive(session):
+                        self.log(f"Sesión perdida con {session.device['ip_address']}; reconectando...")
+                        self._drop(session)
+                        try:
+                            self._connect(session, int(self.settings['device_timeout']))
+                        except Exception as e:
+                            self.log(f"✗ Reconexión fallida con {session.device['ip_address']}: {str(e)}")
+                finally:
+                    session.lock.release()
+
+    def _probe_circuit(self, session):
+        """Sondeo en segundo plano de un dispositivo con el circuito abierto (el intento semiabierto)"""
+        if not session.health.probe_due() or not session.health.allow():
+            return
+        try:
+            self._connect(session, int(self.settings['device_timeout']))
+        except Exception:
+            # El fallo ya quedó registrado y el circuito sigue abierto con más espera
+            pass
@@ -0,0 +1,132 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+from collections import deque
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from settings import LOGS_DIR, load_settings
+
+LOGGER_NAME = 'zkteco'
+
+# Buffer en memoria de las últimas entradas (lo lee la interfaz); se crea en setup_logging
+BUFFER = None
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def guess_level(message):
+    """Nivel según el prefijo que ya usan los mensajes (✗ error, ADVERTENCIA aviso)"""
+    text = str(message).lstrip()
+    if text.startswith('✗'):
+        return logging.ERROR
+    if text.startswith('ADVERTENCIA'):
+        return logging.WARNING
+    return logging.INFO
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por entrada"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'source': getattr(record, 'source', ''),
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RingBuffer(logging.Handler):
+    """Últimas entradas en memoria, numeradas para leer solo las nuevas"""
+
+    def __init__(self, capacity):
+        super().__init__()
+        self._entries = deque(maxlen=capacity)
+        self._seq = 0
+        self._guard = threading.Lock()
+
+    def emit(self, record):
+        with self._guard:
+            self._seq += 1
+            self._entries.append((self._seq, record.created, record.levelname, record.getMessage()))
+
+    def since(self, seq):
+        """Entradas (seq, created, nivel, mensaje) posteriores a seq"""
+        with self._guard:
+            if not self._entries or self._entries[-1][0] <= seq:
+                return []
+            return [entry for entry in self._entries if entry[0] > seq]
+
+
+class EventLog:
+    """Callback compatible con log=print que escribe en el registro estructurado"""
+
+    def __init__(self, logger, source):
+        self.logger = logger
+        self.source = source
+
+    def __call__(self, message, level=None):
+        self.logger.log(level or guess_level(message), message, extra={'source': self.source})
+
+    def debug(self, message):
+        self(message, logging.DEBUG)
+
+    def info(self, message):
+        self(message, logging.INFO)
+
+    def warning(self, message):
+        self(message, logging.WARNING)
+
+    def error(self, message):
+        self(message, logging.ERROR)
+
+
+def setup_logging(source, console=False, settings=None):
+    """Configurar una sola vez el registro del proceso y devolver su callback de log.
+
+    Quien llama solo encola la entrada; el archivo rotativo (logs/<source>.jsonl), el buffer
+    en memoria y la consola se escriben desde el hilo del QueueListener.
+    """
+    global BUFFER, _listener
+    logger = logging.getLogger(LOGGER_NAME)
+    with _setup_lock:
+        if _listener is None:
+            settings = settings or load_settings()
+            handlers = []
+            try:
+                os.makedirs(LOGS_DIR, exist_ok=True)
+                file_handler = RotatingFileHandler(
+                    os.path.join(LOGS_DIR, f'{source}.jsonl'), maxBytes=int(settings['log_max_bytes']),
+                    backupCount=int(settings['log_backup_count']), encoding='utf-8', delay=True)
+                file_handler.setFormatter(JsonFormatter())
+                handlers.append(file_handler)
+            except OSError as e:
+                print(f"No se pudo abrir el log en {LOGS_DIR}: {e}")
+
+            BUFFER = RingBuffer(int(settings['log_buffer_size']))
+            handlers.append(BUFFER)
+
+            if console and sys.stdout is not None:
+                stream = logging.StreamHandler(sys.stdout)
+                stream.setFormatter(logging.Formatter('%(message)s'))
+                handlers.append(stream)
+
+            log_queue = queue.SimpleQueue()
+            logger.setLevel(getattr(logging, str(settings['log_level']).upper(), logging.INFO))
+            logger.propagate = False
+            logger.addHandler(QueueHandler(log_queue))
+            _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+            _listener.start()
+            # Al salir se vacía la cola para no perder las últimas entradas
+            atexit.register(_listener.stop)
+    return EventLog(logger, source)
@@ -0,0 +1,81 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from settings import load_settings
+
+try:
+    import httpx
+    import h2  # noqa: F401  (requerido por httpx para HTTP/2)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+LOCAL_PREFIX = 'http://127.0.0.1'
+
+# Excepciones equivalentes de ambos clientes, para capturarlas en un solo lugar
+TIMEOUT_ERRORS = (requests.exceptions.Timeout,)
+CONNECTION_ERRORS = (requests.exceptions.ConnectionError,)
+if HTTP2_AVAILABLE:
+    TIMEOUT_ERRORS += (httpx.TimeoutException,)
+    CONNECTION_ERRORS += (httpx.TransportError,)
+
+
+class HttpClient:
+    """Cliente HTTP compartido con pool de conexiones keep-alive y reintentos de conexión"""
+
+    def __init__(self, settings=None):
+        self.settings = settings or load_settings()
+        self.connect_timeout = float(self.settings['http_connect_timeout'])
+        pool_size = int(self.settings['http_pool_size'])
+        retries = int(self.settings['http_connect_retries'])
+
+        self.http2 = bool(self.settings['http2']) and HTTP2_AVAILABLE
+        if self.http2:
+            # Con transport= httpx ignora limits= del cliente: el pool se acota en cada transporte
+            limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+            self._client = httpx.Client(
+                http2=True,
+                transport=httpx.HTTPTransport(http2=True, retries=retries, limits=limits),
+                mounts={LOCAL_PREFIX: httpx.HTTPTransport(retries=0, limits=limits)})
+        else:
+            # Solo se reintentan fallos al conectar: un POST leído a medias no se repite aquí
+            retry = Retry(total=retries, connect=retries, read=0, status=0, other=0,
+                          backoff_factor=float(self.settings['http_backoff']), allowed_methods=None)
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+            self._client = requests.Session()
+            self._client.mount('https://', adapter)
+            self._client.mount('http://', adapter)
+            # El servidor local responde o no: reintentar solo retrasaría la detección
+            self._client.mount(LOCAL_PREFIX, HTTPAdapter(max_retries=0))
+
+    def _timeout(self, timeout):
+        if self.http2:
+            return httpx.Timeout(timeout, connect=min(self.connect_timeout, timeout))
+        return (min(self.connect_timeout, timeout), timeout)
+
+    def get(self, url, timeout=10, **kwargs):
+        return self._client.get(url, timeout=self._timeout(timeout), **kwargs)
+
+    def post(self, url, data=None, headers=None, timeout=60, **kwargs):
+        if self.http2:
+            return self._client.post(url, content=data, headers=headers, timeout=self._timeout(timeout), **kwargs)
+        return self._client.post(url, data=data, headers=headers, timeout=self._timeout(timeout), **kwargs)
+
+    def close(self):
+        self._client.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Cliente compartido por todo el proceso (conexiones TLS calientes entre envíos)"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
@@ -0,0 +1,127 @@
+import threading
+import time
+from datetime import datetime
+
+from metrics import RECORDS_QUEUED
+from outbox import SOURCE_LIVE
+from records import AttendanceRecord
+from settings import load_settings
+from sync_cursor import device_key
+from sync_engine import ATTENDANCE_ENDPOINT
+
+try:
+    from zk import ZK
+    ZK_AVAILABLE = True
+except ImportError:
+    ZK_AVAILABLE = False
+
+
+class LiveCapture:
+    """Escucha en tiempo real de las marcaciones de un dispositivo y las reenvía por lotes cortos"""
+
+    def __init__(self, device, outbox, drainer, log=print, settings=None, store=None):
+        self.device = device
+        self.key = device_key(device)
+        self.outbox = outbox
+        self.drainer = drainer
+        self.store = store
+        self.log = log
+        self.settings = settings or load_settings()
+        self.window = float(self.settings['live_batch_window'])
+        self.batch_max = int(self.settings['live_batch_max'])
+        self.captured = 0
+        self.last_event = None
+        self.connected = False
+        self._buffer = []
+        self._buffer_started = None
+        self._conn = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if not ZK_AVAILABLE:
+            raise RuntimeError("Librería pyzk no está instalada")
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._conn is not None:
+            # El generador de pyzk termina en el siguiente timeout de lectura
+            self._conn.end_live_capture = True
+
+    def status(self):
+        return {
+            'conectado': self.connected,
+            'capturados': self.captured,
+            'ultimo_evento': self.last_event,
+            'en_espera': len(self._buffer)
+        }
+
+    def _run(self):
+        failures = 0
+        while not self._stop.is_set():
+            try:
+                # Sesión dedicada: la captura en vivo ocupa el socket de forma exclusiva
+                zk = ZK(self.device['ip_address'], port=int(self.device['port']),
+                        timeout=int(self.settings['device_timeout']), ommit_ping=True)
+                self._conn = zk.connect()
+                self.connected = True
+                failures = 0
+                self.log(f"✓ Captura en tiempo real activa: {self.device['name']} ({self.device['ip_address']})")
+
+                # new_timeout=1: el generador devuelve None cada segundo sin eventos
+                for attendance in self._conn.live_capture(new_timeout=1):
+                    if attendance is not None:
+                        self._add(attendance)
+                    self._flush_if_due()
+                    if self._stop.is_set():
+                        self._conn.end_live_capture = True
+            except Exception as e:
+                failures += 1
+                self.log(f"✗ Captura en tiempo real {self.device['ip_address']}: {str(e)}")
+            finally:
+                self.connected = False
+                self._flush()
+                self._disconnect()
+
+            if not self._stop.is_set():
+                delay = min(float(self.settings['device_reconnect_max']),
+                            float(self.settings['device_reconnect_min']) * 2 ** max(0, failures - 1))
+                self._stop.wait(delay)
+
+    def _add(self, attendance):
+        if not self._buffer:
+            self._buffer_started = time.monotonic()
+        self._buffer.append(AttendanceRecord.from_pyzk(attendance))
+        self.captured += 1
+        self.last_event = datetime.now().isoformat(timespec='seconds')
+
+    def _flush_if_due(self):
+        if not self._buffer:
+            return
+        if len(self._buffer) >= self.batch_max or time.monotonic() - self._buffer_started >= self.window:
+            self._flush()
+
+    def _flush(self):
+        """Encolar las marcaciones acumuladas y despertar al envío"""
+        if not self._buffer:
+            return
+        records, self._buffer = self._buffer, []
+        if self.store is not None:
+            self.store.save(self.key, records)
+        # Marcaciones sueltas: no mueven la marca de agua, o la sincronización saltaría las que
+        # la sesión en vivo no vio (reconexiones, reinicios del equipo)
+        queued = self.outbox.append(self.key, ATTENDANCE_ENDPOINT, records, source=SOURCE_LIVE)
+        RECORDS_QUEUED.inc(queued, device=self.key, source='live')
+        self.drainer.kick()
+
+    def _disconnect(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.disconnect()
+            except Exception:
+                pass
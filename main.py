@@ -4,16 +4,21 @@ import threading
 import time
 from datetime import datetime
 import json
-import requests
 import sys
 import argparse
 import os
-import socket
-from urllib.parse import urljoin
-from flask import Flask, jsonify, request
-# Importaciones para Flask
-from flask import Flask, jsonify
-from flask_cors import CORS
+from functools import partial
+from sync_cursor import SyncCursor, device_key
+from outbox import Outbox, OutboxDrainer, register_outbox_routes
+from device_pool import DeviceConnectionPool
+from server_lock import detect_server, remove_lock, request_drain, write_lock
+import metrics
+import event_log
+import tracing
+from settings import load_settings
+
+# Flask, requests (uploader) y asyncio (sync_engine) se importan en segundo plano
+# después de dibujar la ventana: son la mayor parte del tiempo de arranque
 
 
 try:
@@ -29,13 +34,23 @@ class ZKTecoApp:
         self.root.resizable(True, True)
         self.root.resizable(False, False)
         
+        # Registro estructurado: log() solo encola; la pantalla se actualiza por bloques
+        self.event_log = event_log.setup_logging('gui')
+        settings = load_settings()
+        self.log_max_lines = int(settings['log_ui_max_lines'])
+        self.log_flush_ms = int(settings['log_ui_flush_ms'])
+        self._log_seq = 0
+        
         # Variables
         self.connection = None
-        self.device = None
         self.is_connected = False
         
+        # Sesiones persistentes con keep-alive y reconexión automática
+        self.device_pool = DeviceConnectionPool(log=self.log)
+        
         # Variables para el servidor Flask
         self.flask_app = None
+        self.status_server = None
         self.flask_thread = None
         self.service_running = False
 
@@ -46,51 +61,96 @@ class ZKTecoApp:
         self.device_info = None
         self.current_device_id = None
         
-        # Verificar si el servicio ya está ejecutándose
-        self.check_service_status()
+        # Marca de agua para sincronización incremental
+        self.sync_cursor = SyncCursor()
         
-        # Solo iniciar servidor Flask si el servicio NO está corriendo
-        if not self.service_running:
-            self.init_flask_server()
+        # Cola local: los registros extraídos se envían desde disco con reintentos
+        self.outbox = Outbox()
+        
+        # Envío a la nube y pipeline de sincronización: se crean en _init_services
+        self.uploader = None
+        self.outbox_drainer = None
+        self.sync_engine = None
+        self.sync_jobs = None
+        self.sync_job = None
+        self.services_ready = False
+        self.on_services_ready = None
+        
+        # Verificar si el servicio ya está ejecutándose (sin esperas de red)
+        self.check_service_status()
         
         self.setup_ui()
         
         if not ZK_AVAILABLE:
-            self.log_text.insert(tk.END, "ADVERTENCIA: Librería 'pyzk' no encontrada.\n")
-            self.log_text.insert(tk.END, "Instalar con: pip install pyzk\n\n")
+            self.log("ADVERTENCIA: Librería 'pyzk' no encontrada.")
+            self.log("Instalar con: pip install pyzk")
+        
+        self._flush_log()
+        
+        # La ventana se muestra mientras se cargan los módulos pesados
+        threading.Thread(target=self._init_services, daemon=True).start()
 
-    def check_service_status(self):
-        """Verificar si el servicio ya está ejecutándose en el puerto 3322"""
+    def _init_services(self):
+        """Crear el envío, el pipeline y el servidor Flask sin bloquear la ventana"""
         try:
-            # Intentar hacer una petición al servicio
-            response = requests.get('http://127.0.0.1:3322/estado', timeout=2)
-            if response.status_code == 200:
-                data = response.json()
-                # Verificar si es el servicio (no la aplicación GUI)
-                if data.get('tipo') == 'servicio_windows':
-                    self.service_running = True
-                    print("Servicio ZKTeco detectado ejecutándose")
-                    return True
-        except:
-            pass
-        
-        # También verificar si el puerto está en uso
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                result = s.connect_ex(('127.0.0.1', 3322))
-                if result == 0:
-                    self.service_running = True
-                    print("Puerto 3322 está en uso (posiblemente por el servicio)")
-                    return True
-        except:
-            pass
-        
-        self.service_running = False
-        return False
+            from uploader import CloudUploader
+            from sync_engine import SyncEngine
+            from sync_jobs import SyncJobQueue
+            from attendance_store import open_store
+            from user_roster import open_roster
+            
+            roster = open_roster(log=self.log)
+            self.uploader = CloudUploader(log=self.log, roster=roster)
+            # Con el servicio en el puerto 3322, la cola la vacía solo él: aquí se encola y se le avisa
+            self.outbox_drainer = OutboxDrainer(self.outbox, self.uploader, self.sync_cursor, log=self.log,
+                                                delegate=request_drain if self.service_running else None)
+            self.outbox_drainer.start()
+            
+            # Lectura y envío por el pipeline asíncrono (cancelable, sin un hilo por clic)
+            self.sync_engine = SyncEngine(self.outbox, self.outbox_drainer, self.sync_cursor,
+                                          devices=[self.device_info] if self.device_info else [],
+                                          pool=self.device_pool, log=self.log, store=open_store(log=self.log),
+                                          roster=roster)
+            self.sync_jobs = SyncJobQueue(self.sync_engine, log=self.log)
+            
+            # Solo iniciar servidor Flask si el servicio NO está corriendo
+            if not self.service_running:
+                self.init_flask_server()
+        except Exception as e:
+            self.log(f"✗ Error iniciando servicios: {str(e)}")
+            return
+        self.root.after(0, self._services_ready)
+
+    def _services_ready(self):
+        """Habilitar las acciones que dependen del pipeline"""
+        self.services_ready = True
+        if self.system_params:
+            self.test_btn.config(state="normal")
+            if not self.is_connected:
+                self.connect_btn.config(state="normal")
+        if self.on_services_ready:
+            self.on_services_ready()
+
+    def check_service_status(self):
+        """Verificar si ya hay un servidor en el puerto 3322 (archivo de bloqueo y sondeo local)"""
+        server = detect_server()
+        self.service_running = server is not None
+        if server and server.get('tipo'):
+            self.log(f"Servidor ZKTeco detectado ejecutándose ({server['tipo']}, PID {server['pid']})")
+        elif server:
+            self.log("Puerto 3322 está en uso (posiblemente por el servicio)")
+        return self.service_running
 
     def init_flask_server(self):
         """Inicializar servidor Flask para verificación remota"""
         try:
+            from flask import Flask, Response, jsonify
+            from flask_cors import CORS
+            from status_server import StatusServer
+            from sync_jobs import register_job_routes
+            from attendance_store import register_attendance_routes
+            from reconcile import register_reconcile_routes
+            
             self.flask_app = Flask(__name__)
             CORS(self.flask_app)
             
@@ -129,41 +189,70 @@ class ZKTecoApp:
             # Ruta para verificar conectividad con dispositivo
             @self.flask_app.route('/ping-device', methods=['GET'])
             def ping_device():
-                return jsonify({
+                response = {
                     'dispositivo_conectado': self.is_connected,
                     'puede_sincronizar': self.is_connected and bool(self.system_params)
-                })
+                }
+                
+                # Sondeo ligero (cacheado) del dispositivo, sin descargar registros
+                if self.system_params and ZK_AVAILABLE and self.device_info:
+                    try:
+                        response['dispositivo'] = self.device_pool.probe(self.device_info)
+                        response['alcanzable'] = True
+                    except Exception as e:
+                        response['alcanzable'] = False
+                        response['error'] = str(e)
+                    # Timeout adaptativo y estado del circuito del dispositivo y de la API
+                    response['salud'] = self.device_pool.health().get(device_key(self.device_info))
+                if self.uploader:
+                    response['api'] = self.uploader.health.status()
+                return jsonify(response)
+
+            # Trabajos de sincronización del dispositivo (encolar, consultar avance y cancelar)
+            register_job_routes(self.flask_app, self.sync_jobs)
+
+            # Consulta de marcaciones desde la copia local (sin leer el dispositivo)
+            register_attendance_routes(self.flask_app, self.sync_engine.store)
+
+            # Conciliación por buckets con el resumen del servidor
+            register_reconcile_routes(self.flask_app, self.sync_engine)
+
+            # Otros procesos (el comando sync) encolan y piden aquí el envío
+            register_outbox_routes(self.flask_app, self.outbox_drainer)
+
+            # Métricas de lectura y envío en formato Prometheus
+            @self.flask_app.route('/metrics', methods=['GET'])
+            def metricas():
+                return Response(metrics.render(self.outbox), mimetype=metrics.CONTENT_TYPE)
             
             # NUEVA RUTA: Cerrar servidor
             @self.flask_app.route('/shutdown', methods=['POST'])
             def shutdown():
-                func = request.environ.get('werkzeug.server.shutdown')
-                if func is None:
-                    raise RuntimeError('Not running with the Werkzeug Server')
-                func()
+                # Se detiene después de responder; las peticiones en curso terminan antes
+                self.status_server.stop_async()
                 return jsonify({'message': 'Server shutting down...'})
             
+            # Servidor embebido con pool de hilos acotado (el socket se abre ya)
+            self.status_server = StatusServer(self.flask_app, log=self.log)
+            
             def iniciar_servidor():
                 try:
-                    # CAMBIO CLAVE: daemon=False para que persista
-                    self.flask_app.run(
-                        port=3322, 
-                        host='127.0.0.1', 
-                        debug=False, 
-                        use_reloader=False,
-                        threaded=True
-                    )
+                    # Otras instancias lo detectan sin consultar el puerto por HTTP
+                    write_lock('aplicacion_gui')
+                    self.status_server.serve_forever()
                 except Exception as e:
-                    print(f"Error iniciando servidor Flask: {e}")
+                    self.log(f"✗ Error iniciando servidor Flask: {e}")
+                finally:
+                    remove_lock()
             
             # CAMBIO CLAVE: daemon=False
             self.flask_thread = threading.Thread(target=iniciar_servidor, daemon=False)
             self.flask_thread.start()
             
-            print("Servidor Flask iniciado en http://127.0.0.1:3322")
+            self.log("Servidor Flask iniciado en http://127.0.0.1:3322")
             
         except Exception as e:
-            print(f"Error configurando servidor Flask: {e}")
+            self.log(f"✗ Error configurando servidor Flask: {e}")
 
     def parse_system_params_fast(self):
         """Parsing optimizado de parámetros del sistema"""
@@ -244,7 +333,7 @@ class ZKTecoApp:
             ttk.Label(server_frame, text="http://127.0.0.1:3322/estado", font=('Arial', 9)).grid(row=1, column=1, sticky=tk.W, padx=(10, 0))
 
         # Timeout
-        ttk.Label(config_frame, text="Timeout (s):").grid(row=3, column=0, sticky=tk.W, padx=(0, 10), pady=(10, 0))
+        ttk.Label(config_frame, text="Timeout máx. (s):").grid(row=3, column=0, sticky=tk.W, padx=(0, 10), pady=(10, 0))
         self.timeout_var = tk.StringVar(value="5")
         timeout_entry = ttk.Entry(config_frame, textvariable=self.timeout_var, width=10)
         timeout_entry.grid(row=3, column=1, sticky=tk.W, pady=(10, 0))
@@ -253,8 +342,8 @@ class ZKTecoApp:
         button_frame = ttk.Frame(main_frame)
         button_frame.grid(row=2, column=0, columnspan=2, pady=(0, 10))
         
-        # Solo habilitar botones si tenemos parámetros
-        button_state = "normal" if self.system_params else "disabled"
+        # Se habilitan en _services_ready (si hay parámetros) cuando el pipeline está listo
+        button_state = "disabled"
         
         self.test_btn = ttk.Button(button_frame, text="Probar Conexión", command=self.test_connection, state=button_state)
         self.test_btn.grid(row=0, column=0, padx=(0, 10))
@@ -281,6 +370,13 @@ class ZKTecoApp:
         self.extract_attendance_btn = ttk.Button(data_frame, text="Extraer y Enviar Asistencias", command=self.extract_attendance, state="disabled")
         self.extract_attendance_btn.grid(row=0, column=0)
         
+        self.cancel_btn = ttk.Button(data_frame, text="Cancelar", command=self.cancel_extraction, state="disabled")
+        self.cancel_btn.grid(row=0, column=2, padx=(10, 0))
+        
+        # Sincronización incremental: solo registros posteriores al último envío confirmado
+        self.incremental_var = tk.BooleanVar(value='--full-sync' not in sys.argv)
+        ttk.Checkbutton(data_frame, text="Solo registros nuevos (incremental)", variable=self.incremental_var).grid(row=0, column=1, padx=(10, 0))
+        
         # Log de eventos
         log_frame = ttk.LabelFrame(main_frame, text="Log de Eventos", padding="10")
         log_frame.grid(row=5, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10))
@@ -316,8 +412,6 @@ class ZKTecoApp:
         if self.service_running:
             self.log("NOTA: Servicio ZKTeco detectado ejecutándose")
             self.log("La aplicación GUI funciona en modo complementario")
-        else:
-            self.log("Servidor Flask iniciado en puerto 3322")
         
         if ZK_AVAILABLE:
             self.log("Librería ZK cargada correctamente")
@@ -331,24 +425,26 @@ class ZKTecoApp:
             self.log("✗ No se recibieron parámetros del sistema")
 
     def log(self, message):
-        """Agregar mensaje al log con timestamp"""
-        try:
-            if hasattr(self, 'log_text') and self.log_text:
-                timestamp = datetime.now().strftime("%H:%M:%S")
-                self.root.after(0, lambda: self._safe_log_insert(timestamp, message))
-            else:
-                print(f"[LOG] {message}")
-        except Exception as e:
-            print(f"[ERROR LOG] {message} - Error: {e}")
+        """Agregar mensaje al log (seguro desde cualquier hilo)"""
+        self.event_log(message)
 
-    def _safe_log_insert(self, timestamp, message):
-        """Insertar mensaje en el log de forma segura"""
+    def _flush_log(self):
+        """Volcar en un solo bloque las entradas nuevas del buffer y recortar el widget"""
         try:
-            self.log_text.insert(tk.END, f"[{timestamp}] {message}\n")
-            self.log_text.see(tk.END)
-            self.root.update_idletasks()
+            entries = event_log.BUFFER.since(self._log_seq)
+            if entries:
+                self._log_seq = entries[-1][0]
+                self.log_text.insert(tk.END, ''.join(
+                    f"[{datetime.fromtimestamp(created).strftime('%H:%M:%S')}] {message}\n"
+                    for _, created, _, message in entries))
+                excess = int(self.log_text.index('end-1c').split('.')[0]) - 1 - self.log_max_lines
+                if excess > 0:
+                    self.log_text.delete('1.0', f'{excess + 1}.0')
+                self.log_text.see(tk.END)
         except Exception as e:
-            print(f"[ERROR LOG INSERT] {message} - Error: {e}")
+            print(f"[ERROR LOG] {e}")
+        finally:
+            self.root.after(self.log_flush_ms, self._flush_log)
     
     def clear_log(self):
         """Limpiar el log"""
@@ -364,48 +460,45 @@ class ZKTecoApp:
             messagebox.showerror("Error", "No hay parámetros de dispositivo disponibles")
             return
             
-        def test_conn():
-            try:
-                self.test_btn.config(state="disabled")
-                self.log("Probando conexión...")
-                
-                ip = self.device_info['ip_address']
-                port = int(self.device_info['port'])
-                timeout = int(self.timeout_var.get())
-                
-                # Log reducido para mayor velocidad
-                self.log(f"Conectando a {ip}:{port}")
-                
-                zk = ZK(ip, port=port, timeout=timeout)
-                conn = zk.connect()
-                
-                if conn:
-                    # Obtener solo información de asistencias
-                    try:
-                        attendance_count = len(conn.get_attendance())
-                        
-                        conn.disconnect()
-                        
-                        self.log("✓ Conexión exitosa!")
-                        self.log(f"  - Registros de asistencia: {attendance_count}")
-                        
-                        messagebox.showinfo("Éxito", "Conexión establecida correctamente")
-                    except Exception as e:
-                        conn.disconnect()
-                        self.log(f"✓ Conexión establecida (error obteniendo detalles: {str(e)})")
-                        messagebox.showinfo("Éxito", "Conexión establecida correctamente")
-                else:
-                    self.log("✗ Error: No se pudo establecer conexión")
-                    messagebox.showerror("Error", "No se pudo conectar al dispositivo")
-                    
-            except Exception as e:
-                self.log(f"✗ Error de conexión: {str(e)}")
-                messagebox.showerror("Error", f"Error de conexión: {str(e)}")
-            finally:
-                self.test_btn.config(state="normal")
-        
-        # Ejecutar en hilo separado
-        threading.Thread(target=test_conn, daemon=True).start()
+        try:
+            self.test_btn.config(state="disabled")
+            self.log("Probando conexión...")
+            
+            ip = self.device_info['ip_address']
+            port = int(self.device_info['port'])
+            timeout = int(self.timeout_var.get())
+            
+            # Log reducido para mayor velocidad
+            self.log(f"Conectando a {ip}:{port}")
+            
+            # Reutiliza la sesión persistente si ya existe
+            # Solo contadores y firmware: no descarga el log de asistencias
+            # El sondeo va al pool de E/S de dispositivos; el resultado se muestra desde el hilo de Tk
+            probe = self.sync_engine.pipeline.run_blocking(
+                partial(self.device_pool.probe, self.device_info, timeout=timeout, force=True, wait=True))
+        except Exception as e:
+            self.log(f"✗ Error de conexión: {str(e)}")
+            messagebox.showerror("Error", f"Error de conexión: {str(e)}")
+            self.test_btn.config(state="normal")
+            return
+        probe.add_done_callback(lambda future: self.root.after(0, self.test_finished, future))
+    
+    def test_finished(self, future):
+        """Mostrar el resultado de la prueba de conexión"""
+        self.test_btn.config(state="normal")
+        try:
+            info = future.result()
+        except Exception as e:
+            self.log(f"✗ Error de conexión: {str(e)}")
+            messagebox.showerror("Error", f"Error de conexión: {str(e)}")
+            return
+        
+        self.log("✓ Conexión exitosa!")
+        self.log(f"  - Registros de asistencia: {info['registros']} / {info['capacidad_registros']}")
+        self.log(f"  - Usuarios: {info['usuarios']} / {info['capacidad_usuarios']}")
+        self.log(f"  - Firmware: {info['firmware']} (serie {info['serie']})")
+        
+        messagebox.showinfo("Éxito", "Conexión establecida correctamente")
     
     def connect_device(self):
         """Conectar al dispositivo"""
@@ -417,49 +510,55 @@ class ZKTecoApp:
             messagebox.showerror("Error", "No hay parámetros de dispositivo disponibles")
             return
             
-        def connect():
-            try:
-                self.connect_btn.config(state="disabled")
-                self.log("Conectando al dispositivo...")
+        try:
+            self.connect_btn.config(state="disabled")
+            self.log("Conectando al dispositivo...")
+            
+            timeout = int(self.timeout_var.get())
+            
+            # Solo la conexión va al pool de E/S; los widgets se actualizan desde el hilo de Tk
+            connection = self.sync_engine.pipeline.run_blocking(
+                partial(self.device_pool.connect, self.device_info, timeout=timeout))
+        except Exception as e:
+            self.log(f"✗ Error de conexión: {str(e)}")
+            messagebox.showerror("Error", f"Error de conexión: {str(e)}")
+            self.connect_btn.config(state="normal")
+            return
+        connection.add_done_callback(lambda future: self.root.after(0, self.connect_finished, future))
+    
+    def connect_finished(self, future):
+        """Mostrar el resultado de la conexión"""
+        try:
+            self.connection = future.result()
+            
+            if self.connection:
+                self.is_connected = True
+                self.status_var.set("Conectado")
+                self.status_label.config(foreground="green")
                 
-                ip = self.device_info['ip_address']
-                port = int(self.device_info['port'])
-                timeout = int(self.timeout_var.get())
+                # Habilitar solo botón de extracción de asistencias
+                self.extract_attendance_btn.config(state="normal")
+                self.disconnect_btn.config(state="normal")
                 
-                self.device = ZK(ip, port=port, timeout=timeout)
-                self.connection = self.device.connect()
+                self.log("✓ Dispositivo conectado exitosamente")
+                messagebox.showinfo("Éxito", "Dispositivo conectado correctamente")
+            else:
+                self.log("✗ Error: No se pudo conectar")
+                messagebox.showerror("Error", "No se pudo conectar al dispositivo")
                 
-                if self.connection:
-                    self.is_connected = True
-                    self.status_var.set("Conectado")
-                    self.status_label.config(foreground="green")
-                    
-                    # Habilitar solo botón de extracción de asistencias
-                    self.extract_attendance_btn.config(state="normal")
-                    self.disconnect_btn.config(state="normal")
-                    
-                    self.log("✓ Dispositivo conectado exitosamente")
-                    messagebox.showinfo("Éxito", "Dispositivo conectado correctamente")
-                else:
-                    self.log("✗ Error: No se pudo conectar")
-                    messagebox.showerror("Error", "No se pudo conectar al dispositivo")
-                    
-            except Exception as e:
-                self.log(f"✗ Error de conexión: {str(e)}")
-                messagebox.showerror("Error", f"Error de conexión: {str(e)}")
-            finally:
-                if not self.is_connected:
-                    self.connect_btn.config(state="normal")
-        
-        threading.Thread(target=connect, daemon=True).start()
+        except Exception as e:
+            self.log(f"✗ Error de conexión: {str(e)}")
+            messagebox.showerror("Error", f"Error de conexión: {str(e)}")
+        finally:
+            if not self.is_connected:
+                self.connect_btn.config(state="normal")
     
     def disconnect_device(self):
         """Desconectar del dispositivo"""
         try:
             if self.connection:
-                self.connection.disconnect()
+                self.device_pool.close(self.device_info)
                 self.connection = None
-                self.device = None
                 
             self.is_connected = False
             self.status_var.set("Desconectado")
@@ -479,117 +578,75 @@ class ZKTecoApp:
         """Extraer registros de asistencia y enviar a la nube"""
         if not self.connection:
             return
-            
-        def extract():
-            try:
-                self.extract_attendance_btn.config(state="disabled")
-                self.log("Extrayendo registros de asistencia...")
-                
-                attendance = self.connection.get_attendance()
-                
-                if attendance:
-                    attendance_data = []
-                    for record in attendance:
-                        attendance_data.append({
-                            'uid': record.uid,
-                            'id': record.user_id,
-                            'timestamp': record.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-                            'state': record.status,
-                            'type': record.punch
-                        })
-                    
-                    self.log(f"✓ {len(attendance)} registros extraídos del dispositivo")
-                    
-                    # Enviar a la nube
-                    cloud_success = self.send_data_to_cloud('attendance', attendance_data, '/api/zkteco/attendance')
-                    
-                    # Mensaje de resultado
-                    if cloud_success:
-                        messagebox.showinfo("Éxito", "Asistencias sincronizadas correctamente")
-                        self.log("✓ Sincronización completada exitosamente")
-                    else:
-                        messagebox.showerror("Error", "No se pudo sincronizar las asistencias")
-                        
-                else:
-                    self.log("No se encontraron registros de asistencia")
-                    messagebox.showinfo("Información", "No se encontraron registros de asistencia en el dispositivo")
-                    
-            except Exception as e:
-                self.log(f"✗ Error extrayendo asistencias: {str(e)}")
-                messagebox.showerror("Error", f"Error extrayendo asistencias: {str(e)}")
-            finally:
-                self.extract_attendance_btn.config(state="normal")
         
-        threading.Thread(target=extract, daemon=True).start()
-
-    def send_data_to_cloud(self, data_type, data, endpoint):
-        """Enviar solo los datos a Laravel API"""
         try:
-            self.log(f"Enviando {data_type} a la nube...")
-            
-            # URL base de api Local
-            #base_url = "http://localhost:8000/api/zkteco/attendance"
-            # URL bade de api producción
-            base_url = "https://sistemas.regionpuno.gob.pe/asiss-api/api/zkteco/attendance"
-
-            url = urljoin(base_url, endpoint)
-            
-            # Payload simplificado - solo los datos
-            payload = data  # Directamente el array de datos
-            
-            # Headers para Laravel
-            headers = {
-                'Content-Type': 'application/json',
-                'Accept': 'application/json',
-            }
-            
-            # Log para debugging
-            self.log(f"Enviando a: {url}")
-            self.log(f"Cantidad de registros: {len(data)}")
-            
-            # Hacer la petición POST
-            response = requests.post(
-                url, 
-                json=payload,  # Enviar directamente el array
-                headers=headers,
-                timeout=60
-            )
-            
-            # Log de respuesta
-            self.log(f"Código de respuesta: {response.status_code}")
-            
-            if response.status_code == 200:
-                try:
-                    response_data = response.json()
-                    self.log(f"✓ {data_type.title()} enviados exitosamente")
-                    # Si Laravel devuelve información adicional
-                    if isinstance(response_data, dict) and 'message' in response_data:
-                        self.log(f"  - Respuesta: {response_data['message']}")
-                    return True
-                except:
-                    # Si Laravel no devuelve JSON, pero el status es 200
-                    self.log(f"✓ {data_type.title()} enviados exitosamente")
-                    return True
-            else:
-                try:
-                    error_data = response.json()
-                    self.log(f"✗ Error HTTP {response.status_code}: {error_data.get('message', 'Error desconocido')}")
-                except:
-                    self.log(f"✗ Error HTTP {response.status_code}: {response.text[:200]}")
-                return False
-                
-        except requests.exceptions.Timeout:
-            self.log(f"✗ Timeout enviando a la nube (60s)")
-            return False
-        except requests.exceptions.ConnectionError:
-            self.log(f"✗ Error de conexión con el servidor")
-            return False
+            timeout = int(self.timeout_var.get())
+            self.sync_job = self.sync_engine.submit(incremental=self.incremental_var.get(), devices=[self.device_info],
+                                                    connect_timeout=timeout, force=True)
         except Exception as e:
-            self.log(f"✗ Error enviando a la nube: {str(e)}")
-            return False
+            self.log(f"✗ Error extrayendo asistencias: {str(e)}")
+            messagebox.showerror("Error", f"Error extrayendo asistencias: {str(e)}")
+            return
+        if self.sync_job is None:
+            self.log("Ya hay una extracción en curso")
+            return
+        
+        self.extract_attendance_btn.config(state="disabled")
+        self.cancel_btn.config(state="normal")
+        self.log("Extrayendo registros de asistencia...")
+        # El resultado se muestra desde el hilo de Tk
+        self.sync_job.add_done_callback(lambda job: self.root.after(0, self.extraction_finished, job))
+    
+    def cancel_extraction(self):
+        """Cancelar la extracción en curso"""
+        if self.sync_engine.cancel():
+            self.log("Cancelando extracción...")
+    
+    def extraction_finished(self, job):
+        """Mostrar el resultado de la extracción"""
+        self.sync_job = None
+        self.extract_attendance_btn.config(state="normal")
+        self.cancel_btn.config(state="disabled")
+        
+        if job.cancelled():
+            self.log("Extracción cancelada")
+            return
+        
+        result = self.sync_engine.get_results().get(device_key(self.device_info), {})
+        if result.get('estado') != 'ok':
+            error = result.get('error') or 'sin respuesta del dispositivo'
+            self.log(f"✗ Error extrayendo asistencias: {error}")
+            messagebox.showerror("Error", f"Error extrayendo asistencias: {error}")
+            return
+        
+        read_count = result.get('registros_leidos', 0)
+        queued = result.get('registros_encolados', 0)
+        sent = result.get('registros_enviados', 0)
+        pending = result.get('pendientes_envio', 0)
+        if result.get('rechazados'):
+            self.log(f"ADVERTENCIA: {result['rechazados']} registros rechazados por el servidor quedaron apartados "
+                     f"(tabla dead_letter de config/outbox.db)")
+        if not read_count:
+            self.log("No se encontraron registros de asistencia")
+            messagebox.showinfo("Información", "No se encontraron registros de asistencia en el dispositivo")
+        elif pending and self.outbox_drainer.delegate is not None:
+            self.log(f"✓ {pending} registros encolados; los envía el servicio ZKTeco en ejecución")
+            messagebox.showinfo("Éxito", "Asistencias guardadas en la cola local.\n\nEl servicio ZKTeco en ejecución las enviará al servidor.")
+        elif pending:
+            self.log(f"✗ {pending} registros pendientes en la cola local; se reintentará automáticamente")
+            messagebox.showwarning("Pendiente", "No se pudo sincronizar las asistencias.\n\nLos registros quedaron guardados localmente y se reintentará el envío automáticamente.")
+        elif not queued and not sent:
+            self.log(f"  - Registros nuevos para enviar: 0 de {read_count}")
+            messagebox.showinfo("Información", "No hay registros nuevos para sincronizar")
+        else:
+            self.log(f"✓ Asistencias enviadas exitosamente ({sent} registros)")
+            self.log("✓ Sincronización completada exitosamente")
+            messagebox.showinfo("Éxito", "Asistencias sincronizadas correctamente")
 
 
 def main():
+    # Trazas por etapa con --trace (o ZKTECO_TRACE=1); se guardan en logs/ tras cada sincronización
+    tracing.TRACER.configure(sys.argv)
     root = tk.Tk()
     app = ZKTecoApp(root)
     
@@ -610,14 +667,30 @@ def main():
             if not result:  # Usuario eligió "No" - cerrar todo
                 try:
                     # Intentar cerrar el servidor Flask
-                    import requests
-                    requests.post('http://127.0.0.1:3322/shutdown', timeout=2)
+                    from http_client import get_client
+                    get_client().post('http://127.0.0.1:3322/shutdown', timeout=2)
                 except:
                     pass
         
         root.destroy()
     
     root.protocol("WM_DELETE_WINDOW", on_closing)
+    
+    # Medición de arranque (benchmarks/bench_startup.py): ventana dibujada y servicios listos
+    bench_path = os.environ.get('ZKTECO_STARTUP_BENCH')
+    if bench_path:
+        def mark(stage):
+            with open(bench_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'etapa': stage, 't': time.time()}) + '\n')
+        
+        def finish():
+            mark('servicios')
+            remove_lock()
+            os._exit(0)
+        
+        root.after_idle(lambda: (root.update_idletasks(), mark('ventana')))
+        app.on_services_ready = finish
+    
     root.mainloop()
 
 if __name__ == "__main__":
@@ -0,0 +1,193 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Límites (segundos) de los histogramas: de lecturas LAN rápidas a descargas de minutos
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_items(items))
+        return lines
+
+    def _render_items(self, items):
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}' for key, value in items]
+
+
+class Counter(_Metric):
+    """Contador acumulado por etiquetas"""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Valor instantáneo por etiquetas"""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_all(self, values):
+        """Reemplazar los valores de una etiqueta; las vistas antes y ausentes ahora quedan en 0"""
+        with self._lock:
+            for key in self._values:
+                self._values[key] = 0
+            for label, value in values:
+                self._values[(str(label),)] = value
+
+
+class Histogram(_Metric):
+    """Histograma acumulativo (buckets, suma y cantidad) por etiquetas"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_items(self, items):
+        lines = []
+        for key, (counts, total, count) in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = _format_labels(self.labels, key, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {bucket_count}')
+            labels = _format_labels(self.labels, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Registry:
+    """Conjunto de métricas del proceso, exportadas en formato de texto de Prometheus"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self.register(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# Lectura de dispositivos
+DEVICE_READ_SECONDS = REGISTRY.histogram(
+    'zkteco_device_read_seconds', 'Tiempo de descarga del log de asistencias', ('device',))
+DEVICE_RECORDS_READ = REGISTRY.counter(
+    'zkteco_device_records_read_total', 'Registros leídos del dispositivo', ('device',))
+RECORDS_QUEUED = REGISTRY.counter(
+    'zkteco_records_queued_total', 'Registros nuevos guardados en la cola local', ('device', 'source'))
+SYNC_RUNS = REGISTRY.counter(
+    'zkteco_sync_runs_total', 'Sincronizaciones terminadas por resultado', ('device', 'estado'))
+
+# Envío a la nube
+ENCODE_SECONDS = REGISTRY.histogram(
+    'zkteco_encode_seconds', 'Tiempo de codificación y compresión de un lote', ('device',))
+UPLOAD_SECONDS = REGISTRY.histogram(
+    'zkteco_upload_seconds', 'Latencia de cada POST de un lote', ('device',))
+UPLOAD_BYTES = REGISTRY.counter(
+    'zkteco_upload_bytes_total', 'Bytes enviados en lotes aceptados', ('device',))
+UPLOAD_RECORDS = REGISTRY.counter(
+    'zkteco_upload_records_total', 'Registros aceptados por el servidor', ('device',))
+UPLOAD_FAILURES = REGISTRY.counter(
+    'zkteco_upload_failures_total', 'Lotes rechazados o sin respuesta', ('device',))
+UPLOAD_RETRIES = REGISTRY.counter(
+    'zkteco_upload_retries_total', 'Reintentos de lotes fallidos', ('device',))
+
+# Timeouts adaptativos y circuit breakers por destino (dispositivo o API)
+ADAPTIVE_TIMEOUT = REGISTRY.gauge(
+    'zkteco_adaptive_timeout_seconds', 'Timeout actual derivado de las latencias observadas', ('target', 'kind'))
+CIRCUIT_STATE = REGISTRY.gauge(
+    'zkteco_circuit_state', 'Estado del circuito: 0 cerrado, 1 abierto, 2 semiabierto', ('target', 'kind'))
+OUTBOX_PENDING = REGISTRY.gauge(
+    'zkteco_outbox_pending', 'Registros pendientes de envío en la cola local', ('device',))
+OUTBOX_DEAD_LETTER = REGISTRY.gauge(
+    'zkteco_outbox_dead_letter', 'Registros rechazados por el servidor y apartados de la cola', ('device',))
+
+
+def render(outbox=None):
+    """Texto de /metrics; con outbox se actualiza antes el pendiente y los rechazados por dispositivo"""
+    if outbox is not None:
+        OUTBOX_PENDING.set_all(outbox.pending_by_device())
+        OUTBOX_DEAD_LETTER.set_all(outbox.dead_letter_by_device())
+    return REGISTRY.render()
@@ -0,0 +1,402 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from records import encode_record, iter_chunks, timestamp_key
+from settings import OUTBOX_PATH, load_settings
+
+# Registros leídos por página al vaciar la cola
+DRAIN_PAGE_SIZE = 10000
+
+# Registros insertados por transacción al encolar
+APPEND_BLOCK_SIZE = 5000
+
+# Días del índice de enviados que se mantienen en memoria al filtrar en streaming
+KNOWN_DAYS_CACHE = 32
+
+# Origen de los registros encolados. Solo los de una sincronización sin rango de fechas cubren
+# todo el log desde la marca de agua y pueden moverla; los de un rango, de la captura en tiempo
+# real o de la conciliación se envían sin tocarla
+SOURCE_SYNC = 'sync'
+SOURCE_WINDOW = 'ventana'
+SOURCE_LIVE = 'vivo'
+SOURCE_RECONCILE = 'conciliacion'
+
+
+def uploaded_key(record):
+    return (timestamp_key(record['timestamp']), int(record['uid']), str(record.get('id', '')))
+
+
+class Outbox:
+    """Cola local en SQLite (modo WAL) con los registros pendientes de envío"""
+
+    def __init__(self, path=OUTBOX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                device_id TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                uid INTEGER NOT NULL,
+                timestamp TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL,
+                source TEXT NOT NULL DEFAULT 'sync',
+                UNIQUE (device_id, endpoint, uid, timestamp)
+            )
+        ''')
+        columns = {row[1] for row in self._db.execute('PRAGMA table_info(outbox)')}
+        if 'source' not in columns:
+            # Colas creadas antes de registrar el origen
+            self._db.execute("ALTER TABLE outbox ADD COLUMN source TEXT NOT NULL DEFAULT 'sync'")
+        # Páginas del envío en orden sin ordenar la cola completa en cada una
+        self._db.execute('CREATE INDEX IF NOT EXISTS outbox_drain ON outbox (device_id, endpoint, source, timestamp, uid)')
+        # Registros que el servidor rechazó outbox_max_attempts veces (no bloquean la cola)
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS dead_letter (
+                device_id TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                uid INTEGER NOT NULL,
+                timestamp TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                error TEXT,
+                source TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                failed_at TEXT NOT NULL,
+                PRIMARY KEY (device_id, endpoint, uid, timestamp)
+            )
+        ''')
+        # Índice compacto de registros ya aceptados por el servidor
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS uploaded (
+                device_id TEXT NOT NULL,
+                ts INTEGER NOT NULL,
+                uid INTEGER NOT NULL,
+                user_id TEXT NOT NULL,
+                PRIMARY KEY (device_id, ts, uid, user_id)
+            ) WITHOUT ROWID
+        ''')
+        self._db.commit()
+
+    def append(self, device_id, endpoint, records, source=SOURCE_SYNC):
+        """Encolar registros (lista o generador); los ya pendientes se ignoran. Devuelve cuántos se agregaron"""
+        now = datetime.now().isoformat(timespec='seconds')
+        device_id = str(device_id)
+        added = 0
+        # Por bloques: el generador de entrada se consume sin materializarlo completo
+        for block in iter_chunks(records, APPEND_BLOCK_SIZE):
+            rows = [(device_id, endpoint, int(r['uid']), r['timestamp'], encode_record(r), now, source) for r in block]
+            with self._lock:
+                before = self._db.total_changes
+                self._db.executemany(
+                    'INSERT OR IGNORE INTO outbox (device_id, endpoint, uid, timestamp, payload, created_at, source) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+                self._db.commit()
+                added += self._db.total_changes - before
+        return added
+
+    def pending_groups(self):
+        """Pares (device_id, endpoint) con registros pendientes"""
+        with self._lock:
+            return self._db.execute('SELECT DISTINCT device_id, endpoint FROM outbox').fetchall()
+
+    def pending_count(self, device_id=None):
+        with self._lock:
+            if device_id is None:
+                row = self._db.execute('SELECT COUNT(*) FROM outbox').fetchone()
+            else:
+                row = self._db.execute('SELECT COUNT(*) FROM outbox WHERE device_id = ?', (str(device_id),)).fetchone()
+        return row[0]
+
+    def pending_by_device(self):
+        """Pares (device_id, pendientes)"""
+        with self._lock:
+            return self._db.execute('SELECT device_id, COUNT(*) FROM outbox GROUP BY device_id').fetchall()
+
+    def pending_sources(self, device_id, endpoint):
+        """Orígenes con registros pendientes en un grupo, primero el que mueve la marca de agua"""
+        with self._lock:
+            rows = self._db.execute('SELECT DISTINCT source FROM outbox WHERE device_id = ? AND endpoint = ?',
+                                    (str(device_id), endpoint)).fetchall()
+        return sorted((source for (source,) in rows), key=lambda source: source != SOURCE_SYNC)
+
+    def read_page(self, device_id, endpoint, limit=DRAIN_PAGE_SIZE, source=None):
+        """Leer registros pendientes en orden cronológico (de un origen, o de todos con source=None).
+
+        Con un origen la consulta sigue el índice outbox_drain y no ordena la cola en cada página.
+        """
+        query = 'SELECT payload FROM outbox WHERE device_id = ? AND endpoint = ?'
+        params = [str(device_id), endpoint]
+        if source is not None:
+            query += ' AND source = ?'
+            params.append(source)
+        with self._lock:
+            rows = self._db.execute(query + ' ORDER BY timestamp, uid LIMIT ?', params + [limit]).fetchall()
+        return [json.loads(payload) for (payload,) in rows]
+
+    def ack(self, device_id, endpoint, records):
+        """Eliminar de la cola los registros confirmados y anotarlos en el índice de enviados"""
+        with self._lock:
+            self._db.executemany(
+                'DELETE FROM outbox WHERE device_id = ? AND endpoint = ? AND uid = ? AND timestamp = ?',
+                ((str(device_id), endpoint, int(r['uid']), r['timestamp']) for r in records))
+            self._db.executemany(
+                'INSERT OR IGNORE INTO uploaded (device_id, ts, uid, user_id) VALUES (?, ?, ?, ?)',
+                ((str(device_id),) + uploaded_key(r) for r in records))
+            self._db.commit()
+
+    def iter_not_uploaded(self, device_id, records):
+        """Generar los registros que el servidor aún no aceptó, consultando el índice por días"""
+        known_by_day = {}
+        for record in records:
+            key = uploaded_key(record)
+            day = key[0] // 86400
+            known = known_by_day.get(day)
+            if known is None:
+                if len(known_by_day) >= KNOWN_DAYS_CACHE:
+                    known_by_day.clear()
+                with self._lock:
+                    known = known_by_day[day] = set(self._db.execute(
+                        'SELECT ts, uid, user_id FROM uploaded WHERE device_id = ? AND ts >= ? AND ts < ?',
+                        (str(device_id), day * 86400, (day + 1) * 86400)))
+            if key not in known:
+                yield record
+
+    def filter_uploaded(self, device_id, records):
+        """Descartar los registros que el servidor ya aceptó en envíos anteriores"""
+        return list(self.iter_not_uploaded(device_id, records))
+
+    def uploaded_count(self, device_id=None):
+        with self._lock:
+            if device_id is None:
+                row = self._db.execute('SELECT COUNT(*) FROM uploaded').fetchone()
+            else:
+                row = self._db.execute('SELECT COUNT(*) FROM uploaded WHERE device_id = ?', (str(device_id),)).fetchone()
+        return row[0]
+
+    def reject(self, device_id, endpoint, records, error, max_attempts):
+        """Anotar un rechazo del servidor; los que llegan a max_attempts pasan a dead_letter.
+
+        Devuelve cuántos registros se movieron.
+        """
+        keys = [(str(device_id), endpoint, int(r['uid']), r['timestamp']) for r in records]
+        now = datetime.now().isoformat(timespec='seconds')
+        match = 'device_id = ? AND endpoint = ? AND uid = ? AND timestamp = ?'
+        with self._lock:
+            self._db.executemany(f'UPDATE outbox SET attempts = attempts + 1 WHERE {match}', keys)
+            before = self._db.total_changes
+            self._db.executemany(
+                'INSERT OR REPLACE INTO dead_letter (device_id, endpoint, uid, timestamp, payload, attempts, error, '
+                'source, created_at, failed_at) '
+                f'SELECT device_id, endpoint, uid, timestamp, payload, attempts, ?, source, created_at, ? FROM outbox '
+                f'WHERE {match} AND attempts >= ?',
+                ((error, now) + key + (max_attempts,) for key in keys))
+            moved = self._db.total_changes - before
+            if moved:
+                self._db.executemany(f'DELETE FROM outbox WHERE {match} AND attempts >= ?',
+                                     (key + (max_attempts,) for key in keys))
+            self._db.commit()
+        return moved
+
+    def dead_letter_count(self, device_id=None):
+        with self._lock:
+            if device_id is None:
+                row = self._db.execute('SELECT COUNT(*) FROM dead_letter').fetchone()
+            else:
+                row = self._db.execute('SELECT COUNT(*) FROM dead_letter WHERE device_id = ?',
+                                       (str(device_id),)).fetchone()
+        return row[0]
+
+    def dead_letter_by_device(self):
+        """Pares (device_id, rechazados)"""
+        with self._lock:
+            return self._db.execute('SELECT device_id, COUNT(*) FROM dead_letter GROUP BY device_id').fetchall()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class OutboxDrainer:
+    """Hilo en segundo plano que vacía la cola hacia la API con espera exponencial"""
+
+    def __init__(self, outbox, uploader, cursor, log=print, settings=None, delegate=None):
+        self.outbox = outbox
+        self.uploader = uploader
+        self.cursor = cursor
+        self.log = log
+        self.settings = settings or load_settings()
+        self.max_attempts = max(1, int(self.settings['outbox_max_attempts']))
+        # Un candado por (dispositivo, endpoint): grupos distintos se envían en paralelo
+        self._group_locks = {}
+        self._group_locks_guard = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.retry_delay = None
+        # Si otro proceso es dueño del puerto 3322 (el servicio), solo él vacía la cola: dos
+        # envíos sobre el mismo outbox.db duplican subidas. delegate() le pide que la vacíe
+        self.delegate = delegate
+
+    def start(self):
+        if self.delegate is not None:
+            return
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def kick(self):
+        """Despertar al hilo para que intente vaciar la cola de inmediato"""
+        if self.delegate is not None:
+            self.delegate()
+        self._wakeup.set()
+
+    def drain_once(self):
+        """Enviar todo lo pendiente; devuelve (enviados, pendientes)"""
+        if self.delegate is not None:
+            self.delegate()
+            return 0, self.outbox.pending_count()
+        sent = 0
+        for device_id, endpoint in self.outbox.pending_groups():
+            sent += self._drain_locked(device_id, endpoint)
+        return sent, self.outbox.pending_count()
+
+    def drain_device(self, device_id, progress=None):
+        """Enviar lo pendiente de un dispositivo; devuelve (enviados, pendientes del dispositivo).
+
+        progress(ok, registros) se llama tras cada lote.
+        """
+        if self.delegate is not None:
+            self.delegate()
+            return 0, self.outbox.pending_count(device_id)
+        sent = 0
+        for group_device, endpoint in self.outbox.pending_groups():
+            if group_device == str(device_id):
+                sent += self._drain_locked(group_device, endpoint, progress)
+        return sent, self.outbox.pending_count(device_id)
+
+    def _drain_locked(self, device_id, endpoint, progress=None):
+        with self._group_locks_guard:
+            lock = self._group_locks.setdefault((device_id, endpoint), threading.Lock())
+        with lock:
+            return self._drain_group(device_id, endpoint, progress)
+
+    def _drain_group(self, device_id, endpoint, progress=None):
+        sent = 0
+        # Primero lo que mueve la marca de agua; luego lo demás (rangos, tiempo real, conciliación), sin tocarla
+        for source in self.outbox.pending_sources(device_id, endpoint):
+            group_sent, ok = self._drain_pages(device_id, endpoint, source, progress)
+            sent += group_sent
+            if not ok:
+                break
+        return sent
+
+    def _drain_pages(self, device_id, endpoint, source, progress=None):
+        """Enviar las páginas de un origen; devuelve (enviados, sin fallos)"""
+        sent = 0
+        advances_cursor = source == SOURCE_SYNC
+        while not self._stop.is_set():
+            page = self.outbox.read_page(device_id, endpoint, source=source)
+            if not page:
+                break
+
+            failed = {}
+
+            def on_chunk(index, chunk, ok, result):
+                if ok:
+                    self.outbox.ack(device_id, endpoint, chunk)
+                else:
+                    failed[index] = chunk
+                if progress:
+                    progress(ok, len(chunk))
+
+            result = self.uploader.upload(page, endpoint, total_records=len(page), progress=on_chunk,
+                                          device_id=device_id)
+            sent += result.sent_records
+            # Lotes rechazados por el servidor (no por falta de respuesta): aislar los registros inválidos
+            for index, message in sorted(result.rejected_chunks.items()):
+                sent += self._isolate_rejected(device_id, endpoint, failed[index], message, progress)
+
+            # La marca de agua solo avanza hasta el último lote confirmado sin huecos
+            if advances_cursor and result.confirmed_upto is not None:
+                self.cursor.advance(device_id, [result.confirmed_upto])
+            if not result:
+                # Se detiene el grupo para no dejar huecos en el orden cronológico
+                return sent, False
+        return sent, True
+
+    def _isolate_rejected(self, device_id, endpoint, chunk, message, progress=None):
+        """Reenviar por mitades un lote rechazado: los registros válidos se entregan y los
+        inválidos quedan solos, con su rechazo anotado. Devuelve cuántos se enviaron."""
+        if len(chunk) == 1:
+            if self.outbox.reject(device_id, endpoint, chunk, message, self.max_attempts):
+                self.log(f"✗ Registro {chunk[0]['timestamp']} (uid {chunk[0]['uid']}) de {device_id} rechazado "
+                         f"{self.max_attempts} veces; movido a rechazados: {message}")
+            return 0
+        url = self.uploader.build_url(endpoint)
+        sent = 0
+        middle = len(chunk) // 2
+        for part in (chunk[:middle], chunk[middle:]):
+            ok, retryable, part_message, _ = self.uploader.post_chunk(url, endpoint, part, device_id)
+            if ok:
+                self.outbox.ack(device_id, endpoint, part)
+                sent += len(part)
+                if progress:
+                    progress(True, len(part))
+            elif retryable is None:
+                sent += self._isolate_rejected(device_id, endpoint, part, part_message, progress)
+            else:
+                # La API dejó de responder o rechaza el envío en sí: el resto sigue en la cola
+                break
+        return sent
+
+    def _run(self):
+        idle_interval = self.settings['outbox_idle_interval']
+        min_delay = self.settings['outbox_retry_min']
+        max_delay = self.settings['outbox_retry_max']
+
+        while not self._stop.is_set():
+            try:
+                self.uploader.probe()
+                sent, pending = self.drain_once()
+                if sent:
+                    self.log(f"Cola local: {sent} registros enviados, {pending} pendientes")
+            except Exception as e:
+                self.log(f"✗ Error vaciando la cola local: {str(e)}")
+                pending = self.outbox.pending_count()
+
+            if pending:
+                self.retry_delay = min(max_delay, self.retry_delay * 2) if self.retry_delay else min_delay
+                self.log(f"Cola local: {pending} registros pendientes, reintento en {self.retry_delay}s")
+                timeout = self.retry_delay
+            else:
+                self.retry_delay = None
+                timeout = idle_interval
+
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+
+def register_outbox_routes(app, drainer):
+    """Ruta /cola/enviar de la API local: otro proceso encoló registros y pide vaciar la cola"""
+    from flask import jsonify
+
+    @app.route('/cola/enviar', methods=['POST'])
+    def enviar_cola():
+        drainer.kick()
+        return jsonify({'message': 'Envío de la cola solicitado',
+                        'pendientes': drainer.outbox.pending_count()})
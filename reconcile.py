@@ -0,0 +1,80 @@
+import hashlib
+
+# Granularidad del resumen: prefijo del timestamp 'AAAA-MM-DD HH:MM:SS' que identifica el bucket
+BUCKET_PREFIX = {'day': 10, 'hour': 13}
+
+HASH_MODULUS = 2 ** 64
+
+
+def bucket_of(record, granularity='day'):
+    """Bucket de un registro: '2024-05-01' por día o '2024-05-01 08' por hora"""
+    return record['timestamp'][:BUCKET_PREFIX[granularity]]
+
+
+def record_digest(record):
+    """Huella de un registro: primeros 64 bits del SHA-1 de 'id|timestamp'.
+
+    Solo usa lo que el servidor guarda como clave (usuario y hora), así Laravel calcula lo mismo.
+    """
+    text = f"{record['id']}|{record['timestamp']}".encode('utf-8')
+    return int.from_bytes(hashlib.sha1(text).digest()[:8], 'big')
+
+
+def summarize(records, granularity='day'):
+    """Cantidad y hash por bucket; el hash es la suma módulo 2^64 de las huellas (no depende del orden)"""
+    if granularity not in BUCKET_PREFIX:
+        raise ValueError(f"Granularidad inválida: {granularity} (day u hour)")
+    counts = {}
+    sums = {}
+    for record in records:
+        bucket = bucket_of(record, granularity)
+        counts[bucket] = counts.get(bucket, 0) + 1
+        sums[bucket] = (sums.get(bucket, 0) + record_digest(record)) % HASH_MODULUS
+    return {bucket: {'count': counts[bucket], 'hash': f'{sums[bucket]:016x}'} for bucket in counts}
+
+
+def differing_buckets(local, remote):
+    """Buckets del dispositivo que la nube no tiene exactamente iguales.
+
+    Los buckets que solo existen en la nube se ignoran: son registros ya borrados del
+    dispositivo (p. ej. tras vaciar su log) y no hay nada que reenviar.
+    """
+    return sorted(bucket for bucket, summary in local.items()
+                  if not isinstance(remote.get(bucket), dict)
+                  or remote[bucket].get('count') != summary['count']
+                  or str(remote[bucket].get('hash', '')).lower() != summary['hash'])
+
+
+def register_reconcile_routes(app, engine):
+    """Ruta POST /conciliar de la API local: compara con el servidor en segundo plano"""
+    import threading
+    from flask import jsonify, request
+    from sync_cursor import device_key
+
+    @app.route('/conciliar', methods=['POST'])
+    def conciliar():
+        # ?dispositivo=<id> (todos si se omite), ?granularidad=hour y ?solo_verificar=1
+        wanted = request.args.get('dispositivo')
+        granularity = request.args.get('granularidad', engine.settings['reconcile_granularity'])
+        if granularity not in BUCKET_PREFIX:
+            return jsonify({'error': f"Granularidad inválida: {granularity} (day u hour)"}), 400
+        repair = request.args.get('solo_verificar') not in ('1', 'true')
+        devices = [d for d in engine.devices if wanted in (None, device_key(d))]
+        if not devices:
+            return jsonify({'error': 'Dispositivo no encontrado'}), 404
+
+        # Se marcan aquí, antes de lanzar los hilos: dos peticiones seguidas no conciliarían dos veces
+        busy = engine.begin_reconcile([device_key(d) for d in devices], granularity)
+        if busy:
+            return jsonify({'message': f"Ya hay una conciliación en curso: {', '.join(busy)}"}), 409
+
+        def run(device):
+            try:
+                engine.reconcile(device, granularity, repair, claimed=True)
+            except Exception:
+                # El error queda en /dispositivos (conciliacion.error)
+                pass
+
+        for device in devices:
+            threading.Thread(target=run, args=(device,), daemon=True).start()
+        return jsonify({'message': 'Conciliación iniciada', 'dispositivos': [device_key(d) for d in devices]}), 202
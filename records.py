@@ -0,0 +1,128 @@
+import json
+from datetime import datetime, time, timezone
+
+# Campos del payload que espera Laravel, en orden
+PAYLOAD_FIELDS = ('uid', 'id', 'timestamp', 'state', 'type')
+
+# Campos del usuario que se agregan con upload_enrich_users (padrón del dispositivo)
+ENRICHED_FIELDS = ('name', 'privilege', 'card')
+
+
+class AttendanceRecord:
+    """Registro de asistencia compacto (sin __dict__) con acceso por clave como el payload"""
+
+    __slots__ = ('uid', 'id', 'timestamp', 'state', 'type')
+
+    def __init__(self, uid, user_id, timestamp, state, punch):
+        self.uid = uid
+        self.id = user_id
+        self.timestamp = timestamp
+        self.state = state
+        self.type = punch
+
+    @classmethod
+    def from_pyzk(cls, record):
+        # isoformat es varias veces más rápido que strftime y da el mismo formato
+        # (los dispositivos no guardan microsegundos)
+        return cls(record.uid, record.user_id, record.timestamp.isoformat(sep=' '),
+                   record.status, record.punch)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def to_dict(self):
+        return {'uid': self.uid, 'id': self.id, 'timestamp': self.timestamp,
+                'state': self.state, 'type': self.type}
+
+
+def iter_records(attendance, consume=True, since=None, until=None):
+    """Convertir la lista de pyzk en registros compactos uno a uno.
+
+    Con consume=True cada Attendance se libera de la lista en cuanto se convierte,
+    así la lista original y la convertida nunca coexisten completas en memoria.
+    Con since/until (datetime, inclusivos) solo se convierten los registros del rango.
+    """
+    for index, record in enumerate(attendance):
+        if consume:
+            attendance[index] = None
+        if (since is not None and record.timestamp < since) or (until is not None and record.timestamp > until):
+            continue
+        yield AttendanceRecord.from_pyzk(record)
+
+
+def parse_window_bound(value, end=False):
+    """Fecha u hora de un rango ('2024-05-01' o '2024-05-01 08:00'); una fecha sola como
+    límite final cubre el día completo"""
+    if value in (None, ''):
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        raise ValueError(f"Fecha inválida: {value} (formato AAAA-MM-DD o AAAA-MM-DD HH:MM)")
+    parsed = parsed.replace(tzinfo=None)
+    if end and len(str(value).strip()) == 10:
+        parsed = datetime.combine(parsed.date(), time.max)
+    return parsed
+
+
+def timestamp_key(timestamp):
+    """Timestamp del registro en segundos enteros (hora local del dispositivo tratada como UTC)"""
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    return int(timestamp.replace(tzinfo=timezone.utc).timestamp())
+
+
+def timestamp_from_key(key):
+    """Inverso de timestamp_key: texto 'AAAA-MM-DD HH:MM:SS' del payload"""
+    return datetime.fromtimestamp(key, timezone.utc).replace(tzinfo=None).isoformat(sep=' ')
+
+
+def iter_chunks(records, batch_size):
+    """Agrupar un iterable de registros en lotes sin materializarlo completo"""
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= batch_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def encode_record(record):
+    """JSON compacto de un registro (dict o AttendanceRecord)"""
+    if isinstance(record, AttendanceRecord):
+        record = record.to_dict()
+    return json.dumps(record, separators=(',', ':'), ensure_ascii=False)
+
+
+def encode_columnar(chunk):
+    """JSON columnar de un lote: nombres de campo una sola vez y timestamps como deltas en segundos"""
+    timestamps = [timestamp_key(r['timestamp']) for r in chunk]
+    base = timestamps[0] if timestamps else 0
+    previous = base
+    deltas = []
+    for ts in timestamps:
+        deltas.append(ts - previous)
+        previous = ts
+    payload = {
+        'format': 'columnar',
+        'fields': list(PAYLOAD_FIELDS),
+        'base': base,
+        'uid': [r['uid'] for r in chunk],
+        'id': [r['id'] for r in chunk],
+        'timestamp': deltas,
+        'state': [r['state'] for r in chunk],
+        'type': [r['type'] for r in chunk],
+    }
+    if chunk and isinstance(chunk[0], dict) and 'name' in chunk[0]:
+        payload['fields'].extend(ENRICHED_FIELDS)
+        for field in ENRICHED_FIELDS:
+            payload[field] = [r.get(field) for r in chunk]
+    return json.dumps(payload, separators=(',', ':'), ensure_ascii=False)
@@ -0,0 +1,106 @@
+import atexit
+import json
+import os
+import socket
+from datetime import datetime
+
+from settings import CONFIG_DIR
+
+SERVER_PORT = 3322
+LOCK_PATH = os.path.join(CONFIG_DIR, 'server.lock')
+
+# Un connect a 127.0.0.1 se resuelve al instante; el límite solo cubre casos anómalos
+PROBE_TIMEOUT = 0.1
+
+
+def pid_alive(pid):
+    """Comprobar si el proceso existe sin enviarle señales"""
+    try:
+        pid = int(pid)
+    except (TypeError, ValueError):
+        return False
+    if pid <= 0:
+        return False
+    if os.name == 'nt':
+        # En Windows os.kill termina el proceso: se consulta con OpenProcess
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        ok = kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        kernel32.CloseHandle(handle)
+        return bool(ok) and exit_code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def port_open(port=SERVER_PORT, timeout=PROBE_TIMEOUT):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        try:
+            return s.connect_ex(('127.0.0.1', port)) == 0
+        except OSError:
+            return False
+
+
+def read_lock(path=LOCK_PATH):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else None
+    except (OSError, ValueError):
+        return None
+
+
+def write_lock(tipo, port=SERVER_PORT, path=LOCK_PATH):
+    """Anunciar el servidor local de este proceso; se borra al salir"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'pid': os.getpid(), 'tipo': tipo, 'puerto': port,
+                   'inicio': datetime.now().isoformat(timespec='seconds')}, f)
+    os.replace(tmp_path, path)
+    atexit.register(remove_lock, path)
+
+
+def remove_lock(path=LOCK_PATH):
+    """Borrar el archivo solo si lo escribió este proceso"""
+    lock = read_lock(path)
+    if lock and lock.get('pid') == os.getpid():
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def detect_server(port=SERVER_PORT):
+    """Detectar sin esperas si ya hay un servidor local: archivo de bloqueo y sondeo TCP corto.
+
+    Devuelve los datos del bloqueo ({'pid', 'tipo', ...}), {'tipo': None} si el puerto está
+    ocupado por un proceso que no lo anunció, o None si está libre.
+    """
+    lock = read_lock()
+    if lock and not pid_alive(lock.get('pid')):
+        lock = None
+    # El sondeo confirma el bloqueo (PID reutilizado) y detecta versiones sin archivo
+    if port_open(port):
+        return lock or {'tipo': None, 'puerto': port}
+    return None
+
+
+def request_drain(port=SERVER_PORT):
+    """Pedir al servidor local, dueño de la cola, que la vacíe; False si no respondió"""
+    from http_client import get_client
+    try:
+        get_client().post(f'http://127.0.0.1:{port}/cola/enviar', timeout=2)
+        return True
+    except Exception:
+        # Sin respuesta: el servidor la vacía igual en su próximo ciclo
+        return False
@@ -0,0 +1,128 @@
+import json
+import os
+import sys
+
+
+def get_base_dir():
+    """Directorio base de la aplicación (junto al .exe si está congelada con PyInstaller)"""
+    if getattr(sys, 'frozen', False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+BASE_DIR = get_base_dir()
+CONFIG_DIR = os.path.join(BASE_DIR, 'config')
+LOGS_DIR = os.path.join(BASE_DIR, 'logs')
+
+DEVICE_CONFIG_PATH = os.path.join(CONFIG_DIR, 'device.json')
+SYNC_CURSOR_PATH = os.path.join(CONFIG_DIR, 'sync_cursor.json')
+SETTINGS_PATH = os.path.join(CONFIG_DIR, 'settings.json')
+OUTBOX_PATH = os.path.join(CONFIG_DIR, 'outbox.db')
+ATTENDANCE_DB_PATH = os.path.join(CONFIG_DIR, 'attendance.db')
+USER_ROSTER_PATH = os.path.join(CONFIG_DIR, 'user_roster.json')
+
+# Valores por defecto; se pueden sobrescribir en config/settings.json
+DEFAULT_SETTINGS = {
+    # URL base de api Local: "http://localhost:8000/api/zkteco/attendance"
+    'api_base_url': 'https://sistemas.regionpuno.gob.pe/asiss-api/api/zkteco/attendance',
+    'upload_batch_size': 500,
+    'upload_timeout': 60,
+    'upload_max_retries': 3,
+    # Codificación del envío: compresión None/'gzip'/'zstd' y formato 'json'/'columnar'.
+    # Se puede ajustar por endpoint: {"/api/zkteco/attendance": {"compression": "gzip"}}
+    'upload_compression': None,
+    'upload_format': 'json',
+    'upload_endpoints': {},
+    # Agregar nombre, privilegio y tarjeta del usuario a cada registro enviado (padrón cacheado)
+    'upload_enrich_users': False,
+    # Segundos tras los que el padrón se descarga de nuevo aunque los contadores no cambien
+    'user_roster_max_age': 86400,
+    # Cliente HTTP compartido (pool keep-alive)
+    'http_pool_size': 10,
+    'http_connect_timeout': 10,
+    'http_connect_retries': 2,
+    'http_backoff': 0.5,
+    'http2': False,
+    # Reintentos de la cola local (outbox) en segundos
+    'outbox_retry_min': 5,
+    'outbox_retry_max': 300,
+    'outbox_idle_interval': 60,
+    # Rechazos del servidor (4xx) tras los que un registro pasa a la tabla de rechazados
+    'outbox_max_attempts': 3,
+    # Sincronización de varios dispositivos
+    'sync_max_workers': 4,
+    'device_timeout': 5,
+    'device_sync_timeout': 300,
+    # Vaciar el log de cada dispositivo tras confirmar el envío de todos sus registros
+    'device_clear_after_upload': False,
+    # Etapa de envío del pipeline: hilos de subida y dispositivos leídos en espera de envío
+    'pipeline_upload_workers': 2,
+    'pipeline_queue_size': 16,
+    # Sesiones persistentes con los dispositivos (segundos)
+    'device_keepalive_interval': 30,
+    'device_idle_timeout': 300,
+    'device_reconnect_min': 2,
+    'device_reconnect_max': 120,
+    'device_probe_ttl': 10,
+    # Timeouts adaptativos: percentil de las últimas latencias × factor, entre el mínimo y el
+    # valor fijo (device_timeout, upload_timeout), que queda como máximo
+    'adaptive_timeout_percentile': 99,
+    'adaptive_timeout_factor': 4,
+    'adaptive_timeout_window': 100,
+    'adaptive_timeout_min_samples': 5,
+    'device_timeout_min': 1,
+    'upload_timeout_min': 10,
+    # Circuit breaker por dispositivo y por API: fallos seguidos para abrirlo y espera de la API
+    # (la de los dispositivos es device_reconnect_min/max)
+    'circuit_failure_threshold': 3,
+    'upload_circuit_cooldown_min': 5,
+    'upload_circuit_cooldown_max': 300,
+    # Sincronización programada del servicio (0 desactiva)
+    'sync_interval': 900,
+    'sync_jitter': 60,
+    # Trabajos terminados que recuerda la API /trabajos
+    'sync_jobs_history': 100,
+    # Conciliación con el resumen del servidor por bucket: 'day' u 'hour'
+    'reconcile_granularity': 'day',
+    # Captura en tiempo real (se puede activar por dispositivo con "live_capture": true)
+    'live_capture': False,
+    'live_batch_window': 2,
+    'live_batch_max': 100,
+    # Copia local indexada de todas las marcaciones leídas (consultas por /asistencias)
+    'attendance_store': True,
+    'attendance_page_size': 100,
+    'attendance_page_max': 1000,
+    # Servidor de la API local: 'auto' (waitress si está instalado), 'waitress' o 'werkzeug'
+    'status_server': 'auto',
+    'status_server_threads': 8,
+    'status_server_backlog': 64,
+    # Registro de eventos: archivos JSON rotativos en logs/ y buffer en memoria
+    'log_level': 'INFO',
+    'log_max_bytes': 5 * 1024 * 1024,
+    'log_backup_count': 5,
+    'log_buffer_size': 2000,
+    # Interfaz: líneas máximas en pantalla y cada cuántos milisegundos se vuelca el buffer
+    'log_ui_max_lines': 1000,
+    'log_ui_flush_ms': 200,
+}
+
+_settings_cache = None
+
+
+def load_settings(reload=False):
+    """Cargar configuración de config/settings.json combinada con los valores por defecto"""
+    global _settings_cache
+    if _settings_cache is not None and not reload:
+        return _settings_cache
+
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        with open(SETTINGS_PATH, 'r', encoding='utf-8') as f:
+            user_settings = json.load(f)
+        if isinstance(user_settings, dict):
+            settings.update(user_settings)
+    except (OSError, ValueError):
+        pass
+
+    _settings_cache = settings
+    return settings
@@ -0,0 +1,99 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer
+
+from settings import load_settings
+
+try:
+    from waitress.server import create_server
+    WAITRESS_AVAILABLE = True
+except ImportError:
+    WAITRESS_AVAILABLE = False
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Servidor WSGI de werkzeug que atiende con un pool de hilos acotado"""
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads, backlog):
+        self.request_queue_size = backlog
+        super().__init__(host, port, app)
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='status-http')
+        # Conexiones aceptadas a la espera de un hilo; con el cupo lleno se deja de aceptar
+        # y el resto espera en la cola del sistema (backlog)
+        self._slots = threading.BoundedSemaphore(threads * 2)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        self._pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        # Terminar las peticiones en curso antes de salir
+        self._pool.shutdown(wait=True)
+
+
+class StatusServer:
+    """Servidor embebido de la API local: waitress si está instalado, si no werkzeug con pool acotado"""
+
+    def __init__(self, app, host='127.0.0.1', port=3322, log=print, settings=None):
+        self.settings = settings or load_settings()
+        self.log = log
+        threads = max(1, int(self.settings['status_server_threads']))
+        backlog = max(1, int(self.settings['status_server_backlog']))
+        backend = self.settings['status_server']
+        if backend == 'waitress' and not WAITRESS_AVAILABLE:
+            self.log("ADVERTENCIA: waitress no está instalado; se usa el servidor de werkzeug")
+        self.backend = 'waitress' if backend in ('auto', 'waitress') and WAITRESS_AVAILABLE else 'werkzeug'
+
+        # El socket se abre aquí: un puerto ocupado falla antes de lanzar el hilo
+        if self.backend == 'waitress':
+            self._server = create_server(app, host=host, port=port, threads=threads, backlog=backlog,
+                                         connection_limit=threads * 8, channel_timeout=30,
+                                         ident='ZKTecoSync')
+        else:
+            self._server = PooledWSGIServer(host, port, app, threads, backlog)
+        self.port = port
+        self._serving = False
+        self._stopped = threading.Event()
+
+    def serve_forever(self):
+        """Atender peticiones hasta stop(); bloquea el hilo que lo llama"""
+        self.log(f"Servidor local en http://127.0.0.1:{self.port} ({self.backend})")
+        self._serving = True
+        try:
+            if self.backend == 'waitress':
+                self._server.run()
+                self._server.task_dispatcher.shutdown()
+            else:
+                self._server.serve_forever(poll_interval=0.5)
+                self._server.server_close()
+        finally:
+            self._stopped.set()
+
+    def stop(self, timeout=10):
+        """Dejar de aceptar conexiones, terminar las peticiones en curso y liberar el puerto"""
+        if self.backend == 'waitress':
+            self._server.close()
+        elif self._serving:
+            self._server.shutdown()
+        else:
+            # Nunca llegó a atender: basta con cerrar el socket
+            self._server.server_close()
+            return True
+        return self._stopped.wait(timeout)
+
+    def stop_async(self):
+        """Detener desde una petición (p. ej. /shutdown) sin esperar a su propio hilo"""
+        threading.Thread(target=self.stop, daemon=True).start()
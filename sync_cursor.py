@@ -0,0 +1,137 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from settings import SYNC_CURSOR_PATH
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+def device_key(device_info):
+    """Clave estable del dispositivo: su id, o ip:puerto si no tiene id"""
+    if device_info.get('id') not in (None, ''):
+        return str(device_info['id'])
+    return f"{device_info.get('ip_address', '')}:{device_info.get('port', 4370)}"
+
+
+def record_position(record):
+    """Posición de un registro en el log: (timestamp, uid)"""
+    return (record['timestamp'], int(record['uid']))
+
+
+@contextmanager
+def file_lock(path):
+    """Candado entre procesos sobre path.lock (la interfaz y el servicio comparten config/)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.lock', 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class SyncCursor:
+    """Marca de agua por dispositivo con el último registro confirmado por el servidor"""
+
+    def __init__(self, path=SYNC_CURSOR_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._cursors = self._load()
+
+    def _mtime_ns(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load(self):
+        self._mtime = self._mtime_ns()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        # Escritura atómica: un corte de luz no debe dejar el archivo a medias
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._cursors, f, indent=2)
+        os.replace(tmp_path, self.path)
+        self._mtime = self._mtime_ns()
+
+    def _refresh(self):
+        # Otro proceso (la interfaz o el servicio) pudo escribir el archivo desde la última lectura
+        if self._mtime_ns() != self._mtime:
+            self._cursors = self._load()
+
+    def get(self, device_id):
+        """Devolver (timestamp, uid) del último registro confirmado, o None"""
+        with self._lock:
+            self._refresh()
+            cursor = self._cursors.get(str(device_id))
+        if not cursor:
+            return None
+        return (cursor['timestamp'], int(cursor['uid']))
+
+    def iter_new(self, device_id, records):
+        """Generar solo los registros posteriores a la marca de agua del dispositivo"""
+        cursor = self.get(device_id)
+        if cursor is None:
+            yield from records
+            return
+        for record in records:
+            if record_position(record) > cursor:
+                yield record
+
+    def filter_new(self, device_id, records):
+        """Filtrar los registros posteriores a la marca de agua del dispositivo"""
+        return list(self.iter_new(device_id, records))
+
+    def advance(self, device_id, records):
+        """Avanzar la marca de agua tras la confirmación del servidor"""
+        if not records:
+            return
+        last = max(record_position(r) for r in records)
+        # Releer bajo el candado del archivo: se parte de lo que hay en disco y no se pisa lo
+        # que haya avanzado otro proceso
+        with self._lock, file_lock(self.path):
+            self._cursors = self._load()
+            current = self._cursors.get(str(device_id))
+            if current and (current['timestamp'], int(current['uid'])) >= last:
+                return
+            self._cursors[str(device_id)] = {
+                'timestamp': last[0],
+                'uid': last[1],
+                'updated_at': datetime.now().isoformat(timespec='seconds')
+            }
+            self._save()
+
+    def reset(self, device_id):
+        """Borrar la marca de agua para forzar una sincronización completa"""
+        with self._lock, file_lock(self.path):
+            self._cursors = self._load()
+            if self._cursors.pop(str(device_id), None) is not None:
+                self._save()
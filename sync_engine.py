@@ -0,0 +1,324 @@
+import json
+import threading
+import time
+from concurrent.futures import CancelledError
+from datetime import datetime
+
+from async_pipeline import AsyncSyncPipeline
+from device_pool import DeviceConnectionPool, ZK_AVAILABLE
+from outbox import SOURCE_RECONCILE, SOURCE_SYNC, SOURCE_WINDOW
+from metrics import DEVICE_READ_SECONDS, DEVICE_RECORDS_READ, RECORDS_QUEUED, SYNC_RUNS
+from records import iter_records
+from reconcile import bucket_of, differing_buckets, summarize
+from settings import DEVICE_CONFIG_PATH, load_settings
+from sync_cursor import device_key
+from tracing import TRACER, profiled, span
+
+ATTENDANCE_ENDPOINT = '/api/zkteco/attendance'
+SUMMARY_ENDPOINT = ATTENDANCE_ENDPOINT + '/summary'
+
+
+def normalize_device(params):
+    """Normalizar los parámetros de un dispositivo al formato de device_info"""
+    return {
+        'id': params.get('id'),
+        'name': params.get('name', ''),
+        'ip_address': params.get('ip_address', ''),
+        'port': int(params.get('port', 4370)),
+        'live_capture': params.get('live_capture')
+    }
+
+
+def load_devices(path=DEVICE_CONFIG_PATH):
+    """Leer dispositivos de config/device.json (un objeto, un array o {"devices": [...]})"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get('devices', [data])
+    return [normalize_device(d) for d in data if d.get('ip_address')]
+
+
+def read_device_attendance(pool, device, timeout=None, force=False, roster=None, log=print):
+    """Descargar las asistencias usando la sesión persistente del dispositivo.
+
+    Con roster, en la misma sesión se actualiza el padrón de usuarios si el dispositivo cambió.
+    """
+    with pool.acquire(device, timeout=timeout, force=force) as conn:
+        if roster is not None:
+            try:
+                with span('padron', dispositivo=device_key(device)):
+                    roster.refresh(device_key(device), conn)
+            except Exception as e:
+                # Sin padrón nuevo los registros se envían con el guardado; la lectura sigue
+                log(f"ADVERTENCIA: No se pudo actualizar el padrón de {device['name']}: {e}")
+        with span('lectura', dispositivo=device_key(device)) as current:
+            attendance = conn.get_attendance() or []
+            current.set(registros=len(attendance))
+        return attendance
+
+
+class SyncEngine:
+    """Sincronización de varios dispositivos en paralelo sobre el pipeline asíncrono"""
+
+    def __init__(self, outbox, drainer, cursor, devices=None, pool=None, log=print, settings=None, store=None,
+                 roster=None):
+        self.outbox = outbox
+        self.drainer = drainer
+        self.cursor = cursor
+        # Copia local consultable de todo lo leído (AttendanceStore, opcional)
+        self.store = store
+        # Padrón de usuarios cacheado (UserRoster, opcional) para enriquecer los envíos
+        self.roster = roster
+        self.log = log
+        self.settings = settings or load_settings()
+        self.pool = pool or DeviceConnectionPool(log=log, settings=self.settings)
+        self.devices = devices if devices is not None else load_devices()
+        self.results = {}
+        # Estado de la conciliación por dispositivo, aparte: una sincronización no lo borra
+        self.reconciliations = {}
+        self.running = False
+        # Número de la ejecución en curso; cada resultado lleva el de la suya en 'ejecucion'
+        self.run_id = 0
+        self.last_run = None
+        self._current = None
+        self._clear_after_upload = False
+        self._run_devices = {}
+        self._lock = threading.Lock()
+        self.pipeline = AsyncSyncPipeline(self.sync_device, self.upload_device, log=log, settings=self.settings)
+
+    def _set_result(self, key, **values):
+        with self._lock:
+            if values.get('estado') == 'sincronizando':
+                # Cada ejecución empieza sin los datos de la anterior
+                self.results[key] = {'ejecucion': self.run_id}
+            self.results.setdefault(key, {}).update(values)
+        if 'fin' in values:
+            SYNC_RUNS.inc(device=key, estado=values['estado'])
+
+    def get_results(self):
+        with self._lock:
+            results = {key: dict(value) for key, value in self.results.items()}
+            for key, value in self.reconciliations.items():
+                results.setdefault(key, {})['conciliacion'] = dict(value)
+        return results
+
+    def begin_reconcile(self, keys, granularity='day'):
+        """Marcar los dispositivos como 'conciliando' antes de lanzar la conciliación.
+
+        Todos o ninguno: devuelve las claves que ya tenían una en curso (vacío si se marcaron).
+        """
+        with self._lock:
+            busy = [key for key in keys if self.reconciliations.get(key, {}).get('estado') == 'conciliando']
+            if not busy:
+                for key in keys:
+                    self.reconciliations[key] = {'estado': 'conciliando', 'granularidad': granularity}
+        return busy
+
+    def _set_reconcile(self, key, **values):
+        with self._lock:
+            self.reconciliations[key] = values
+
+    def sync_device(self, device, incremental=True, connect_timeout=None, force=False,
+                    since=None, until=None, verify_all=False):
+        """Leer un dispositivo y encolar sus registros nuevos (etapa bloqueante del pipeline).
+
+        since/until limitan la conversión y el envío a un rango de fechas. Con verify_all cada
+        registro se contrasta con el índice de enviados aunque la marca de agua ya lo cubra,
+        requisito para poder vaciar después el log del dispositivo.
+        """
+        key = device_key(device)
+        started = time.monotonic()
+        with DEVICE_READ_SECONDS.time(device=key):
+            attendance = read_device_attendance(self.pool, device, timeout=connect_timeout, force=force,
+                                                roster=self.roster, log=self.log)
+        read_count = len(attendance)
+        DEVICE_RECORDS_READ.inc(read_count, device=key)
+
+        # Conversión en streaming: registro a registro hasta la cola local
+        records = iter_records(attendance, since=since, until=until)
+        if TRACER.enabled:
+            # Con --trace la conversión se materializa para medirla (y perfilarla) aparte de la cola
+            with span('conversion', dispositivo=key) as current, profiled('conversion'):
+                records = list(records)
+                current.set(registros=len(records))
+        with span('cola', dispositivo=key) as current:
+            if self.store is not None:
+                records = self.store.iter_save(key, records)
+            if incremental and not verify_all:
+                records = self.cursor.iter_new(key, records)
+            records = self.outbox.iter_not_uploaded(key, records)
+            # Un rango no cubre todo lo posterior a la marca de agua: sus registros no la mueven
+            source = SOURCE_WINDOW if since or until else SOURCE_SYNC
+            queued = self.outbox.append(key, ATTENDANCE_ENDPOINT, records, source=source)
+            current.set(registros=queued)
+        RECORDS_QUEUED.inc(queued, device=key, source='sync')
+        del attendance
+
+        self.log(f"✓ {device['name']} ({device['ip_address']}): {read_count} leídos, {queued} encolados")
+        return {
+            'registros_leidos': read_count,
+            'registros_encolados': queued,
+            'duracion': round(time.monotonic() - started, 2)
+        }
+
+    def upload_device(self, key):
+        """Enviar lo encolado del dispositivo y, si se pidió, vaciar su log (etapa de envío del pipeline)"""
+        sent, pending = self.drainer.drain_device(key, progress=lambda ok, count: self._chunk_progress(key, ok, count))
+        rejected = self.outbox.dead_letter_count(key)
+        if rejected:
+            # Apartados en la tabla dead_letter de la cola local: no bloquean el envío ni el vaciado
+            self._set_result(key, rechazados=rejected)
+        if self._clear_after_upload:
+            if pending:
+                self.log(f"Log del dispositivo {key} no vaciado: {pending} registros sin confirmar")
+            else:
+                self._set_result(key, log_vaciado=self._clear_device_log(key))
+        return sent, pending
+
+    def _chunk_progress(self, key, ok, count):
+        """Avance del envío por lotes, visible en los resultados mientras se envía"""
+        with self._lock:
+            result = self.results.setdefault(key, {})
+            if ok:
+                result['lotes_enviados'] = result.get('lotes_enviados', 0) + 1
+                result['registros_enviados'] = result.get('registros_enviados', 0) + count
+            else:
+                result['lotes_fallidos'] = result.get('lotes_fallidos', 0) + 1
+
+    def _clear_device_log(self, key):
+        """Vaciar el log si el dispositivo sigue teniendo exactamente los registros ya confirmados"""
+        device = self._run_devices[key]
+        expected = self.get_results().get(key, {}).get('registros_leidos')
+        if not expected:
+            return False
+        with self.pool.acquire(device, force=True) as conn:
+            # Sin marcaciones nuevas entre la comprobación y el borrado
+            conn.disable_device()
+            try:
+                conn.read_sizes()
+                if conn.records != expected:
+                    self.log(f"Log de {device['name']} no vaciado: tiene {conn.records} registros y se confirmaron {expected}")
+                    return False
+                conn.clear_attendance()
+            finally:
+                conn.enable_device()
+        self.log(f"✓ Log de {device['name']} ({device['ip_address']}) vaciado: {expected} registros confirmados por el servidor")
+        return True
+
+    def submit(self, incremental=True, devices=None, timeout=None, connect_timeout=None, force=False,
+               since=None, until=None, clear_after_upload=False):
+        """Lanzar una sincronización sin bloquear; devuelve un Future (con run_id), o None si ya hay una en curso.
+
+        Con clear_after_upload el log de cada dispositivo se vacía solo si el servidor confirmó
+        todos sus registros; no se admite junto con un rango de fechas.
+        """
+        if not ZK_AVAILABLE:
+            raise RuntimeError("Librería pyzk no está instalada")
+        if clear_after_upload and (since or until):
+            raise ValueError("Para vaciar el log del dispositivo la extracción no puede tener rango de fechas")
+        with self._lock:
+            if self.running:
+                return None
+            self.running = True
+            self.run_id += 1
+
+        devices = self.devices if devices is None else devices
+        self._clear_after_upload = clear_after_upload
+        self._run_devices = {device_key(d): d for d in devices}
+        window = f" del {since or 'inicio'} al {until or 'final'}" if since or until else ""
+        self.log(f"Sincronizando {len(devices)} dispositivo(s){window}...")
+        future = self.pipeline.sync(devices, incremental, self._set_result, timeout=timeout,
+                                    connect_timeout=connect_timeout, force=force,
+                                    read_options={'since': since, 'until': until, 'verify_all': clear_after_upload})
+        # Quien lanzó la ejecución reconoce sus resultados por este número
+        future.run_id = self.run_id
+        self._current = future
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        # Lo que quede pendiente (fallos o cancelación) lo reintenta la cola local
+        self.drainer.kick()
+        if TRACER.enabled:
+            TRACER.flush('sync', log=self.log)
+        self.last_run = datetime.now().isoformat(timespec='seconds')
+        with self._lock:
+            self.running = False
+            self._current = None
+
+    def run_all(self, incremental=True, devices=None, **options):
+        """Sincronizar los dispositivos (todos por defecto) y esperar el resultado"""
+        future = self.submit(incremental, devices, **options)
+        if future is None:
+            return False
+        try:
+            future.result()
+        except CancelledError:
+            self.log("Sincronización cancelada")
+        return True
+
+    def cancel(self):
+        """Cancelar la sincronización en curso; las lecturas ya iniciadas terminan en segundo plano"""
+        future = self._current
+        return future is not None and future.cancel()
+
+    def cancel_device(self, key):
+        """Cancelar un solo dispositivo de la sincronización en curso; False si ya terminó de leerlo"""
+        with self._lock:
+            if not self.running or key not in self._run_devices:
+                return False
+            result = self.results.get(key, {})
+            # Ya leído: lo leído se envía igualmente y la cancelación no tendría efecto
+            if result.get('ejecucion') == self.run_id and result.get('estado') != 'sincronizando':
+                return False
+        self.pipeline.cancel_device(key)
+        return True
+
+    def reconcile(self, device, granularity='day', repair=True, claimed=False):
+        """Comparar el log del dispositivo con el resumen del servidor por día u hora.
+
+        Solo se reencolan los registros de los buckets que difieren (aunque el índice de
+        enviados los dé por confirmados); con repair=False solo se informa la diferencia.
+        claimed=True si quien llama ya lo marcó con begin_reconcile.
+        """
+        key = device_key(device)
+        started = time.monotonic()
+        if not claimed and self.begin_reconcile([key], granularity):
+            raise RuntimeError(f"Ya hay una conciliación en curso para {key}")
+        try:
+            attendance = read_device_attendance(self.pool, device, force=True, log=self.log)
+            records = list(iter_records(attendance))
+            local = summarize(records, granularity)
+            if not local:
+                result = {'buckets': 0, 'diferentes': [], 'reenviados': 0}
+            else:
+                since = min(r['timestamp'] for r in records)
+                until = max(r['timestamp'] for r in records)
+                remote = self.drainer.uploader.fetch_summary(SUMMARY_ENDPOINT, key, since, until, granularity)
+                differing = differing_buckets(local, remote)
+                resend = 0
+                if repair and differing:
+                    wanted = set(differing)
+                    # Registros ya cubiertos por la marca de agua: se reenvían sin moverla
+                    resend = self.outbox.append(key, ATTENDANCE_ENDPOINT,
+                                                (r for r in records if bucket_of(r, granularity) in wanted),
+                                                source=SOURCE_RECONCILE)
+                    RECORDS_QUEUED.inc(resend, device=key, source='reconcile')
+                result = {'buckets': len(local), 'diferentes': differing, 'reenviados': resend}
+        except Exception as e:
+            self._set_reconcile(key, estado='error', granularidad=granularity, error=str(e))
+            self.log(f"✗ Conciliación de {device['name']} falló: {e}")
+            raise
+
+        if result['reenviados']:
+            self.drainer.kick()
+        result.update(estado='completado', granularidad=granularity, fin=datetime.now().isoformat(timespec='seconds'),
+                      duracion=round(time.monotonic() - started, 2))
+        self._set_reconcile(key, **result)
+        self.log(f"✓ Conciliación de {device['name']}: {len(result['diferentes'])} de {result['buckets']} "
+                 f"bucket(s) distintos, {result['reenviados']} registros reencolados")
+        return result
+
+    def start_background(self, incremental=True, **options):
+        """Lanzar una sincronización sin esperarla; devuelve False si ya hay una en curso"""
+        return self.submit(incremental, **options) is not None
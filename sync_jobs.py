@@ -0,0 +1,237 @@
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import CancelledError
+from datetime import datetime
+
+from records import parse_window_bound
+from settings import load_settings
+from sync_cursor import device_key
+
+# Estados finales de un trabajo
+FINISHED_STATES = ('completado', 'error', 'timeout', 'cancelado')
+
+# Resultado del motor -> estado del trabajo
+ENGINE_STATES = {'ok': 'completado', 'error': 'error', 'timeout': 'timeout', 'cancelado': 'cancelado'}
+
+# Campos de avance que se copian del resultado del motor
+PROGRESS_FIELDS = ('estado', 'registros_leidos', 'registros_encolados', 'lotes_enviados', 'lotes_fallidos',
+                   'registros_enviados', 'pendientes_envio', 'rechazados', 'log_vaciado', 'error', 'error_envio')
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def job_options(incremental=True, since=None, until=None, clear_after_upload=False):
+    """Opciones normalizadas de un trabajo (comparables para fusionar pedidos repetidos)"""
+    return {
+        'incremental': bool(incremental),
+        'since': since.isoformat(sep=' ') if since else None,
+        'until': until.isoformat(sep=' ') if until else None,
+        'clear_after_upload': bool(clear_after_upload),
+    }
+
+
+class SyncJobQueue:
+    """Trabajos de sincronización pedidos por la API, ejecutados en segundo plano.
+
+    Un pedido para un dispositivo que ya tiene un trabajo igual en cola o en curso se fusiona
+    con ese trabajo, así dos pestañas del portal no disparan lecturas solapadas del mismo equipo.
+    """
+
+    def __init__(self, engine, log=print, settings=None):
+        self.engine = engine
+        self.log = log
+        self.settings = settings or load_settings()
+        self.history = max(1, int(self.settings['sync_jobs_history']))
+        self._jobs = OrderedDict()
+        self._devices = {}
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, daemon=True, name='sync-jobs')
+        self._thread.start()
+
+    def enqueue(self, device, **options):
+        """Encolar un trabajo; devuelve (trabajo, fusionado)"""
+        if options.get('clear_after_upload') and (options.get('since') or options.get('until')):
+            raise ValueError("Para vaciar el log del dispositivo la extracción no puede tener rango de fechas")
+        options = job_options(**options)
+        key = device_key(device)
+        with self._cond:
+            for job in self._jobs.values():
+                if job['dispositivo'] == key and job['estado'] in ('en_cola', 'ejecutando') \
+                        and job['opciones'] == options:
+                    job['pedidos'] += 1
+                    return dict(job), True
+            job = {
+                'id': uuid.uuid4().hex[:12],
+                'dispositivo': key,
+                'nombre': device['name'],
+                'estado': 'en_cola',
+                'opciones': options,
+                'pedidos': 1,
+                'creado': _now(),
+                'inicio': None,
+                'fin': None,
+                'progreso': {},
+            }
+            self._jobs[job['id']] = job
+            self._devices[job['id']] = device
+            self._trim()
+            self._cond.notify()
+            return dict(job), False
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return self._snapshot(job) if job else None
+
+    def list(self):
+        with self._cond:
+            return [self._snapshot(job) for job in reversed(self._jobs.values())]
+
+    def cancel(self, job_id):
+        """Cancelar un trabajo en cola o en lectura; devuelve False si ya terminó, ya se está enviando o no existe.
+
+        En un trabajo fusionado cada llamada retira un pedido; se cancela al retirar el último.
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if not job or job['estado'] in FINISHED_STATES:
+                return False
+            if job['pedidos'] > 1:
+                job['pedidos'] -= 1
+                return True
+            if job['estado'] == 'en_cola':
+                job['estado'] = 'cancelado'
+                job['fin'] = _now()
+                return True
+        # Si la lectura ya terminó, lo leído queda en la cola local y se envía igualmente
+        return self.engine.cancel_device(job['dispositivo'])
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+
+    def _snapshot(self, job):
+        snapshot = dict(job)
+        snapshot['progreso'] = dict(job['progreso'])
+        if job['estado'] == 'ejecutando':
+            # Avance en vivo: lo que el motor lleva leído y enviado de este dispositivo
+            result = self.engine.get_results().get(job['dispositivo'], {})
+            snapshot['progreso'] = {k: result[k] for k in PROGRESS_FIELDS if k in result}
+        return snapshot
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job['estado'] in FINISHED_STATES]
+        for job_id in finished[:max(0, len(self._jobs) - self.history)]:
+            del self._jobs[job_id]
+            self._devices.pop(job_id, None)
+
+    def _next_batch(self):
+        """Trabajos en cola con las mismas opciones que el primero: se leen en paralelo en una sola pasada"""
+        queued = [job for job in self._jobs.values() if job['estado'] == 'en_cola']
+        if not queued:
+            return []
+        options = queued[0]['opciones']
+        return [job for job in queued if job['opciones'] == options]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stop and not self._next_batch():
+                    self._cond.wait()
+                if self._stop:
+                    return
+                batch = self._next_batch()
+            try:
+                self._run_batch(batch)
+            except Exception as e:
+                self.log(f"✗ Error ejecutando trabajos de sincronización: {str(e)}")
+                with self._cond:
+                    for job in batch:
+                        if job['estado'] not in FINISHED_STATES:
+                            job.update(estado='error', fin=_now(), progreso={'error': str(e)})
+
+    def _run_batch(self, batch):
+        options = batch[0]['opciones']
+        submit_options = {
+            'since': parse_window_bound(options['since']),
+            'until': parse_window_bound(options['until']),
+            'clear_after_upload': options['clear_after_upload'],
+        }
+
+        # El motor ejecuta una sincronización a la vez (programada, manual o de la API)
+        while True:
+            with self._cond:
+                batch = [job for job in batch if job['estado'] == 'en_cola']
+                if not batch:
+                    return
+                future = self.engine.submit(options['incremental'], devices=[self._devices[job['id']] for job in batch],
+                                            **submit_options)
+                if future is not None:
+                    run_id = future.run_id
+                    started = _now()
+                    for job in batch:
+                        job.update(estado='ejecutando', inicio=started)
+                    break
+                self._cond.wait(1)
+
+        try:
+            future.result()
+        except CancelledError:
+            pass
+
+        results = self.engine.get_results()
+        with self._cond:
+            for job in batch:
+                result = results.get(job['dispositivo'], {})
+                # Un resultado de otra ejecución: el dispositivo se canceló antes de empezar a leerlo
+                if result.get('ejecucion') != run_id:
+                    result = {'estado': 'cancelado'}
+                job['progreso'] = {k: result[k] for k in PROGRESS_FIELDS if k in result}
+                job['estado'] = ENGINE_STATES.get(result.get('estado'), 'error')
+                job['fin'] = _now()
+
+
+def register_job_routes(app, jobs):
+    """Rutas /trabajos de la API local (servicio e interfaz comparten la misma cola)"""
+    from flask import jsonify, request
+
+    @app.route('/trabajos', methods=['POST'])
+    def crear_trabajo():
+        # ?dispositivo=<id> (todos si se omite), con las mismas opciones que /sincronizar
+        wanted = request.args.get('dispositivo')
+        devices = [d for d in jobs.engine.devices if wanted in (None, device_key(d))]
+        if not devices:
+            return jsonify({'error': 'Dispositivo no encontrado'}), 404
+        try:
+            options = {
+                'incremental': request.args.get('completa') not in ('1', 'true'),
+                'since': parse_window_bound(request.args.get('desde')),
+                'until': parse_window_bound(request.args.get('hasta'), end=True),
+                'clear_after_upload': request.args.get('limpiar') in ('1', 'true'),
+            }
+            created = [jobs.enqueue(device, **options) for device in devices]
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'trabajos': [dict(job, fusionado=merged) for job, merged in created]}), 202
+
+    @app.route('/trabajos', methods=['GET'])
+    def listar_trabajos():
+        return jsonify({'trabajos': jobs.list()})
+
+    @app.route('/trabajos/<job_id>', methods=['GET'])
+    def ver_trabajo(job_id):
+        job = jobs.get(job_id)
+        if not job:
+            return jsonify({'error': 'Trabajo no encontrado'}), 404
+        return jsonify(job)
+
+    @app.route('/trabajos/<job_id>/cancelar', methods=['POST'])
+    def cancelar_trabajo(job_id):
+        if not jobs.cancel(job_id):
+            return jsonify({'message': 'El trabajo no existe, ya terminó o ya se están enviando sus registros'}), 409
+        return jsonify(jobs.get(job_id))
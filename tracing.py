@@ -0,0 +1,189 @@
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from settings import LOGS_DIR
+
+# ZKTECO_TRACE=1 activa las trazas; ZKTECO_TRACE=profile además el perfil de la conversión
+TRACE_ENV = 'ZKTECO_TRACE'
+
+# Tope de eventos en memoria entre dos volcados (servicio con --trace mucho tiempo)
+MAX_EVENTS = 200000
+
+
+class _NoSpan:
+    """Span vacío que se devuelve con las trazas desactivadas (sin costo en el camino caliente)"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+NO_SPAN = _NoSpan()
+
+
+class Span:
+    """Tramo medido de una etapa; set() agrega datos (registros, bytes) antes de cerrarlo"""
+
+    __slots__ = ('tracer', 'name', 'category', 'args', 'start')
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = 0.0
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer._add(self, end)
+        return False
+
+
+class Tracer:
+    """Trazas por etapa de la sincronización, exportables a Chrome/Perfetto (chrome://tracing, ui.perfetto.dev)"""
+
+    def __init__(self):
+        self.enabled = False
+        self.profile = False
+        self._origin = time.perf_counter()
+        self._events = []
+        self._threads = {}
+        self._dropped = 0
+        self._profiles = []
+        self._lock = threading.Lock()
+        # cProfile admite un solo perfilador activo a la vez
+        self._profile_lock = threading.Lock()
+
+    def enable(self, profile=False):
+        self.enabled = True
+        self.profile = bool(profile)
+
+    def configure(self, argv=()):
+        """Activar con --trace / --trace-profile o con la variable de entorno ZKTECO_TRACE"""
+        env = os.environ.get(TRACE_ENV, '').strip().lower()
+        profile = '--trace-profile' in argv or env == 'profile'
+        if profile or '--trace' in argv or env in ('1', 'true'):
+            self.enable(profile)
+        return self.enabled
+
+    def span(self, name, category='sync', **args):
+        if not self.enabled:
+            return NO_SPAN
+        return Span(self, name, category, args)
+
+    @contextmanager
+    def profiled(self, name):
+        """Perfil cProfile del bloque si se pidió --trace-profile (uno a la vez; los demás se omiten)"""
+        if not self.profile or not self._profile_lock.acquire(blocking=False):
+            yield
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+            with self._lock:
+                self._profiles.append((name, profiler))
+        finally:
+            self._profile_lock.release()
+
+    def _add(self, span, end):
+        thread = threading.current_thread()
+        event = {
+            'name': span.name,
+            'cat': span.category,
+            'ph': 'X',
+            'ts': round((span.start - self._origin) * 1e6, 1),
+            'dur': round((end - span.start) * 1e6, 1),
+            'pid': os.getpid(),
+            'tid': thread.ident,
+            'args': span.args,
+        }
+        with self._lock:
+            if len(self._events) >= MAX_EVENTS:
+                self._dropped += 1
+                return
+            self._events.append(event)
+            self._threads.setdefault(thread.ident, thread.name)
+
+    def flush(self, label='sync', log=print):
+        """Escribir la traza, el resumen y el perfil en logs/ y empezar de cero; devuelve la ruta de la traza"""
+        with self._lock:
+            events, self._events = self._events, []
+            threads, self._threads = self._threads, {}
+            profiles, self._profiles = self._profiles, []
+            dropped, self._dropped = self._dropped, 0
+        if not events:
+            return None
+
+        os.makedirs(LOGS_DIR, exist_ok=True)
+        base = os.path.join(LOGS_DIR, f"trace-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{label}")
+        pid = os.getpid()
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                    for tid, name in threads.items()]
+        with open(base + '.json', 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+
+        lines = summary_table(events)
+        if dropped:
+            lines.append(f"({dropped} tramos descartados al superar {MAX_EVENTS})")
+        if profiles:
+            stats = pstats.Stats(profiles[0][1])
+            for _, profiler in profiles[1:]:
+                stats.add(profiler)
+            stats.dump_stats(base + '.prof')
+            lines.append(f"Perfil de {', '.join(sorted({name for name, _ in profiles}))}: {base}.prof "
+                         f"(python -m pstats o snakeviz)")
+        with open(base + '-resumen.txt', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+        log(f"Traza guardada en {base}.json (resumen en {base}-resumen.txt)")
+        return base + '.json'
+
+
+def summary_table(events):
+    """Tabla por etapa: veces, tiempo total, medio y máximo, registros y bytes"""
+    stages = {}
+    for event in events:
+        stage = stages.setdefault(event['name'], {'count': 0, 'total': 0.0, 'max': 0.0, 'records': 0, 'bytes': 0})
+        stage['count'] += 1
+        stage['total'] += event['dur']
+        stage['max'] = max(stage['max'], event['dur'])
+        stage['records'] += int(event['args'].get('registros') or 0)
+        stage['bytes'] += int(event['args'].get('bytes') or 0)
+
+    lines = [f"{'Etapa':<16}{'Veces':>8}{'Total (s)':>12}{'Media (ms)':>12}{'Máx (ms)':>12}{'Registros':>12}{'Bytes':>14}"]
+    for name, stage in sorted(stages.items(), key=lambda item: -item[1]['total']):
+        lines.append(f"{name:<16}{stage['count']:>8}{stage['total'] / 1e6:>12.3f}"
+                     f"{stage['total'] / stage['count'] / 1e3:>12.2f}{stage['max'] / 1e3:>12.2f}"
+                     f"{stage['records']:>12}{stage['bytes']:>14}")
+    return lines
+
+
+# Trazador del proceso; desactivado salvo --trace o ZKTECO_TRACE
+TRACER = Tracer()
+TRACER.configure()
+span = TRACER.span
+profiled = TRACER.profiled
@@ -0,0 +1,296 @@
+import gzip
+import time
+from urllib.parse import urljoin
+
+from circuit_breaker import CLOSED, TargetHealth
+from http_client import CONNECTION_ERRORS, TIMEOUT_ERRORS, get_client
+from metrics import ENCODE_SECONDS, UPLOAD_BYTES, UPLOAD_FAILURES, UPLOAD_RECORDS, UPLOAD_RETRIES, UPLOAD_SECONDS
+from records import encode_columnar, encode_record, iter_chunks
+from settings import load_settings
+from sync_cursor import record_position
+from tracing import span
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+# Códigos HTTP que justifican reintentar un lote
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+# Códigos con los que el servidor rechaza los datos del lote (no la configuración): partiendo
+# el lote se aíslan los registros inválidos y el resto se entrega
+REJECTED_STATUS = {400, 409, 413, 422}
+
+# Códigos con los que el servidor rechaza una codificación que no soporta. 415 es inequívoco;
+# 400 también puede ser un registro inválido, así que solo cuenta si el JSON plano sí pasa
+UNSUPPORTED_ENCODING_STATUS = {400, 415}
+
+COLUMNAR_CONTENT_TYPE = 'application/vnd.zkteco.columnar+json'
+
+# Cabecera con el dispositivo de origen, para que el servidor pueda resumir por dispositivo
+DEVICE_HEADER = 'X-ZKTeco-Device'
+
+
+def encode_chunk(chunk, payload_format='json'):
+    """Codificar un lote: array JSON (el formato original que espera Laravel) o columnar"""
+    if payload_format == 'columnar':
+        return encode_columnar(chunk).encode('utf-8')
+    return ('[' + ','.join(encode_record(r) for r in chunk) + ']').encode('utf-8')
+
+
+def compress_body(body, codec):
+    """Comprimir el cuerpo según Content-Encoding ('gzip' o 'zstd')"""
+    if codec == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    return body
+
+
+class UploadResult:
+    """Resultado de un envío por lotes"""
+
+    def __init__(self):
+        self.total_chunks = 0
+        self.sent_chunks = 0
+        self.sent_records = 0
+        self.bytes_sent = 0
+        self.failed_chunks = []
+        # Lotes cuyos datos rechazó el servidor (REJECTED_STATUS): índice -> mensaje
+        self.rejected_chunks = {}
+        # Último registro del prefijo de lotes confirmados sin huecos
+        self.confirmed_upto = None
+        self._chunk_max = {}
+        self._next_index = 0
+
+    @property
+    def ok(self):
+        return self.total_chunks > 0 and not self.failed_chunks
+
+    def __bool__(self):
+        return self.ok
+
+    def _mark_confirmed(self, index, chunk):
+        self._chunk_max[index] = max(chunk, key=record_position)
+        # Avanzar el prefijo contiguo: un lote fallido bloquea los posteriores
+        while self._next_index in self._chunk_max:
+            record = self._chunk_max.pop(self._next_index)
+            if self.confirmed_upto is None or record_position(record) > record_position(self.confirmed_upto):
+                self.confirmed_upto = record
+            self._next_index += 1
+
+
+class CloudUploader:
+    """Envío por lotes a la API de Laravel con reintento solo de los lotes fallidos"""
+
+    def __init__(self, log=print, settings=None, client=None, roster=None):
+        self.log = log
+        self.settings = settings or load_settings()
+        self.client = client or get_client()
+        # Padrón de usuarios (UserRoster) para agregar nombre, privilegio y tarjeta a cada registro
+        self.roster = roster
+        self.batch_size = max(1, int(self.settings['upload_batch_size']))
+        self.timeout = self.settings['upload_timeout']
+        # Latencias y circuit breaker de la API: timeout adaptativo con upload_timeout como máximo
+        self.health = TargetHealth('API', self.settings, self.settings['upload_timeout_min'], self.timeout,
+                                   self.settings['upload_circuit_cooldown_min'],
+                                   self.settings['upload_circuit_cooldown_max'], kind='api', label='api', log=log)
+        self.max_retries = int(self.settings['upload_max_retries'])
+        # Endpoints que rechazaron compresión/columnar: se vuelve al JSON original
+        self._plain_endpoints = set()
+
+    def build_url(self, endpoint):
+        return urljoin(self.settings['api_base_url'], endpoint)
+
+    def endpoint_options(self, endpoint):
+        """Compresión y formato configurados para el endpoint (upload_endpoints en settings.json)"""
+        if endpoint in self._plain_endpoints:
+            return None, 'json'
+        options = {
+            'compression': self.settings['upload_compression'],
+            'format': self.settings['upload_format'],
+        }
+        options.update(self.settings['upload_endpoints'].get(endpoint, {}))
+        compression = options['compression'] or None
+        if compression == 'zstd' and not ZSTD_AVAILABLE:
+            compression = 'gzip'
+        return compression, options['format'] or 'json'
+
+    def encode(self, endpoint, chunk, device_id='', plain=False):
+        """Cuerpo y cabeceras de un lote según la configuración del endpoint (plain: JSON sin comprimir)"""
+        compression, payload_format = (None, 'json') if plain else self.endpoint_options(endpoint)
+        if self.roster is not None:
+            chunk = self.roster.enrich(device_id, chunk)
+        headers = {
+            'Content-Type': COLUMNAR_CONTENT_TYPE if payload_format == 'columnar' else 'application/json',
+            'Accept': 'application/json',
+        }
+        if device_id:
+            headers[DEVICE_HEADER] = str(device_id)
+        body = encode_chunk(chunk, payload_format)
+        if compression:
+            body = compress_body(body, compression)
+            headers['Content-Encoding'] = compression
+        return body, headers
+
+    def post_chunk(self, url, endpoint, chunk, device_id='', plain=False):
+        """Enviar un lote; devuelve (ok, reintentable, mensaje, bytes enviados).
+
+        reintentable es None cuando el servidor rechazó los datos (REJECTED_STATUS): no se
+        reintenta igual, pero el lote se puede partir para aislar los registros inválidos.
+        """
+        if not self.health.allow():
+            # Circuito abierto: no se ocupa un hilo esperando a una API que no responde
+            return False, True, f"API sin respuesta; próximo intento en {self.health.retry_in():.0f}s", 0
+        with ENCODE_SECONDS.time(device=device_id), span('codificacion', dispositivo=device_id) as current:
+            body, headers = self.encode(endpoint, chunk, device_id, plain)
+            current.set(registros=len(chunk), bytes=len(body))
+        timeout = self.health.timeout()
+        started = time.monotonic()
+        try:
+            with UPLOAD_SECONDS.time(device=device_id), span('envio', dispositivo=device_id, bytes=len(body)) as current:
+                response = self.client.post(url, data=body, headers=headers, timeout=timeout)
+                current.set(estado=response.status_code)
+        except TIMEOUT_ERRORS:
+            self.health.failure()
+            return False, True, f"Timeout ({timeout}s)", 0
+        except CONNECTION_ERRORS:
+            self.health.failure()
+            return False, True, "Error de conexión con el servidor", 0
+        if response.status_code >= 500 or response.status_code in (408, 429):
+            self.health.failure()
+        else:
+            self.health.success(time.monotonic() - started)
+
+        if response.status_code in UNSUPPORTED_ENCODING_STATUS and not plain \
+                and (headers.get('Content-Encoding') or headers['Content-Type'] != 'application/json'):
+            # Negociación: se repite el lote en JSON plano y el endpoint queda en JSON plano si el
+            # servidor no entiende la codificación (415, o un 400 que en JSON plano sí se acepta)
+            result = self.post_chunk(url, endpoint, chunk, device_id, plain=True)
+            if response.status_code == 415 or result[0]:
+                self._plain_endpoints.add(endpoint)
+                self.log(f"El servidor no acepta compresión/columnar en {endpoint}; se usa JSON sin comprimir")
+            return result
+
+        if 200 <= response.status_code < 300:
+            try:
+                response_data = response.json()
+                if isinstance(response_data, dict) and 'message' in response_data:
+                    return True, False, response_data['message'], len(body)
+            except ValueError:
+                pass
+            return True, False, None, len(body)
+
+        try:
+            message = response.json().get('message', 'Error desconocido')
+        except (ValueError, AttributeError):
+            message = response.text[:200]
+        if response.status_code in REJECTED_STATUS:
+            retryable = None
+        else:
+            retryable = response.status_code in RETRYABLE_STATUS
+        return False, retryable, f"HTTP {response.status_code}: {message}", 0
+
+    def fetch_summary(self, endpoint, device_id, since, until, granularity='day'):
+        """Resumen por bucket que guarda el servidor: {bucket: {'count': n, 'hash': '…'}}.
+
+        GET <endpoint>?dispositivo=&desde=&hasta=&granularidad= debe responder {"buckets": {...}}
+        con el mismo cálculo que reconcile.summarize.
+        """
+        params = {'dispositivo': str(device_id), 'desde': since, 'hasta': until, 'granularidad': granularity}
+        response = self.client.get(self.build_url(endpoint), params=params,
+                                   headers={'Accept': 'application/json', DEVICE_HEADER: str(device_id)},
+                                   timeout=self.timeout)
+        if response.status_code != 200:
+            raise RuntimeError(f"El servidor no devolvió el resumen (HTTP {response.status_code})")
+        try:
+            buckets = response.json()['buckets']
+        except (ValueError, KeyError, TypeError):
+            raise RuntimeError("Respuesta de resumen inválida: se esperaba {\"buckets\": {...}}")
+        return buckets if isinstance(buckets, dict) else {}
+
+    def probe(self):
+        """Sondear la API si su circuito está abierto y ya pasó la espera (desde el hilo de la cola)"""
+        if not self.health.probe_due() or not self.health.allow():
+            return
+        started = time.monotonic()
+        try:
+            response = self.client.get(self.settings['api_base_url'], timeout=self.health.timeout())
+        except TIMEOUT_ERRORS + CONNECTION_ERRORS:
+            self.health.failure()
+            return
+        # Cualquier respuesta que no sea un error del servidor indica que la API volvió
+        if response.status_code >= 500:
+            self.health.failure()
+        else:
+            self.health.success(time.monotonic() - started)
+
+    def upload(self, records, endpoint, total_records=None, progress=None, device_id=''):
+        """Enviar los registros en lotes a medida que se leen del iterable"""
+        url = self.build_url(endpoint)
+        result = UploadResult()
+        retry_queue = []
+
+        compression, payload_format = self.endpoint_options(endpoint)
+        self.log(f"Enviando a: {url} (lotes de {self.batch_size}, {payload_format}{'+' + compression if compression else ''})")
+
+        for index, chunk in enumerate(iter_chunks(records, self.batch_size)):
+            result.total_chunks += 1
+            ok, retryable, message, size = self.post_chunk(url, endpoint, chunk, device_id)
+            self._handle_chunk(result, index, chunk, ok, message, size, total_records, progress, device_id)
+            if not ok:
+                if retryable:
+                    retry_queue.append((index, chunk))
+                else:
+                    result.failed_chunks.append(index)
+                    if retryable is None:
+                        result.rejected_chunks[index] = message
+
+        # Reintentar únicamente los lotes fallidos, con espera exponencial
+        for attempt in range(1, self.max_retries + 1):
+            if not retry_queue:
+                break
+            if self.health.state != CLOSED:
+                # Con el circuito abierto la cola local reintenta cuando la API vuelva a responder
+                break
+            delay = 2 ** attempt
+            self.log(f"Reintentando {len(retry_queue)} lote(s) en {delay}s (intento {attempt}/{self.max_retries})")
+            time.sleep(delay)
+
+            pending, retry_queue = retry_queue, []
+            for index, chunk in pending:
+                UPLOAD_RETRIES.inc(device=device_id)
+                ok, retryable, message, size = self.post_chunk(url, endpoint, chunk, device_id)
+                self._handle_chunk(result, index, chunk, ok, message, size, total_records, progress, device_id)
+                if not ok:
+                    if retryable:
+                        retry_queue.append((index, chunk))
+                    else:
+                        result.failed_chunks.append(index)
+                        if retryable is None:
+                            result.rejected_chunks[index] = message
+
+        result.failed_chunks.extend(index for index, _ in retry_queue)
+        result.failed_chunks.sort()
+        return result
+
+    def _handle_chunk(self, result, index, chunk, ok, message, size, total_records, progress, device_id=''):
+        if ok:
+            UPLOAD_RECORDS.inc(len(chunk), device=device_id)
+            UPLOAD_BYTES.inc(size, device=device_id)
+            result.sent_chunks += 1
+            result.sent_records += len(chunk)
+            result.bytes_sent += size
+            result._mark_confirmed(index, chunk)
+            total_text = f"/{total_records}" if total_records is not None else ""
+            self.log(f"  ✓ Lote {index + 1} enviado ({result.sent_records}{total_text} registros, {size / 1024:.1f} KB)")
+            if message:
+                self.log(f"    - Respuesta: {message}")
+        else:
+            UPLOAD_FAILURES.inc(device=device_id)
+            self.log(f"  ✗ Lote {index + 1} falló: {message}")
+
+        if progress:
+            progress(index, chunk, ok, result)
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+
+from records import ENRICHED_FIELDS
+from settings import USER_ROSTER_PATH, load_settings
+
+
+def device_signature(conn):
+    """Contadores de read_sizes (un paquete): cambian al agregar o quitar usuarios, tarjetas o huellas"""
+    conn.read_sizes()
+    return [conn.users, conn.cards, conn.fingers, conn.faces]
+
+
+def roster_checksum(users):
+    """Huella del padrón descargado, para saber si realmente cambió"""
+    digest = hashlib.sha1()
+    for user_id in sorted(users):
+        user = users[user_id]
+        digest.update(f"{user_id}\x1f{user['name']}\x1f{user['privilege']}\x1f{user['card']}\x1e".encode('utf-8'))
+    return digest.hexdigest()
+
+
+class UserRoster:
+    """Padrón de usuarios por dispositivo, cacheado en disco y descargado solo cuando cambia.
+
+    Antes de cada lectura se comparan los contadores del dispositivo (read_sizes) con los del
+    padrón guardado; la lista completa se vuelve a descargar solo si difieren o si el padrón
+    tiene más de user_roster_max_age segundos (un cambio de nombre no altera los contadores).
+    """
+
+    def __init__(self, path=USER_ROSTER_PATH, settings=None, log=print):
+        self.path = path
+        self.log = log
+        self.settings = settings or load_settings()
+        self.max_age = float(self.settings['user_roster_max_age'])
+        self._lock = threading.Lock()
+        self._rosters = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        # Escritura atómica, como la marca de agua
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._rosters, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def refresh(self, device_id, conn, force=False):
+        """Actualizar el padrón con la conexión abierta si el dispositivo cambió; devuelve True si se descargó"""
+        device_id = str(device_id)
+        signature = device_signature(conn)
+        with self._lock:
+            cached = self._rosters.get(device_id)
+        if not force and cached and cached['firma'] == signature and self._age(cached) < self.max_age:
+            return False
+
+        users = {
+            str(user.user_id): {'name': user.name, 'privilege': user.privilege, 'card': user.card}
+            for user in conn.get_users()
+        }
+        checksum = roster_checksum(users)
+        with self._lock:
+            changed = not cached or cached['checksum'] != checksum
+            self._rosters[device_id] = {
+                'firma': signature,
+                'checksum': checksum,
+                'actualizado': datetime.now().isoformat(timespec='seconds'),
+                'usuarios': users,
+            }
+            self._save()
+        if changed:
+            self.log(f"Padrón de usuarios del dispositivo {device_id} actualizado: {len(users)} usuarios")
+        return True
+
+    @staticmethod
+    def _age(cached):
+        try:
+            return (datetime.now() - datetime.fromisoformat(cached['actualizado'])).total_seconds()
+        except (KeyError, ValueError):
+            return float('inf')
+
+    def users(self, device_id):
+        with self._lock:
+            return dict(self._rosters.get(str(device_id), {}).get('usuarios', {}))
+
+    def enrich(self, device_id, chunk):
+        """Registros del lote con nombre, privilegio y tarjeta del usuario (None si no está en el padrón)"""
+        with self._lock:
+            users = self._rosters.get(str(device_id), {}).get('usuarios', {})
+        empty = dict.fromkeys(ENRICHED_FIELDS)
+        enriched = []
+        for record in chunk:
+            record = record.to_dict() if hasattr(record, 'to_dict') else dict(record)
+            record.update(users.get(str(record['id']), empty))
+            enriched.append(record)
+        return enriched
+
+
+def open_roster(log=print, settings=None):
+    """UserRoster si el enriquecimiento está activado (upload_enrich_users), si no None"""
+    settings = settings or load_settings()
+    if not settings['upload_enrich_users']:
+        return None
+    return UserRoster(settings=settings, log=log)
@@ -1,54 +1,147 @@
 import threading
-import socket
-import requests
+import random
+import time
 import sys
 from datetime import datetime
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
+from http_client import CONNECTION_ERRORS, get_client
+from outbox import Outbox, OutboxDrainer, register_outbox_routes
+from sync_cursor import SyncCursor, device_key
+from sync_engine import SyncEngine, load_devices
+from uploader import CloudUploader
+from settings import load_settings
+from live_capture import LiveCapture
+from server_lock import detect_server, remove_lock, request_drain, write_lock
+from status_server import StatusServer
+from event_log import setup_logging
+from records import parse_window_bound
+from sync_jobs import SyncJobQueue, register_job_routes
+from attendance_store import open_store, register_attendance_routes
+from reconcile import register_reconcile_routes
+from user_roster import open_roster
+import metrics
+import tracing
+
+class SyncScheduler:
+    """Sincronización periódica de cada dispositivo con desfase aleatorio (jitter)"""
+
+    def __init__(self, engine, interval, jitter, log=print, clear_after_upload=False):
+        self.engine = engine
+        self.log = log
+        self.clear_after_upload = clear_after_upload
+        self.interval = interval
+        self.jitter = jitter
+        self.next_runs = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _next_delay(self):
+        return max(1.0, self.interval + random.uniform(-self.jitter, self.jitter))
+
+    def start(self):
+        # Primera ejecución repartida en la ventana de jitter para no disparar todos a la vez
+        now = time.monotonic()
+        for device in self.engine.devices:
+            self.next_runs[device_key(device)] = now + random.uniform(0, max(self.jitter, 1))
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self.log(f"✓ Sincronización programada cada {self.interval}s (±{self.jitter}s)")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            due = [d for d in self.engine.devices if self.next_runs[device_key(d)] <= now]
+            if due:
+                try:
+                    ran = self.engine.run_all(devices=due, clear_after_upload=self.clear_after_upload)
+                except Exception as e:
+                    self.log(f"✗ Error en sincronización programada: {e}")
+                    ran = True
+                
+                if ran:
+                    for device in due:
+                        self.next_runs[device_key(device)] = time.monotonic() + self._next_delay()
+                else:
+                    # Hay una sincronización manual en curso; reintentar en breve
+                    self._stop.wait(5)
+                    continue
+            
+            wait_time = min(self.next_runs.values()) - time.monotonic()
+            self._stop.wait(max(0.5, wait_time))
 
 class ZKTecoServer:
-    def __init__(self):
+    def __init__(self, log=print):
+        self.log = log
         self.flask_app = None
+        self.status_server = None
         self.flask_thread = None
         self.service_running = False
+        self.engine = None
+        self.scheduler = None
+        self.jobs = None
+        self.store = None
+        self.live_captures = {}
         
         # Verificar si el servicio ya está ejecutándose
         self.check_service_status()
         
         # Solo iniciar servidor Flask si el servicio NO está corriendo
         if not self.service_running:
+            self.init_sync_engine()
             self.init_flask_server()
         else:
-            print("Servicio ZKTeco ya está ejecutándose en puerto 3322")
+            self.log("Servicio ZKTeco ya está ejecutándose en puerto 3322")
 
     def check_service_status(self):
-        """Verificar si el servicio ya está ejecutándose en el puerto 3322"""
+        """Verificar si ya hay un servidor en el puerto 3322 (archivo de bloqueo y sondeo local)"""
+        server = detect_server()
+        self.service_running = server is not None
+        if server and server.get('tipo'):
+            self.log(f"Servidor ZKTeco detectado ejecutándose ({server['tipo']}, PID {server['pid']})")
+        elif server:
+            self.log("Puerto 3322 está en uso (posiblemente por el servicio)")
+        return self.service_running
+
+    def init_sync_engine(self):
+        """Preparar el motor de sincronización con los dispositivos de config/device.json"""
         try:
-            # Intentar hacer una petición al servicio
-            response = requests.get('http://127.0.0.1:3322/estado', timeout=2)
-            if response.status_code == 200:
-                data = response.json()
-                # Verificar si es el servicio (no la aplicación GUI)
-                if data.get('tipo') == 'servicio_windows':
-                    self.service_running = True
-                    print("Servicio ZKTeco detectado ejecutándose")
-                    return True
-        except:
-            pass
+            devices = load_devices()
+        except (OSError, ValueError) as e:
+            self.log(f"ADVERTENCIA: Sin dispositivos configurados: {e}")
+            return
         
-        # También verificar si el puerto está en uso
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                result = s.connect_ex(('127.0.0.1', 3322))
-                if result == 0:
-                    self.service_running = True
-                    print("Puerto 3322 está en uso (posiblemente por el servicio)")
-                    return True
-        except:
-            pass
+        cursor = SyncCursor()
+        outbox = Outbox()
+        roster = open_roster(log=self.log)
+        drainer = OutboxDrainer(outbox, CloudUploader(log=self.log, roster=roster), cursor, log=self.log)
+        drainer.start()
+        self.store = open_store(log=self.log)
+        self.engine = SyncEngine(outbox, drainer, cursor, devices=devices, log=self.log, store=self.store,
+                                 roster=roster)
+        self.jobs = SyncJobQueue(self.engine, log=self.log)
+        self.log(f"✓ {len(devices)} dispositivo(s) configurado(s)")
         
-        self.service_running = False
-        return False
+        settings = load_settings()
+        interval = get_interval_arg(settings['sync_interval'])
+        if interval > 0 and devices:
+            self.scheduler = SyncScheduler(self.engine, interval, float(settings['sync_jitter']), log=self.log,
+                                           clear_after_upload=bool(settings['device_clear_after_upload']))
+            self.scheduler.start()
+        
+        # Captura en tiempo real para los dispositivos que la tengan activada
+        for device in devices:
+            enabled = device['live_capture'] if device['live_capture'] is not None else settings['live_capture']
+            if enabled:
+                capture = LiveCapture(device, outbox, drainer, log=self.log, store=self.store)
+                try:
+                    capture.start()
+                    self.live_captures[device_key(device)] = capture
+                except RuntimeError as e:
+                    self.log(f"✗ Captura en tiempo real no disponible: {e}")
 
     def init_flask_server(self):
         """Inicializar servidor Flask para verificación remota"""
@@ -77,36 +170,116 @@ class ZKTecoServer:
                     'puerto': 3322
                 })
             
+            # Resultado de la última sincronización por dispositivo
+            @self.flask_app.route('/dispositivos', methods=['GET'])
+            def dispositivos():
+                if not self.engine:
+                    return jsonify({'error': 'No hay dispositivos configurados'}), 404
+                
+                results = self.engine.get_results()
+                # Registros que el servidor rechazó y quedaron apartados de la cola
+                for key, count in self.engine.outbox.dead_letter_by_device():
+                    results.setdefault(key, {'estado': 'sin_sincronizar'})['rechazados'] = count
+                # Timeout adaptativo y estado del circuito de cada dispositivo
+                for key, health in self.engine.pool.health().items():
+                    results.setdefault(key, {'estado': 'sin_sincronizar'})['salud'] = health
+                for key, capture in self.live_captures.items():
+                    results.setdefault(key, {'estado': 'sin_sincronizar'})['tiempo_real'] = capture.status()
+                if self.scheduler:
+                    now = time.monotonic()
+                    for key, next_run in self.scheduler.next_runs.items():
+                        results.setdefault(key, {'estado': 'sin_sincronizar'})['proxima_en'] = max(0, round(next_run - now))
+                return jsonify({
+                    'sincronizando': self.engine.running,
+                    'intervalo': self.scheduler.interval if self.scheduler else None,
+                    'ultima_sincronizacion': self.engine.last_run,
+                    'pendientes_envio': self.engine.outbox.pending_count(),
+                    'rechazados_envio': self.engine.outbox.dead_letter_count(),
+                    'api': self.engine.drainer.uploader.health.status(),
+                    'dispositivos': [
+                        dict(results.get(key, {'estado': 'sin_sincronizar'}), id=key, nombre=device['name'], ip=device['ip_address'])
+                        for key, device in ((device_key(d), d) for d in self.engine.devices)
+                    ]
+                })
+            
+            # Lanzar una sincronización de todos los dispositivos
+            @self.flask_app.route('/sincronizar', methods=['POST'])
+            def sincronizar():
+                if not self.engine:
+                    return jsonify({'error': 'No hay dispositivos configurados'}), 404
+                
+                incremental = request.args.get('completa') not in ('1', 'true')
+                try:
+                    # Rango opcional ?desde=2024-05-01&hasta=2024-05-31 y vaciado con ?limpiar=1
+                    options = {
+                        'since': parse_window_bound(request.args.get('desde')),
+                        'until': parse_window_bound(request.args.get('hasta'), end=True),
+                        'clear_after_upload': request.args.get('limpiar') in ('1', 'true'),
+                    }
+                    started = self.engine.start_background(incremental=incremental, **options)
+                except ValueError as e:
+                    return jsonify({'error': str(e)}), 400
+                if not started:
+                    return jsonify({'message': 'Ya hay una sincronización en curso'}), 409
+                return jsonify({'message': 'Sincronización iniciada'}), 202
+            
+            # Cancelar la sincronización en curso
+            @self.flask_app.route('/sincronizar/cancelar', methods=['POST'])
+            def cancelar_sincronizacion():
+                if not self.engine:
+                    return jsonify({'error': 'No hay dispositivos configurados'}), 404
+                
+                if not self.engine.cancel():
+                    return jsonify({'message': 'No hay una sincronización en curso'}), 409
+                return jsonify({'message': 'Sincronización cancelada'})
+            
+            # Trabajos de sincronización por dispositivo (encolar, consultar avance y cancelar)
+            if self.jobs:
+                register_job_routes(self.flask_app, self.jobs)
+            
+            # Consulta de marcaciones desde la copia local (sin leer el dispositivo)
+            register_attendance_routes(self.flask_app, self.store)
+            
+            # Conciliación por buckets con el resumen del servidor
+            if self.engine:
+                register_reconcile_routes(self.flask_app, self.engine)
+                # Otros procesos (la interfaz, el comando sync) encolan y piden aquí el envío
+                register_outbox_routes(self.flask_app, self.engine.drainer)
+            
+            # Métricas por dispositivo y etapa en formato Prometheus
+            @self.flask_app.route('/metrics', methods=['GET'])
+            def metricas():
+                outbox = self.engine.outbox if self.engine else None
+                return Response(metrics.render(outbox), mimetype=metrics.CONTENT_TYPE)
+            
             # Ruta para cerrar servidor
             @self.flask_app.route('/shutdown', methods=['POST'])
             def shutdown():
-                func = request.environ.get('werkzeug.server.shutdown')
-                if func is None:
-                    raise RuntimeError('Not running with the Werkzeug Server')
-                func()
+                # Se detiene después de responder; las peticiones en curso terminan antes
+                self.status_server.stop_async()
                 return jsonify({'message': 'Server shutting down...'})
             
+            # Servidor embebido con pool de hilos acotado (el socket se abre ya)
+            self.status_server = StatusServer(self.flask_app, log=self.log)
+            
             def iniciar_servidor():
                 try:
-                    self.flask_app.run(
-                        port=3322, 
-                        host='127.0.0.1', 
-                        debug=False, 
-                        use_reloader=False,
-                        threaded=True
-                    )
+                    write_lock('servidor_standalone')
+                    self.status_server.serve_forever()
                 except Exception as e:
-                    print(f"Error iniciando servidor Flask: {e}")
+                    self.log(f"✗ Error iniciando servidor Flask: {e}")
+                finally:
+                    remove_lock()
             
             # Iniciar servidor en hilo separado
             self.flask_thread = threading.Thread(target=iniciar_servidor, daemon=False)
             self.flask_thread.start()
             
-            print("Iniciando servidor ZKTeco en puerto 3322...")
-            print("✓ Servidor ZKTeco iniciado exitosamente en http://127.0.0.1:3322")
+            self.log("Iniciando servidor ZKTeco en puerto 3322...")
+            self.log("✓ Servidor ZKTeco iniciado exitosamente en http://127.0.0.1:3322")
             
         except Exception as e:
-            print(f"Error configurando servidor Flask: {e}")
+            self.log(f"✗ Error configurando servidor Flask: {e}")
 
     def mantener_activo(self):
         """Mantener el servidor activo hasta que se ejecute el comando stop"""
@@ -120,24 +293,90 @@ class ZKTecoServer:
 def stop_server():
     """Detener el servidor remotamente"""
     try:
-        response = requests.post('http://127.0.0.1:3322/shutdown', timeout=2)
+        response = get_client().post('http://127.0.0.1:3322/shutdown', timeout=2)
         if response.status_code == 200:
             print("Servidor detenido exitosamente.")
         else:
             print("Error al detener el servidor.")
-    except requests.exceptions.ConnectionError:
+    except CONNECTION_ERRORS:
         print("El servidor no está ejecutándose o ya fue detenido.")
     except Exception as e:
         print(f"Error al intentar detener el servidor: {e}")
 
+def get_arg(name):
+    """Valor de un argumento --nombre valor, o None"""
+    for i, arg in enumerate(sys.argv):
+        if arg == name and i + 1 < len(sys.argv):
+            return sys.argv[i + 1]
+    return None
+
+def get_interval_arg(default):
+    """Intervalo de sincronización desde --interval N (segundos)"""
+    for i, arg in enumerate(sys.argv):
+        if arg == '--interval' and i + 1 < len(sys.argv):
+            try:
+                return float(sys.argv[i + 1])
+            except ValueError:
+                print(f"Intervalo inválido: {sys.argv[i + 1]}")
+    return float(default)
+
+def sync_once(log=print):
+    """Sincronizar todos los dispositivos una vez, sin servidor, y vaciar la cola"""
+    cursor = SyncCursor()
+    outbox = Outbox()
+    roster = open_roster(log=log)
+    # Si el servicio o la interfaz están en ejecución, la cola la vacía ese proceso: aquí solo se encola
+    owner = detect_server()
+    drainer = OutboxDrainer(outbox, CloudUploader(log=log, roster=roster), cursor, log=log,
+                            delegate=request_drain if owner else None)
+    engine = SyncEngine(outbox, drainer, cursor, log=log, store=open_store(log=log), roster=roster)
+    try:
+        options = {
+            'since': parse_window_bound(get_arg('--since')),
+            'until': parse_window_bound(get_arg('--until'), end=True),
+            'clear_after_upload': '--clear-after-upload' in sys.argv,
+        }
+        if '--reconcile' in sys.argv:
+            granularity = get_arg('--granularity') or engine.settings['reconcile_granularity']
+            for device in engine.devices:
+                try:
+                    engine.reconcile(device, granularity, repair='--dry-run' not in sys.argv)
+                except (RuntimeError, OSError) as e:
+                    log(f"  [{device_key(device)}] sin conciliar: {e}")
+        else:
+            engine.run_all(incremental='--full-sync' not in sys.argv, **options)
+    except ValueError as e:
+        log(f"✗ {e}")
+        return
+    
+    engine.pool.close_all()
+    
+    sent, pending = drainer.drain_once()
+    if owner:
+        log(f"Registros encolados: {pending} - los envía el servidor en ejecución (PID {owner.get('pid', '?')})")
+    else:
+        log(f"Registros enviados: {sent} - pendientes en cola local: {pending}")
+    # Envíos posteriores a la sincronización (reintentos de la cola, conciliación)
+    if tracing.TRACER.enabled:
+        tracing.TRACER.flush('sync', log=log)
+    for key, result in engine.get_results().items():
+        log(f"  [{key}] {result.get('nombre', '')}: {result.get('estado')} {result.get('error') or ''}")
+
 def main():
+    # Trazas por etapa con --trace / --trace-profile (o ZKTECO_TRACE=1 / profile)
+    tracing.TRACER.configure(sys.argv)
+    
     # Verificar argumentos de línea de comandos
     if len(sys.argv) > 1 and sys.argv[1] == 'stop':
         stop_server()
         return
     
+    if len(sys.argv) > 1 and sys.argv[1] == 'sync':
+        sync_once(setup_logging('servicio', console=True))
+        return
+    
     print("=== Servidor ZKTeco Standalone ===")
-    server = ZKTecoServer()
+    server = ZKTecoServer(log=setup_logging('servicio', console=True))
     
     if not server.service_running:
         server.mantener_activo()